@@ -1,8 +1,12 @@
+import argparse
 import sqlite3
 from fpdf import FPDF
 import hashlib
 import re
-from datetime import datetime, timedelta
+from datetime import datetime
+import instrumentation
+from profiling import ActionProfiler
+from forecasting import get_spending_model
 from database import (
     register_user,
     authenticate_user,
@@ -12,13 +16,39 @@ from database import (
     get_report,
     set_budget,
     get_budget,
+    get_budget_status,
+    get_category_subtrees,
     get_total_expenses,
     create_tables,
     create_budget_table,
     backup_data,
+    record_change,
+    apply_to_daily_balances,
+    enable_replica,
+    request_replica_refresh,
     generate_backup_pdf  # Ensure this is imported
 )
 
+# Profiler for menu actions, set by the --profile option
+action_profiler = None
+
+# Function to run a menu action, profiling it when profiling is enabled
+def run_action(action, func, *args):
+    """
+    Runs a menu action, under the action profiler if the app was started with --profile.
+    
+    Args:
+        action (str): The name of the action (used in the profile file names).
+        func (callable): The function implementing the action.
+        *args: Arguments passed to the function.
+    
+    Returns:
+        The return value of the function.
+    """
+    if action_profiler is None:
+        return func(*args)
+    return action_profiler.run(action, func, *args)
+
 # Function to set or update the budget for a user
 def set_user_budget(user_id):
     """
@@ -31,12 +61,12 @@ def set_user_budget(user_id):
         None
     """
     print("\n--- Set or Update Budget ---")
-    category = input("Enter budget category (e.g., Food, Rent, or 'total' for overall budget): ")
+    category = input("Enter budget category (e.g., Food, Food > Groceries, Rent, or 'total' for overall budget): ")
     amount = float(input(f"Enter the amount for the {category} budget: "))
     period = input("Enter the period ('monthly' or 'yearly'): ").lower()
 
     # Set or update the budget in the database
-    set_budget(user_id, category, amount, period)
+    run_action('set_budget', set_budget, user_id, category, amount, period)
     print(f"Budget for {category} in {period} set to {amount}.")
 
 # Function to view the user's budget and expenses comparison
@@ -52,37 +82,41 @@ def view_budget(user_id, period='monthly'):
     Returns:
         None
     """
-    conn = create_connection('finance.db')
-    cursor = conn.cursor()
-
-    # Fetch all budgets for the user for the specified period
-    cursor.execute("SELECT category, amount FROM budgets WHERE user_id = ? AND period = ?", (user_id, period))
-    budgets = cursor.fetchall()
+    # Fetch all budgets for the user with their expenses for the specified period
+    statuses = get_budget_status(user_id, period)
 
     print(f"\n--- Budget for {period} ---")
     
     budget_exceedance_found = False  # Track if any budget exceedance occurred
 
     # Check each budget category
-    for budget in budgets:
-        category, budget_amount = budget
-        # Fetch total expenses for each category in the specified period
-        cursor.execute('''SELECT SUM(amount) FROM transactions 
-                          WHERE user_id = ? AND category = ? AND type = 'expense' AND date LIKE ?''',
-                       (user_id, category, f"{datetime.now().year}-{datetime.now().month:02d}%" if period == 'monthly' else f"{datetime.now().year}%"))
-        total_expenses = cursor.fetchone()[0] or 0  # Default to 0 if no expenses
-
-        print(f"Category: {category}, Budget: {budget_amount}, Total Expenses: {total_expenses}")
+    for status in statuses:
+        category = status['category']
+        print(f"Category: {category}, Budget: {status['budget']}, Total Expenses: {status['total_expenses']}")
 
         # Check if expenses exceed the budget for each category
-        if total_expenses > budget_amount:
+        if status['exceeded']:
             print(f"Warning: You have exceeded your budget for {category}!")
             budget_exceedance_found = True
 
     if not budget_exceedance_found:
         print("You are within your budget for all categories.")
 
-    conn.close()
+    # Project the end-of-period spend for each budget, including its subcategories,
+    # and flag unusual expenses
+    model = get_spending_model(user_id)
+    forecasts = model.forecast(period)
+    subtrees = get_category_subtrees([status['category'] for status in statuses])
+    for status in statuses:
+        projections = [forecasts[category]['projected'] for category in subtrees.get(status['category'], [])
+                       if category in forecasts]
+        if projections and sum(projections) > status['budget']:
+            print(f"Forecast: {status['category']} is on track to reach {sum(projections):.2f} "
+                  f"against a budget of {status['budget']}.")
+
+    period_start = datetime.now().strftime("%Y-%m-01" if period == 'monthly' else "%Y-01-01")
+    for transaction_id, category, amount, date, _ in model.anomalies(since=period_start):
+        print(f"Unusual expense: ID {transaction_id}, {category} {amount} on {date}")
 
 # Function to connect to the database
 def create_connection(db_file='finance.db'):
@@ -95,7 +129,7 @@ def create_connection(db_file='finance.db'):
     Returns:
         sqlite3.Connection: The database connection object.
     """
-    conn = sqlite3.connect(db_file)
+    conn = instrumentation.connect(db_file)
     return conn
 
 # Function to validate the username format
@@ -202,59 +236,6 @@ def authenticate_user(username, password):
         print("Username not found!")
         return None
 
-# Function to generate a financial report (income vs expense)
-def get_report(user_id, period='monthly'):
-    """
-    Generates a financial report showing total income, total expenses, and savings for 
-    a specified period (monthly or yearly).
-    
-    Args:
-        user_id (int): The unique ID of the user for whom the report is generated.
-        period (str): The period for the report ('monthly' or 'yearly'). Default is 'monthly'.
-    
-    Returns:
-        dict: A dictionary containing income, expense, savings, start date, and end date for the report.
-    """
-    conn = create_connection('finance.db')
-    cursor = conn.cursor()
-    
-    # Get current month and year for report filtering
-    current_date = datetime.now()
-    if period == 'monthly':
-        start_date = current_date.replace(day=1).strftime("%Y-%m-%d")
-        end_date = (current_date + timedelta(days=1)).strftime("%Y-%m-%d")
-    elif period == 'yearly':
-        start_date = f"{current_date.year}-01-01"
-        end_date = f"{current_date.year}-12-31"
-    else:
-        raise ValueError("Period must be 'monthly' or 'yearly'")
-
-    # Fetch transactions within the specified period
-    cursor.execute('''SELECT SUM(amount), type FROM transactions
-                      WHERE user_id = ? AND date BETWEEN ? AND ? 
-                      GROUP BY type''', (user_id, start_date, end_date))
-
-    transactions = cursor.fetchall()
-    income = 0
-    expense = 0
-
-    for transaction in transactions:
-        if transaction[1] == 'income':
-            income = transaction[0] if transaction[0] else 0
-        elif transaction[1] == 'expense':
-            expense = transaction[0] if transaction[0] else 0
-
-    savings = income - expense
-    conn.close()
-
-    return {
-        'income': income,
-        'expense': expense,
-        'savings': savings,
-        'start_date': start_date,
-        'end_date': end_date
-    }
-
 def delete_transaction(conn, user_id, transaction_id):
     """ 
     Delete a transaction from the database by its ID and user ID.
@@ -267,12 +248,16 @@ def delete_transaction(conn, user_id, transaction_id):
     cursor = conn.cursor()
 
     # Check if the transaction belongs to the user
-    cursor.execute("SELECT * FROM transactions WHERE id = ? AND user_id = ?", (transaction_id, user_id))
+    cursor.execute("SELECT type, amount, date, currency FROM transactions WHERE id = ? AND user_id = ?",
+                   (transaction_id, user_id))
     transaction = cursor.fetchone()
 
     if transaction:
         # Delete the transaction if it belongs to the user
+        transaction_type, amount, date, currency = transaction
         cursor.execute("DELETE FROM transactions WHERE id = ?", (transaction_id,))
+        apply_to_daily_balances(cursor, user_id, transaction_type, amount, date, currency, sign=-1)
+        record_change(cursor, 'transactions', 'delete', transaction_id, user_id)
         conn.commit()
         print(f"Transaction {transaction_id} deleted successfully!")
     else:
@@ -339,37 +324,41 @@ def main_menu(user_id):
             amount = float(input("Enter income amount: "))
             description = input("Enter description: ")
             category = input("Enter category (e.g., Salary, Business): ")
-            add_transaction(conn, user_id, 'income', amount, description, category)  # Pass conn
+            run_action('add_income', add_transaction, conn, user_id, 'income', amount, description, category)  # Pass conn
             conn.commit()  # Ensure changes are committed
+            request_replica_refresh()  # Show the new transaction in reports without waiting for the next refresh
 
         elif choice == '2':  # Add Expense
             amount = float(input("Enter expense amount: "))
             description = input("Enter description: ")
-            category = input("Enter category (e.g., Food, Rent): ")
-            add_transaction(conn, user_id, 'expense', amount, description, category)  # Pass conn
+            category = input("Enter category (e.g., Food, Rent, or Food > Groceries for a subcategory): ")
+            run_action('add_expense', add_transaction, conn, user_id, 'expense', amount, description, category)  # Pass conn
             conn.commit()  # Ensure changes are committed
+            request_replica_refresh()
 
         elif choice == '3':  # View Transactions
             # print(f"User ID is {user_id}")  # Debugging line
-            view_transactions(conn, user_id)  # Pass both conn and user_id
+            run_action('view_transactions', view_transactions, conn, user_id)  # Pass both conn and user_id
 
         elif choice == '4':  # Delete Transaction
             transaction_id = int(input("Enter transaction ID to delete: "))
-            delete_transaction(conn, user_id, transaction_id)  # Pass conn and user_id
+            run_action('delete_transaction', delete_transaction, conn, user_id, transaction_id)  # Pass conn and user_id
+            request_replica_refresh()
 
         elif choice == '5':  # View Financial Report
             period = input("Enter period ('monthly' or 'yearly'): ").lower()
-            report = get_report(user_id, period)
+            report = run_action('view_report', get_report, user_id, period)
             print(report)
 
         elif choice == '6':  # Set/Update Budget
             set_user_budget(user_id)
+            request_replica_refresh()
 
         elif choice == '7':  # View Budget
-            view_budget(user_id)
+            run_action('view_budget', view_budget, user_id)
 
         elif choice == '8':  # Backup Database
-            generate_backup_pdf()  # Call the PDF backup function
+            run_action('backup_pdf', generate_backup_pdf)  # Call the PDF backup function
 
         elif choice == '9':  # Logout
             print("Logging out...")
@@ -383,6 +372,24 @@ def main_menu(user_id):
 
 # Start the main function
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Personal finance management")
+    parser.add_argument('--profile', metavar='DIR', help="Profile menu actions and write the results to DIR")
+    parser.add_argument('--profile-sample', type=float, default=1.0,
+                        help="Fraction of actions to profile (default: 1.0)")
+    parser.add_argument('--profile-top', type=int, default=20, help="Number of hotspots per profile (default: 20)")
+    parser.add_argument('--report-replica', action='store_true',
+                        help="Serve reports, budgets and backups from a snapshot copy of the database")
+    parser.add_argument('--replica-staleness', type=float, default=60.0,
+                        help="Maximum age in seconds of the report snapshot (default: 60)")
+    parser.add_argument('--replica-refresh', type=float, default=5.0,
+                        help="Refresh the report snapshot in the background every N seconds, and right "
+                             "after each change you make (default: 5)")
+    args = parser.parse_args()
+    if args.profile:
+        action_profiler = ActionProfiler(args.profile, args.profile_sample, args.profile_top)
+
     create_tables()  # Ensure tables are created
     create_budget_table()  # Ensure budget table exists
+    if args.report_replica:
+        enable_replica(max_staleness=args.replica_staleness, refresh_interval=args.replica_refresh)
     main()
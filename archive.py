@@ -0,0 +1,152 @@
+import argparse
+import os
+from datetime import datetime
+import database
+
+# Function to archive one closed year
+def archive_year(year, archive_dir='archive', vacuum=False):
+    """
+    Move a closed year's transactions from the hot database into the archive database,
+    leaving monthly rollups behind.
+
+    Archived years are tables ('transactions_<year>') in one archive database, not
+    separate files: SQLite attaches at most 10 databases to a connection, so a report
+    or rebuild spanning more archived years could not attach one file per year. The
+    archive file is backed up and moved as a whole; a single year can still be
+    dropped from it with DROP TABLE once its partition record is removed.
+
+    The change log entries of the moved rows go with them, into the archive database's
+    'change_log' table, so the hot database does not keep a JSON image of every
+    archived row. Export change data before archiving a year: entries moved to the
+    archive are no longer returned by database.iter_changes.
+
+    The copy, the rollups, the change log move, the delete from the hot table and the
+    partition record are committed in one transaction across both databases, so an
+    interrupted run leaves the year either fully hot or fully archived. Daily balances
+    are left untouched: archiving moves rows, it does not change the ledger.
+
+    Args:
+        year (int): The year to archive. Must be before the current year.
+        archive_dir (str): Directory for the archive database.
+        vacuum (bool): VACUUM the hot database afterwards to return the freed space.
+
+    Returns:
+        dict: The year, archive path and number of transactions moved.
+    """
+    if year >= datetime.now().year:
+        raise ValueError("Only closed years (before the current year) can be archived")
+
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.abspath(os.path.join(archive_dir, "archive.db"))
+    table_name = f"transactions_{year}"
+    conn = database.create_connection(database.DATABASE_FILE)
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT path FROM archive_partitions WHERE year = ?", (year,))
+    if cursor.fetchone():
+        conn.close()
+        raise ValueError(f"Year {year} is already archived")
+
+    cursor.execute("ATTACH DATABASE ? AS archive", (path,))
+    cursor.execute(f'''CREATE TABLE IF NOT EXISTS archive.{table_name} (
+                         id INTEGER PRIMARY KEY,
+                         user_id INTEGER,
+                         amount REAL,
+                         category TEXT,
+                         type TEXT,
+                         date TEXT,
+                         currency TEXT,
+                         category_id INTEGER
+                     )''')
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS archive.idx_{table_name}_user_date ON {table_name} (user_id, date)")
+    cursor.execute('''CREATE TABLE IF NOT EXISTS archive.change_log (
+                        seq INTEGER PRIMARY KEY,
+                        table_name TEXT NOT NULL,
+                        operation TEXT NOT NULL,
+                        row_id INTEGER NOT NULL,
+                        user_id INTEGER,
+                        data TEXT,
+                        changed_at TEXT NOT NULL
+                    )''')
+
+    year_filter = "date >= ? AND date < ?"
+    year_range = (f"{year}-01-01", f"{year + 1}-01-01")
+    try:
+        cursor.execute("BEGIN")
+        cursor.execute(f'''INSERT INTO archive.{table_name} ({database.ARCHIVE_COLUMNS})
+                           SELECT {database.ARCHIVE_COLUMNS} FROM main.transactions WHERE {year_filter}''', year_range)
+        moved = cursor.rowcount
+        cursor.execute(f'''INSERT OR REPLACE INTO transactions_rollup
+                               (user_id, year, month, category, type, currency, total, count)
+                           SELECT user_id, ?, CAST(substr(date, 6, 2) AS INTEGER), category, type, currency,
+                                  SUM(amount), COUNT(*)
+                           FROM main.transactions WHERE {year_filter}
+                           GROUP BY user_id, substr(date, 6, 2), category, type, currency''', (year,) + year_range)
+        moved_rows = f"SELECT id FROM main.transactions WHERE {year_filter}"
+        cursor.execute(f'''INSERT INTO archive.change_log
+                           SELECT seq, table_name, operation, row_id, user_id, data, changed_at FROM main.change_log
+                           WHERE table_name = 'transactions' AND row_id IN ({moved_rows})''', year_range)
+        cursor.execute(f'''DELETE FROM main.change_log
+                           WHERE table_name = 'transactions' AND row_id IN ({moved_rows})''', year_range)
+        cursor.execute(f"DELETE FROM main.transactions WHERE {year_filter}", year_range)
+        cursor.execute('''INSERT INTO archive_partitions (year, path, rows, archived_at) VALUES (?, ?, ?, ?)''',
+                       (year, path, moved, datetime.now().isoformat(timespec='seconds')))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.execute("DETACH DATABASE archive")
+
+    if vacuum:
+        cursor.execute("VACUUM")
+    conn.close()
+    return {'year': year, 'path': path, 'rows': moved}
+
+# Function to archive every closed year older than a cutoff
+def archive_closed_years(keep_years=1, archive_dir='archive', vacuum=True):
+    """
+    Archive all years that still have transactions in the hot database and are older
+    than the last keep_years closed years.
+
+    Args:
+        keep_years (int): Number of most recent closed years to keep hot.
+        archive_dir (str): Directory for the archive database.
+        vacuum (bool): VACUUM the hot database after archiving.
+
+    Returns:
+        list: One result per archived year, as returned by archive_year.
+    """
+    cutoff = datetime.now().year - keep_years
+    conn = database.create_connection(database.DATABASE_FILE)
+    cursor = conn.cursor()
+    cursor.execute('''SELECT DISTINCT CAST(substr(date, 1, 4) AS INTEGER) FROM transactions
+                      WHERE date < ? ORDER BY 1''', (f"{cutoff}-01-01",))
+    years = [row[0] for row in cursor.fetchall()]
+    conn.close()
+
+    results = [archive_year(year, archive_dir) for year in years]
+    if vacuum and results:
+        conn = database.create_connection(database.DATABASE_FILE)
+        conn.execute("VACUUM")
+        conn.close()
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Move closed years of transactions into the archive database.")
+    parser.add_argument('--db', default='finance.db', help="Hot database file (default: finance.db)")
+    parser.add_argument('--archive-dir', default='archive', help="Directory for the archive database")
+    parser.add_argument('--year', type=int, help="Archive only this year")
+    parser.add_argument('--keep-years', type=int, default=1, help="Closed years to keep in the hot database")
+    args = parser.parse_args()
+
+    database.DATABASE_FILE = args.db
+    database.create_tables()
+    if args.year:
+        results = [archive_year(args.year, args.archive_dir, vacuum=True)]
+    else:
+        results = archive_closed_years(args.keep_years, args.archive_dir)
+    for result in results:
+        print(f"Archived {result['rows']} transactions from {result['year']} to {result['path']}")
+    if not results:
+        print("Nothing to archive.")
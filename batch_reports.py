@@ -0,0 +1,308 @@
+import argparse
+import json
+import os
+import time
+from multiprocessing import Pool
+from sketches import DistinctCounter
+from database import (
+    create_readonly_connection,
+    get_all_user_ids,
+    get_report,
+    get_budget_status
+)
+
+# Read-only connection owned by each worker process, and whether the workers compute
+# per-category expense statistics (both set by _init_worker)
+worker_connection = None
+worker_statistics = False
+
+# Function to open the per-worker read-only connection
+def _init_worker(db_file, statistics=False):
+    """
+    Pool initializer: opens one read-only connection per worker process.
+
+    Args:
+        db_file (str): The database file path.
+        statistics (bool): Compute per-category expense statistics for each user.
+    """
+    global worker_connection, worker_statistics
+    worker_connection = create_readonly_connection(db_file)
+    worker_statistics = statistics
+
+# Function to build the reports for one chunk of users
+def _report_chunk(user_ids):
+    """
+    Compute the monthly and yearly reports and budget statuses for a chunk of users
+    using the worker's read-only connection. When the job computes statistics, each
+    user's rows also get per-category expense statistics, and the yearly statistics
+    of the chunk are merged into one set of sketches, with a distinct count of
+    spenders per category, so the parent can combine the chunks into a ledger-wide
+    summary. Otherwise the statistics returned are empty.
+
+    Args:
+        user_ids (list): The user IDs in this chunk.
+
+    Returns:
+        tuple: (worker process ID, elapsed seconds, list of report rows,
+        (SpendStatistics per category, DistinctCounter of users per category))
+    """
+    started = time.perf_counter()
+    rows = []
+    statistics = {}
+    spenders = {}
+    for user_id in user_ids:
+        monthly = get_report(user_id, 'monthly', conn=worker_connection, with_statistics=worker_statistics)
+        yearly = get_report(user_id, 'yearly', conn=worker_connection,
+                            statistics=statistics if worker_statistics else None)
+        row = {
+            'user_id': user_id,
+            'currency': monthly['currency'],
+            'monthly_income': monthly['income'],
+            'monthly_expense': monthly['expense'],
+            'monthly_savings': monthly['savings'],
+            'yearly_income': yearly['income'],
+            'yearly_expense': yearly['expense'],
+            'yearly_savings': yearly['savings'],
+            'monthly_budgets': get_budget_status(user_id, 'monthly', conn=worker_connection),
+            'yearly_budgets': get_budget_status(user_id, 'yearly', conn=worker_connection)
+        }
+        if worker_statistics:
+            row['monthly_category_stats'] = monthly['category_stats']
+            row['yearly_category_stats'] = yearly['category_stats']
+            for category in yearly['category_stats']:
+                spenders.setdefault(category, DistinctCounter()).add(user_id)
+        rows.append(row)
+    return os.getpid(), time.perf_counter() - started, rows, (statistics, spenders)
+
+# Function to split the user IDs into chunks for the pool
+def chunk_user_ids(user_ids, chunk_size):
+    """
+    Split a list of user IDs into consecutive chunks.
+
+    Args:
+        user_ids (list): The user IDs to split.
+        chunk_size (int): Maximum number of users per chunk.
+
+    Returns:
+        list: A list of lists of user IDs.
+    """
+    return [user_ids[i:i + chunk_size] for i in range(0, len(user_ids), chunk_size)]
+
+class JsonlReportWriter:
+    """
+    Streams report rows to a JSON Lines file, one user per line.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w')
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.file.write(json.dumps(row) + "\n")
+
+    def close(self):
+        self.file.close()
+
+class ChunkedReportWriter:
+    """
+    Streams report rows to a JSON Lines file with one line per chunk, holding an array
+    of values per field (e.g. {"num_rows": 2, "columns": {"user_id": [1, 2], ...}}).
+    Field names are written once per chunk instead of once per row; the file is
+    still JSON text, read back whole lines at a time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w')
+
+    def write_rows(self, rows):
+        if not rows:
+            return
+        columns = {name: [row[name] for row in rows] for name in rows[0]}
+        self.file.write(json.dumps({'num_rows': len(rows), 'columns': columns}) + "\n")
+
+    def close(self):
+        self.file.close()
+
+# Function to read a chunked report file back into rows
+def read_chunked_report(path):
+    """
+    Read a file written by ChunkedReportWriter back into a list of row dictionaries.
+
+    Args:
+        path (str): The chunked report file path.
+
+    Returns:
+        list: A list of report rows.
+    """
+    rows = []
+    with open(path) as f:
+        for line in f:
+            group = json.loads(line)
+            names = list(group['columns'])
+            for i in range(group['num_rows']):
+                rows.append({name: group['columns'][name][i] for name in names})
+    return rows
+
+REPORT_WRITERS = {
+    'jsonl': (JsonlReportWriter, 'reports.jsonl'),
+    'chunked': (ChunkedReportWriter, 'reports.chunked.jsonl')
+}
+
+# Function to merge the per-chunk expense sketches
+def merge_chunk_statistics(chunk_statistics):
+    """
+    Merge the expense sketches returned by the workers into a ledger-wide summary.
+
+    Args:
+        chunk_statistics (iterable): (statistics, spenders) pairs as returned by _report_chunk.
+
+    Returns:
+        dict: Per category, the yearly expense summary and the approximate number of users
+        with expenses in it.
+    """
+    statistics = {}
+    spenders = {}
+    for chunk_stats, chunk_spenders in chunk_statistics:
+        for category, category_stats in chunk_stats.items():
+            if category in statistics:
+                statistics[category].merge(category_stats)
+            else:
+                statistics[category] = category_stats
+        for category, counter in chunk_spenders.items():
+            if category in spenders:
+                spenders[category].merge(counter)
+            else:
+                spenders[category] = counter
+    summary = {}
+    for category, category_stats in sorted(statistics.items()):
+        summary[category] = category_stats.summary()
+        summary[category]['users'] = spenders[category].count()
+    return summary
+
+# Function to generate reports for every user with a process pool
+def run_batch_reports(db_file='finance.db', output_dir='reports', workers=4, chunk_size=100,
+                      output_format='jsonl', verbose=True, statistics=False):
+    """
+    Generate monthly/yearly reports and budget statuses for all users, splitting the
+    users across a multiprocessing pool with one read-only connection per worker.
+    Results are streamed to the output file as chunks complete.
+
+    With statistics, each user's row also gets the count, median and 90th percentile
+    of their expenses per category, and a ledger-wide summary of the yearly expenses
+    per category is merged from the workers' sketches and written to
+    ledger_statistics.json. This reads every expense row of each user's month and
+    year on top of the report totals, so it is off by default.
+
+    Args:
+        db_file (str): The database file path.
+        output_dir (str): Directory for the output file (created if missing).
+        workers (int): Number of worker processes.
+        chunk_size (int): Number of users handed to a worker at a time.
+        output_format (str): 'jsonl' or 'chunked'.
+        verbose (bool): Print progress while the job runs.
+        statistics (bool): Compute per-category expense statistics.
+
+    Returns:
+        dict: Summary with the output path, user count, wall time, per-worker timing and
+        the ledger-wide category statistics (None without statistics).
+    """
+    if output_format not in REPORT_WRITERS:
+        raise ValueError("Output format must be 'jsonl' or 'chunked'")
+
+    conn = create_readonly_connection(db_file)
+    user_ids = get_all_user_ids(conn)
+    conn.close()
+
+    os.makedirs(output_dir, exist_ok=True)
+    writer_class, filename = REPORT_WRITERS[output_format]
+    writer = writer_class(os.path.join(output_dir, filename))
+
+    chunks = chunk_user_ids(user_ids, chunk_size)
+    worker_stats = {}
+    chunk_statistics = []
+    users_done = 0
+    started = time.perf_counter()
+
+    try:
+        with Pool(processes=workers, initializer=_init_worker, initargs=(db_file, statistics)) as pool:
+            for pid, elapsed, rows, chunk_stats in pool.imap_unordered(_report_chunk, chunks):
+                writer.write_rows(rows)
+                chunk_statistics.append(chunk_stats)
+                stats = worker_stats.setdefault(pid, {'chunks': 0, 'users': 0, 'seconds': 0.0})
+                stats['chunks'] += 1
+                stats['users'] += len(rows)
+                stats['seconds'] += elapsed
+                users_done += len(rows)
+                if verbose:
+                    print(f"Progress: {users_done}/{len(user_ids)} users ({time.perf_counter() - started:.2f}s)")
+    finally:
+        writer.close()
+
+    category_statistics = None
+    if statistics:
+        category_statistics = merge_chunk_statistics(chunk_statistics)
+        with open(os.path.join(output_dir, 'ledger_statistics.json'), 'w') as f:
+            json.dump(category_statistics, f, indent=2)
+
+    wall_time = time.perf_counter() - started
+    if verbose:
+        for pid, stats in sorted(worker_stats.items()):
+            print(f"Worker {pid}: {stats['users']} users in {stats['chunks']} chunks, {stats['seconds']:.2f}s busy")
+
+    return {
+        'output_path': writer.path,
+        'users': len(user_ids),
+        'workers': workers,
+        'wall_time': wall_time,
+        'worker_stats': worker_stats,
+        'category_statistics': category_statistics
+    }
+
+# Function to measure how the batch job scales with the number of workers
+def benchmark_scaling(db_file='finance.db', output_dir='reports', worker_counts=(1, 2, 4, 8),
+                      chunk_size=100, output_format='jsonl'):
+    """
+    Run the batch report job once per worker count and report the speedup relative
+    to a single worker.
+
+    Args:
+        db_file (str): The database file path.
+        output_dir (str): Directory for the output files.
+        worker_counts (tuple): Worker counts to benchmark.
+        chunk_size (int): Number of users handed to a worker at a time.
+        output_format (str): 'jsonl' or 'chunked'.
+
+    Returns:
+        list: A list of dictionaries with workers, wall time and speedup.
+    """
+    results = []
+    baseline = None
+    for workers in worker_counts:
+        summary = run_batch_reports(db_file, os.path.join(output_dir, f"workers_{workers}"), workers,
+                                    chunk_size, output_format, verbose=False)
+        if baseline is None:
+            baseline = summary['wall_time']
+        speedup = baseline / summary['wall_time'] if summary['wall_time'] else 0.0
+        results.append({'workers': workers, 'wall_time': summary['wall_time'], 'speedup': speedup})
+        print(f"{workers} workers: {summary['wall_time']:.2f}s ({speedup:.2f}x)")
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate reports for all users in parallel.")
+    parser.add_argument('--db', default='finance.db', help="Database file (default: finance.db)")
+    parser.add_argument('--output-dir', default='reports', help="Output directory (default: reports)")
+    parser.add_argument('--workers', type=int, default=4, help="Number of worker processes")
+    parser.add_argument('--chunk-size', type=int, default=100, help="Users per work chunk")
+    parser.add_argument('--format', choices=sorted(REPORT_WRITERS), default='jsonl', help="Output format")
+    parser.add_argument('--statistics', action='store_true',
+                        help="Add per-category expense statistics and write ledger_statistics.json")
+    parser.add_argument('--benchmark', action='store_true', help="Benchmark with 1, 2, 4 and 8 workers")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark_scaling(args.db, args.output_dir, chunk_size=args.chunk_size, output_format=args.format)
+    else:
+        run_batch_reports(args.db, args.output_dir, args.workers, args.chunk_size, args.format,
+                          statistics=args.statistics)
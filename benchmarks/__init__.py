@@ -0,0 +1,6 @@
+"""
+Benchmark suite for the personal finance application.
+
+    python -m benchmarks.run --scales 10000 100000 --output results.json
+    python -m benchmarks.run --compare baseline.json results.json --threshold 0.1
+"""
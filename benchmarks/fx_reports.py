@@ -0,0 +1,60 @@
+import argparse
+import os
+import random
+import database
+from benchmarks.read_path import time_reads
+from benchmarks.synthetic import build_ledger
+
+# Foreign currencies used for the mixed-currency ledger
+FOREIGN_CURRENCIES = ['EUR', 'GBP', 'INR', 'JPY']
+
+# Function to compare report time on single- and mixed-currency ledgers
+def run_fx_benchmark(data_dir, num_rows=1000000, sample_users=200, passes=3, seed=42):
+    """
+    Time the report and budget reads on a single-currency ledger and on a ledger where
+    30% of the transactions are in foreign currencies, with otherwise identical data.
+
+    Args:
+        data_dir (str): Directory where the two ledgers are built (reused if present).
+        num_rows (int): Transactions per ledger.
+        sample_users (int): Number of users reported on per pass.
+        passes (int): Number of passes per ledger.
+        seed (int): Random seed for the ledgers and the user sample.
+
+    Returns:
+        dict: Best pass time per ledger and the mixed/single ratio.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    ledgers = {
+        'single_currency': (os.path.join(data_dir, f"fx_single_{num_rows}.db"), None),
+        'mixed_currency': (os.path.join(data_dir, f"fx_mixed_{num_rows}.db"), FOREIGN_CURRENCIES)
+    }
+    num_users = max(1, num_rows // 1000)
+    user_ids = random.Random(seed).sample(range(1, num_users + 1), min(sample_users, num_users))
+
+    results = {}
+    previous_db = database.DATABASE_FILE
+    try:
+        for name, (db_file, currencies) in ledgers.items():
+            if not os.path.exists(db_file):
+                print(f"Building {name} ledger with {num_rows} rows...")
+                build_ledger(db_file, num_rows, seed=seed, currencies=currencies)
+            database.DATABASE_FILE = db_file
+            results[name] = min(time_reads(user_ids)['median'] for _ in range(passes))
+            print(f"{name}: {results[name]:.3f}s")
+    finally:
+        database.DATABASE_FILE = previous_db
+
+    results['ratio'] = results['mixed_currency'] / results['single_currency']
+    print(f"Mixed/single ratio: {results['ratio']:.2f}x")
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark reports over mixed-currency ledgers.")
+    parser.add_argument('--data-dir', default='benchmark_data', help="Directory for the ledgers")
+    parser.add_argument('--rows', type=int, default=1000000, help="Transactions per ledger")
+    parser.add_argument('--users', type=int, default=200, help="Users reported on per pass")
+    parser.add_argument('--passes', type=int, default=3, help="Passes per ledger")
+    args = parser.parse_args()
+
+    run_fx_benchmark(args.data_dir, args.rows, args.users, args.passes)
@@ -0,0 +1,358 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+import database
+import instrumentation
+from benchmarks.synthetic import build_ledger
+from sketches import QuantileSketch, RunningStats
+
+# Relative frequency of each operation in the default workload, roughly what
+# interactive users of the menu do
+DEFAULT_MIX = {
+    'register': 2,
+    'login': 10,
+    'add_income': 5,
+    'add_expense': 30,
+    'view_transactions': 20,
+    'report': 15,
+    'budget_check': 15,
+    'set_budget': 2,
+    'backup': 1
+}
+
+class OperationStats:
+    """
+    Outcome counts and latency distribution of one operation type. Latencies are
+    measured from the scheduled arrival, so they include time spent queued behind
+    busy workers. The first error other than lock contention is kept, as
+    'ExceptionType: message', so failures can be diagnosed from the summary.
+    Instances merge, so results from several processes combine.
+    """
+
+    def __init__(self):
+        self.completed = 0
+        self.lock_errors = 0
+        self.errors = 0
+        self.first_error = None
+        self.latency = QuantileSketch(seed=0)
+        self.max_latency = None
+        self.service = RunningStats()
+
+    def add(self, latency, service):
+        self.completed += 1
+        self.latency.add(latency)
+        self.max_latency = latency if self.max_latency is None else max(self.max_latency, latency)
+        self.service.add(service)
+
+    def add_error(self, error):
+        self.errors += 1
+        if self.first_error is None:
+            self.first_error = f"{type(error).__name__}: {error}"
+
+    def merge(self, other):
+        self.completed += other.completed
+        self.lock_errors += other.lock_errors
+        self.errors += other.errors
+        self.first_error = self.first_error or other.first_error
+        self.latency.merge(other.latency)
+        if other.max_latency is not None:
+            self.max_latency = other.max_latency if self.max_latency is None else max(self.max_latency, other.max_latency)
+        self.service.merge(other.service)
+        return self
+
+    def summary(self):
+        p50, p90, p99 = self.latency.quantiles([0.5, 0.9, 0.99])
+        to_ms = lambda seconds: seconds * 1000 if seconds is not None else None
+        return {
+            'completed': self.completed,
+            'lock_errors': self.lock_errors,
+            'errors': self.errors,
+            'first_error': self.first_error,
+            'p50_ms': to_ms(p50),
+            'p90_ms': to_ms(p90),
+            'p99_ms': to_ms(p99),
+            'max_ms': to_ms(self.max_latency),
+            'mean_service_ms': to_ms(self.service.mean)
+        }
+
+class VirtualUsers:
+    """
+    The simulated users and the operations they perform against DATABASE_FILE.
+
+    Each worker thread gets its own connection for the functions that take one;
+    the others open their own connections as they do in the app.
+    """
+
+    def __init__(self, db_file, work_dir, seed, busy_timeout):
+        self.db_file = db_file
+        self.work_dir = work_dir
+        self.busy_timeout = busy_timeout
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+        self.prefix = f"load{os.getpid()}_{seed}_"
+        self.registered = 0
+        conn = database.create_connection(db_file)
+        self.users = conn.execute("SELECT id, username, password FROM users ORDER BY id LIMIT 10000").fetchall()
+        conn.close()
+        if not self.users:
+            raise ValueError("The database has no users to simulate")
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            # Closed by close() from the generating thread once the workers are done
+            conn = self.local.conn = instrumentation.connect(self.db_file, check_same_thread=False)
+            conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout * 1000)}")
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    def close(self):
+        for conn in self.connections:
+            conn.close()
+        self.connections = []
+
+    def pick_user(self):
+        with self.lock:
+            return self.rng.choice(self.users)
+
+    def run(self, operation):
+        user_id, username, password = self.pick_user()
+        conn = self.connection()
+        if operation == 'register':
+            with self.lock:
+                self.registered += 1
+                username = f"{self.prefix}{self.registered}"
+            database.register_user(conn, username, 'secret')
+            new_user_id = database.authenticate_user(username, 'secret')
+            if new_user_id is not None:
+                with self.lock:
+                    self.users.append((new_user_id, username, 'secret'))
+        elif operation == 'login':
+            database.authenticate_user(username, password)
+        elif operation == 'add_income':
+            database.add_transaction(conn, user_id, 'income', 1500.0, 'Load test', 'Salary')
+        elif operation == 'add_expense':
+            database.add_transaction(conn, user_id, 'expense', 18.5, 'Load test', 'Food > Groceries')
+        elif operation == 'view_transactions':
+            database.view_transactions(conn, user_id)
+        elif operation == 'report':
+            database.get_report(user_id, 'monthly')
+        elif operation == 'budget_check':
+            database.get_budget_status(user_id, 'monthly')
+        elif operation == 'set_budget':
+            database.set_budget(user_id, 'Food', 400.0, 'monthly')
+        elif operation == 'backup':
+            backup_file = os.path.join(self.work_dir, f"backup_{threading.get_ident()}.sql")
+            database.backup_data(backup_file)
+        else:
+            raise ValueError(f"Unknown operation '{operation}'")
+
+# Function to check whether an error is lock contention
+def is_lock_error(error):
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in message or 'busy' in message)
+
+# Function to generate load from one process
+def drive_load(db_file, rate, duration, threads, mix, seed=42, busy_timeout=5.0):
+    """
+    Generate an open-loop workload: operations arrive as a Poisson process at the
+    given rate, independent of how fast they complete, and are served by a pool of
+    worker threads. When the workers cannot keep up, arrivals queue and their
+    latency grows, as it would for real users.
+
+    Args:
+        db_file (str): The database file.
+        rate (float): Mean arrivals per second.
+        duration (float): Seconds to generate arrivals for.
+        threads (int): Number of worker threads.
+        mix (dict): Relative weight per operation name.
+        seed (int): Random seed for arrivals, operations and users.
+        busy_timeout (float): Seconds a worker connection waits for a lock.
+
+    Returns:
+        dict: OperationStats per operation.
+    """
+    previous_db = database.DATABASE_FILE
+    database.DATABASE_FILE = db_file
+    rng = random.Random(seed)
+    operations = list(mix)
+    weights = [mix[name] for name in operations]
+    stats = {name: OperationStats() for name in operations}
+    stats_lock = threading.Lock()
+    work_dir = tempfile.mkdtemp(prefix='load_', dir=os.path.dirname(os.path.abspath(db_file)))
+    users = VirtualUsers(db_file, work_dir, seed, busy_timeout)
+
+    def serve(operation, arrival):
+        started = time.perf_counter()
+        error = None
+        try:
+            users.run(operation)
+        except Exception as e:
+            conn = getattr(users.local, 'conn', None)
+            if conn is not None and conn.in_transaction:
+                conn.rollback()
+            error = e
+        finished = time.perf_counter()
+        with stats_lock:
+            if error is None:
+                stats[operation].add(finished - arrival, finished - started)
+            elif is_lock_error(error):
+                stats[operation].lock_errors += 1
+            else:
+                stats[operation].add_error(error)
+
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            started = time.perf_counter()
+            arrival = started
+            while True:
+                arrival += rng.expovariate(rate)
+                if arrival - started >= duration:
+                    break
+                delay = arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(serve, rng.choices(operations, weights=weights)[0], arrival)
+    finally:
+        users.close()
+        database.DATABASE_FILE = previous_db
+        for filename in os.listdir(work_dir):
+            os.remove(os.path.join(work_dir, filename))
+        os.rmdir(work_dir)
+    return stats
+
+# Function to run drive_load in a worker process
+def _drive_load_process(arguments):
+    return drive_load(*arguments)
+
+# Function to measure the size of a database including its journal files
+def database_size(db_file):
+    return sum(os.path.getsize(db_file + suffix) for suffix in ('', '-journal', '-wal')
+               if os.path.exists(db_file + suffix))
+
+# Function to run a load test
+def run_load_test(db_file, rate=50.0, duration=30.0, concurrency=8, processes=1, mix=None,
+                  seed=42, busy_timeout=5.0, verbose=True):
+    """
+    Drive a mixed workload against a file-backed database from many threads, and
+    optionally many processes, and summarize how it held up.
+
+    With several processes, each one generates rate / processes arrivals per second
+    with concurrency / processes threads, and their results are merged.
+
+    Args:
+        db_file (str): The database file (must already have the schema and some users).
+        rate (float): Total mean arrivals per second.
+        duration (float): Seconds to generate load for.
+        concurrency (int): Total number of worker threads.
+        processes (int): Number of load-generating processes.
+        mix (dict, optional): Relative weight per operation. Defaults to DEFAULT_MIX.
+        seed (int): Random seed.
+        busy_timeout (float): Seconds a worker connection waits for a lock.
+        verbose (bool): Print the summary.
+
+    Returns:
+        dict: Throughput, per-operation outcomes and latency percentiles, lock
+        errors and database growth.
+    """
+    mix = mix or DEFAULT_MIX
+    size_before = database_size(db_file)
+    started = time.perf_counter()
+
+    # Backups and the app functions print progress; keep it out of the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        if processes > 1:
+            threads = max(1, concurrency // processes)
+            arguments = [(db_file, rate / processes, duration, threads, mix, seed + i, busy_timeout)
+                         for i in range(processes)]
+            with Pool(processes) as pool:
+                results = pool.map(_drive_load_process, arguments)
+        else:
+            results = [drive_load(db_file, rate, duration, concurrency, mix, seed, busy_timeout)]
+    elapsed = time.perf_counter() - started
+
+    merged = {name: OperationStats() for name in mix}
+    for result in results:
+        for name, operation_stats in result.items():
+            merged[name].merge(operation_stats)
+    total = OperationStats()
+    for operation_stats in merged.values():
+        total.merge(operation_stats)
+
+    size_after = database_size(db_file)
+    summary = {
+        'rate': rate,
+        'duration': duration,
+        'concurrency': concurrency,
+        'processes': processes,
+        'elapsed': elapsed,
+        'throughput': total.completed / elapsed,
+        'total': total.summary(),
+        'operations': {name: operation_stats.summary() for name, operation_stats in merged.items()},
+        'size_before': size_before,
+        'size_after': size_after,
+        'growth_bytes': size_after - size_before
+    }
+    if verbose:
+        print_summary(summary)
+    return summary
+
+# Function to print a load test summary
+def print_summary(summary):
+    print(f"{summary['total']['completed']} operations in {summary['elapsed']:.1f}s: "
+          f"{summary['throughput']:.1f} ops/s (offered {summary['rate']:.1f}/s)")
+    print(f"{'operation':<18}{'done':>7}{'locked':>8}{'errors':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}")
+    for name, result in list(summary['operations'].items()) + [('total', summary['total'])]:
+        percentiles = "".join(f"{result[key]:>10.2f}" if result[key] is not None else f"{'-':>10}"
+                              for key in ('p50_ms', 'p90_ms', 'p99_ms'))
+        print(f"{name:<18}{result['completed']:>7}{result['lock_errors']:>8}{result['errors']:>8}{percentiles}")
+    for name, result in summary['operations'].items():
+        if result['first_error']:
+            print(f"First error in {name}: {result['first_error']}")
+    print(f"Database grew by {summary['growth_bytes'] / 1024:.1f} KiB to {summary['size_after'] / 1024 ** 2:.1f} MiB")
+
+# Function to parse a workload mix such as 'add_expense=30,report=10'
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        if name.strip() not in DEFAULT_MIX:
+            raise ValueError(f"Unknown operation '{name.strip()}'")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulate many concurrent users against a file-backed database.")
+    parser.add_argument('--db', default='benchmark_data/load.db', help="Database file (built if missing)")
+    parser.add_argument('--rows', type=int, default=100000, help="Rows to generate when building the database")
+    parser.add_argument('--rate', type=float, default=50.0, help="Mean operations arriving per second")
+    parser.add_argument('--duration', type=float, default=30.0, help="Seconds to generate load for")
+    parser.add_argument('--concurrency', type=int, default=8, help="Total worker threads")
+    parser.add_argument('--processes', type=int, default=1, help="Load-generating processes")
+    parser.add_argument('--mix', type=parse_mix, help="Operation weights, e.g. 'add_expense=30,report=10'")
+    parser.add_argument('--busy-timeout', type=float, default=5.0, help="Seconds to wait for a lock")
+    parser.add_argument('--seed', type=int, default=42, help="Random seed")
+    parser.add_argument('--output', help="Optional JSON file for the results")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        os.makedirs(os.path.dirname(args.db) or '.', exist_ok=True)
+        print(f"Building synthetic ledger with {args.rows} rows...")
+        build_ledger(args.db, args.rows, seed=args.seed)
+    results = run_load_test(args.db, args.rate, args.duration, args.concurrency, args.processes, args.mix,
+                            args.seed, args.busy_timeout)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
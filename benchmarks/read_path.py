@@ -0,0 +1,154 @@
+import argparse
+import json
+import os
+import random
+import database
+from benchmarks.run import time_call
+from benchmarks.synthetic import build_ledger
+
+# Function to time the report and budget reads for a sample of users
+def time_reads(user_ids):
+    """
+    Time get_report (monthly and yearly) and get_budget_status for each sampled user,
+    using whichever connection mode is currently configured.
+
+    Args:
+        user_ids (list): The users to report on.
+
+    Returns:
+        dict: Timing statistics for one pass over all sampled users.
+    """
+    def read_all():
+        for user_id in user_ids:
+            database.get_report(user_id, 'monthly')
+            database.get_report(user_id, 'yearly')
+            database.get_budget_status(user_id, 'monthly')
+    return time_call(read_all, 1)
+
+# Function to measure the memory available to cache the ledger
+def available_memory():
+    """
+    Get the memory available to this process for the OS page cache: MemAvailable from
+    /proc/meminfo, capped by what is left under the cgroup memory limit if one is set.
+
+    Returns:
+        int or None: Bytes available, or None where it cannot be determined.
+    """
+    available = None
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    available = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    for limit_file, usage_file in (('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.current'),
+                                   ('/sys/fs/cgroup/memory/memory.limit_in_bytes',
+                                    '/sys/fs/cgroup/memory/memory.usage_in_bytes')):
+        try:
+            with open(limit_file) as f:
+                limit = f.read().strip()
+            with open(usage_file) as f:
+                usage = int(f.read().strip())
+        except (OSError, ValueError):
+            continue
+        if limit.isdigit() and (available is None or int(limit) - usage < available):
+            available = int(limit) - usage
+        break
+    return available
+
+# Function to drop a file from the OS page cache
+def evict_from_page_cache(path):
+    """
+    Ask the OS to drop a file's cached pages, so the next read of it goes to disk.
+    Only unmodified pages are dropped; does nothing where posix_fadvise is unavailable.
+
+    Args:
+        path (str): The file to evict.
+
+    Returns:
+        bool: True if the request was made.
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+# Function to compare the default and read-optimized read paths
+def run_read_path_benchmark(db_file, num_rows, sample_users=200, passes=3, seed=42, cold=False):
+    """
+    Compare the report and budget reads with a new default connection per call
+    against the read-optimized mode.
+
+    The ledger's size is printed against the memory available to cache it. A ledger
+    that fits is served from the OS page cache after the first pass, so the timings
+    then compare CPU and connection costs only, not I/O. For I/O-bound numbers either
+    run with cold=True, which evicts the ledger from the page cache before each
+    mode's first pass, or run the benchmark under a memory limit smaller than the
+    ledger, e.g. systemd-run --user --scope -p MemoryMax=1G python -m benchmarks.read_path.
+
+    Args:
+        db_file (str): The ledger file; built with num_rows rows if it does not exist.
+        num_rows (int): Ledger size used when building the file.
+        sample_users (int): Number of users reported on per pass.
+        passes (int): Number of passes per mode; the first pass is a cold read.
+        seed (int): Random seed for the ledger and the user sample.
+        cold (bool): Evict the ledger from the page cache before each mode.
+
+    Returns:
+        dict: Per-pass timings for both modes, the speedup of the best pass, and the
+            ledger size and available memory in bytes.
+    """
+    if not os.path.exists(db_file):
+        print(f"Building synthetic ledger with {num_rows} rows...")
+        build_ledger(db_file, num_rows, seed=seed)
+
+    previous_db = database.DATABASE_FILE
+    database.DATABASE_FILE = db_file
+    conn = database.create_connection(db_file)
+    user_ids = database.get_all_user_ids(conn)
+    conn.close()
+    user_ids = random.Random(seed).sample(user_ids, min(sample_users, len(user_ids)))
+
+    results = {'db_bytes': os.path.getsize(db_file), 'available_memory_bytes': available_memory()}
+    if results['available_memory_bytes'] is None:
+        print(f"Ledger: {results['db_bytes'] / 1024 ** 3:.2f} GiB, available memory unknown")
+    else:
+        fits = results['db_bytes'] < results['available_memory_bytes']
+        print(f"Ledger: {results['db_bytes'] / 1024 ** 3:.2f} GiB, available memory: "
+              f"{results['available_memory_bytes'] / 1024 ** 3:.2f} GiB "
+              f"({'fits in memory, later passes read from the page cache' if fits else 'larger than memory'})")
+    try:
+        for mode, enabled in (('default', False), ('read_optimized', True)):
+            database.set_read_optimized(enabled)
+            if cold and not evict_from_page_cache(db_file):
+                print("Cannot evict the ledger from the page cache on this platform")
+            results[mode] = [time_reads(user_ids)['median'] for _ in range(passes)]
+            print(f"{mode}: " + ", ".join(f"{seconds:.3f}s" for seconds in results[mode]))
+    finally:
+        database.set_read_optimized(False)
+        database.DATABASE_FILE = previous_db
+
+    results['speedup'] = min(results['default']) / min(results['read_optimized'])
+    print(f"Speedup: {results['speedup']:.2f}x")
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the read-optimized connection mode.")
+    parser.add_argument('--db', default='benchmark_data/read_path.db', help="Ledger file (built if missing)")
+    parser.add_argument('--rows', type=int, default=10000000, help="Rows to generate when building the ledger")
+    parser.add_argument('--users', type=int, default=200, help="Users reported on per pass")
+    parser.add_argument('--passes', type=int, default=3, help="Passes per mode")
+    parser.add_argument('--cold', action='store_true', help="Evict the ledger from the page cache before each mode")
+    parser.add_argument('--output', help="Optional JSON file for the results")
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(args.db) or '.', exist_ok=True)
+    results = run_read_path_benchmark(args.db, args.rows, args.users, args.passes, cold=args.cold)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
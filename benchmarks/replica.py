@@ -0,0 +1,171 @@
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import threading
+import time
+import database
+from benchmarks.synthetic import build_ledger
+
+# Function to run heavy report scans until told to stop
+def _run_reports(user_ids, stop, counts):
+    """
+    Reader thread: repeatedly run a ledger-wide statistics scan and per-user reports
+    through the read-only functions, so they use the replica when it is enabled.
+
+    Args:
+        user_ids (list): Users to report on.
+        stop (threading.Event): Set when the measurement is over.
+        counts (dict): Shared counters for completed scans and errors.
+    """
+    while not stop.is_set():
+        try:
+            database.get_spending_statistics()
+            for user_id in user_ids:
+                database.get_report(user_id, 'yearly')
+                if stop.is_set():
+                    break
+            counts['scans'] += 1
+        except sqlite3.OperationalError:
+            counts['reader_errors'] += 1
+    database.close_read_connections()
+
+# Function to time single-row writes while reports run
+def measure_writes(db_file, user_ids, duration, readers, write_interval):
+    """
+    Add transactions one at a time for a fixed duration and record the latency of
+    each write, with a number of reader threads scanning concurrently. Writes that
+    overlap a replica refresh (one was running when the write started or ended, or
+    one completed in between) are also reported on their own, since they are the
+    ones a blocking copy would delay.
+
+    Args:
+        db_file (str): The ledger file.
+        user_ids (list): Users the writes and reports are for.
+        duration (float): Seconds to write for.
+        readers (int): Number of concurrent report threads.
+        write_interval (float): Pause between writes, as in interactive use.
+
+    Returns:
+        dict: Write latency percentiles in milliseconds, overall and for writes overlapping
+        a refresh, write count, lock errors and report scans.
+    """
+    stop = threading.Event()
+    counts = {'scans': 0, 'reader_errors': 0}
+    threads = [threading.Thread(target=_run_reports, args=(user_ids[i::readers], stop, counts))
+               for i in range(readers)]
+    for thread in threads:
+        thread.start()
+
+    conn = database.create_connection(db_file)
+    latencies = []
+    overlapping = []
+    lock_errors = 0
+    deadline = time.perf_counter() + duration
+    i = 0
+    while time.perf_counter() < deadline:
+        user_id = user_ids[i % len(user_ids)]
+        refreshing, generation = database.replica_state['refreshing'], database.replica_state['generation']
+        started = time.perf_counter()
+        try:
+            database.add_transaction(conn, user_id, 'expense', 12.5, 'Coffee', 'Food')
+            latencies.append(time.perf_counter() - started)
+            if (refreshing or database.replica_state['refreshing']
+                    or database.replica_state['generation'] != generation):
+                overlapping.append(latencies[-1])
+        except sqlite3.OperationalError:
+            lock_errors += 1
+        i += 1
+        time.sleep(write_interval)
+    conn.close()
+
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    overlapping.sort()
+    def percentile(values, fraction):
+        return values[min(len(values) - 1, int(fraction * len(values)))] * 1000 if values else None
+    return {
+        'writes': len(latencies),
+        'p50_ms': percentile(latencies, 0.5),
+        'p99_ms': percentile(latencies, 0.99),
+        'max_ms': latencies[-1] * 1000 if latencies else None,
+        'mean_ms': statistics.mean(latencies) * 1000 if latencies else None,
+        'overlap_writes': len(overlapping),
+        'overlap_p50_ms': percentile(overlapping, 0.5),
+        'overlap_max_ms': overlapping[-1] * 1000 if overlapping else None,
+        'lock_errors': lock_errors,
+        'report_scans': counts['scans'],
+        'reader_errors': counts['reader_errors']
+    }
+
+# Function to compare write latency with reports on the primary and on the replica
+def run_replica_benchmark(db_file, num_rows, duration=10.0, readers=2, write_interval=0.01,
+                          max_staleness=5.0, refresh_interval=0.5, seed=42):
+    """
+    Measure write latency with no readers, with heavy reports on the primary
+    database, and with the same reports routed to the reporting replica.
+
+    Args:
+        db_file (str): The ledger file; built with num_rows rows if it does not exist.
+        num_rows (int): Ledger size used when building the file.
+        duration (float): Seconds of writing per mode.
+        readers (int): Number of concurrent report threads.
+        write_interval (float): Pause between writes in seconds.
+        max_staleness (float): Replica staleness bound in seconds.
+        refresh_interval (float): Seconds between background replica refreshes.
+        seed (int): Random seed for the ledger.
+
+    Returns:
+        dict: Results per mode ('idle', 'primary', 'replica').
+    """
+    if not os.path.exists(db_file):
+        print(f"Building synthetic ledger with {num_rows} rows...")
+        build_ledger(db_file, num_rows, seed=seed)
+
+    previous_db = database.DATABASE_FILE
+    database.DATABASE_FILE = db_file
+    conn = database.create_connection(db_file)
+    user_ids = database.get_all_user_ids(conn)[:200]
+    conn.close()
+
+    results = {}
+    try:
+        for mode, mode_readers in (('idle', 0), ('primary', readers), ('replica', readers)):
+            if mode == 'replica':
+                database.enable_replica(max_staleness=max_staleness, refresh_interval=refresh_interval)
+            results[mode] = measure_writes(db_file, user_ids, duration, mode_readers, write_interval)
+            if mode == 'replica':
+                results[mode]['replica_copy_seconds'] = database.replica_state['copy_seconds']
+            print(f"{mode}: {results[mode]['writes']} writes, p50 {results[mode]['p50_ms']:.2f}ms, "
+                  f"p99 {results[mode]['p99_ms']:.2f}ms, max {results[mode]['max_ms']:.2f}ms, "
+                  f"{results[mode]['lock_errors']} lock errors, {results[mode]['report_scans']} report scans")
+            if results[mode]['overlap_writes']:
+                print(f"  {results[mode]['overlap_writes']} writes overlapped a refresh: "
+                      f"p50 {results[mode]['overlap_p50_ms']:.2f}ms, max {results[mode]['overlap_max_ms']:.2f}ms")
+    finally:
+        database.disable_replica()
+        database.DATABASE_FILE = previous_db
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark write latency with reports on the primary vs the replica.")
+    parser.add_argument('--db', default='benchmark_data/replica.db', help="Ledger file (built if missing)")
+    parser.add_argument('--rows', type=int, default=1000000, help="Rows to generate when building the ledger")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds of writing per mode")
+    parser.add_argument('--readers', type=int, default=2, help="Concurrent report threads")
+    parser.add_argument('--staleness', type=float, default=5.0, help="Replica staleness bound in seconds")
+    parser.add_argument('--refresh', type=float, default=0.5,
+                        help="Seconds between replica refreshes (short, so many writes overlap a copy)")
+    parser.add_argument('--output', help="Optional JSON file for the results")
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(args.db) or '.', exist_ok=True)
+    results = run_replica_benchmark(args.db, args.rows, args.duration, args.readers,
+                                    max_staleness=args.staleness, refresh_interval=args.refresh)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,217 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+import database
+from benchmarks.synthetic import build_ledger
+
+# Default ledger sizes, from 10k up to 10M transactions
+DEFAULT_SCALES = [10000, 100000, 1000000, 10000000]
+
+# Operations that scan the whole database are timed once per scale
+FULL_SCAN_OPERATIONS = ('backup_data', 'generate_backup_pdf')
+
+# Function to time one call repeatedly
+def time_call(func, repeat):
+    """
+    Call a function several times and collect its wall-clock timings.
+
+    Anything the function prints is discarded so console output does not
+    dominate the measurement.
+
+    Args:
+        func (callable): Zero-argument function to time.
+        repeat (int): Number of calls.
+
+    Returns:
+        dict: min, median, mean and max seconds, plus the number of calls.
+    """
+    timings = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+    return {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+        'max': max(timings),
+        'repeat': repeat
+    }
+
+# Function to build the hot-path operations for a ledger
+def hot_path_operations(conn, user_id, work_dir):
+    """
+    Build the operations to benchmark against the current DATABASE_FILE.
+
+    'view_budget' times get_budget_status, which holds all of view_budget's
+    queries without the console output.
+
+    Args:
+        conn (sqlite3.Connection): Connection used by the functions that take one.
+        user_id (int): The user the per-user operations run for.
+        work_dir (str): Directory for backup output files.
+
+    Returns:
+        dict: Operation name mapped to a zero-argument function.
+    """
+    return {
+        'add_transaction': lambda: database.add_transaction(conn, user_id, 'expense', 12.5, 'Benchmark', 'Food'),
+        'view_transactions': lambda: database.view_transactions(conn, user_id),
+        'get_report_monthly': lambda: database.get_report(user_id, 'monthly'),
+        'get_report_yearly': lambda: database.get_report(user_id, 'yearly'),
+        'view_budget': lambda: database.get_budget_status(user_id, 'monthly'),
+        'set_budget': lambda: database.set_budget(user_id, 'Food', 500.0, 'monthly'),
+        'backup_data': lambda: database.backup_data(os.path.join(work_dir, 'backup.sql')),
+        'generate_backup_pdf': lambda: database.generate_backup_pdf(os.path.join(work_dir, 'backup.pdf'))
+    }
+
+# Function to benchmark all hot paths at one ledger size
+def run_scale(num_rows, data_dir, repeat=5, skip=(), seed=42):
+    """
+    Build (or reuse) a synthetic ledger of the given size and time every hot path on it.
+
+    Args:
+        num_rows (int): Number of transactions in the ledger.
+        data_dir (str): Directory where ledgers are cached between runs.
+        repeat (int): Number of calls per per-user operation.
+        skip (tuple): Operation names to leave out.
+        seed (int): Random seed for the synthetic data.
+
+    Returns:
+        dict: Operation name mapped to its timing statistics.
+    """
+    db_file = os.path.join(data_dir, f"ledger_{num_rows}_{seed}.db")
+    if not os.path.exists(db_file):
+        print(f"Building synthetic ledger with {num_rows} rows...")
+        build_ledger(db_file + '.tmp', num_rows, seed=seed)
+        os.replace(db_file + '.tmp', db_file)
+
+    # Benchmark a copy so that writes do not change the cached ledger
+    work_dir = tempfile.mkdtemp(dir=data_dir)
+    work_db = os.path.join(work_dir, 'finance.db')
+    source = database.create_connection(db_file)
+    target = database.create_connection(work_db)
+    source.backup(target)
+    source.close()
+    target.close()
+
+    previous_db = database.DATABASE_FILE
+    database.DATABASE_FILE = work_db
+    conn = database.create_connection(work_db)
+    results = {}
+    try:
+        operations = hot_path_operations(conn, 1, work_dir)
+        for name, func in operations.items():
+            if name in skip:
+                continue
+            results[name] = time_call(func, 1 if name in FULL_SCAN_OPERATIONS else repeat)
+            print(f"  {name}: {results[name]['median'] * 1000:.2f} ms")
+    finally:
+        conn.close()
+        database.DATABASE_FILE = previous_db
+        for filename in os.listdir(work_dir):
+            os.remove(os.path.join(work_dir, filename))
+        os.rmdir(work_dir)
+    return results
+
+# Function to run the benchmark suite
+def run_benchmarks(scales=DEFAULT_SCALES, data_dir='benchmark_data', repeat=5, skip=(), seed=42):
+    """
+    Run the hot-path benchmarks at every ledger size.
+
+    Args:
+        scales (list): Ledger sizes in transactions.
+        data_dir (str): Directory where ledgers are cached between runs.
+        repeat (int): Number of calls per per-user operation.
+        skip (tuple): Operation names to leave out.
+        seed (int): Random seed for the synthetic data.
+
+    Returns:
+        dict: Run metadata and results keyed by scale, then operation.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    results = {}
+    for num_rows in scales:
+        print(f"Scale {num_rows}:")
+        results[str(num_rows)] = run_scale(num_rows, data_dir, repeat, skip, seed)
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seed': seed,
+            'repeat': repeat
+        },
+        'results': results
+    }
+
+# Function to compare two benchmark runs
+def compare_results(baseline, current, threshold=0.10):
+    """
+    Compare the median timings of two benchmark runs.
+
+    Args:
+        baseline (dict): Results of the earlier run.
+        current (dict): Results of the later run.
+        threshold (float): Relative slowdown above which an operation is a regression.
+
+    Returns:
+        list: One dictionary per operation present in both runs, with the scale,
+        operation, both medians, the relative change and a 'regression' flag.
+    """
+    comparisons = []
+    for scale, operations in current['results'].items():
+        baseline_operations = baseline['results'].get(scale, {})
+        for name, stats in operations.items():
+            if name not in baseline_operations:
+                continue
+            before = baseline_operations[name]['median']
+            after = stats['median']
+            change = (after - before) / before if before else 0.0
+            comparisons.append({
+                'scale': scale,
+                'operation': name,
+                'baseline': before,
+                'current': after,
+                'change': change,
+                'regression': change > threshold
+            })
+    return comparisons
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the finance application's hot paths.")
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES, help="Ledger sizes in rows")
+    parser.add_argument('--data-dir', default='benchmark_data', help="Directory for cached ledgers")
+    parser.add_argument('--repeat', type=int, default=5, help="Calls per per-user operation")
+    parser.add_argument('--skip', nargs='*', default=[], help="Operations to skip")
+    parser.add_argument('--seed', type=int, default=42, help="Random seed for the synthetic data")
+    parser.add_argument('--output', default='benchmark_results.json', help="File for the JSON results")
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help="Compare two result files")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Regression threshold (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        comparisons = compare_results(baseline, current, args.threshold)
+        for item in comparisons:
+            flag = "REGRESSION" if item['regression'] else "ok"
+            print(f"{item['scale']:>10} {item['operation']:<22} {item['baseline'] * 1000:10.2f} ms "
+                  f"-> {item['current'] * 1000:10.2f} ms ({item['change']:+.1%}) {flag}")
+        sys.exit(1 if any(item['regression'] for item in comparisons) else 0)
+
+    report = run_benchmarks(args.scales, args.data_dir, args.repeat, tuple(args.skip), args.seed)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
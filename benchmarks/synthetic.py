@@ -0,0 +1,175 @@
+import random
+import sqlite3
+from datetime import date, timedelta
+import database
+
+# Expense categories with their relative frequency and typical amount (median, spread)
+EXPENSE_CATEGORIES = [
+    ('Food', 30, 25.0, 0.6),
+    ('Groceries', 20, 60.0, 0.5),
+    ('Transport', 15, 15.0, 0.7),
+    ('Entertainment', 8, 40.0, 0.8),
+    ('Utilities', 6, 90.0, 0.3),
+    ('Shopping', 10, 70.0, 0.9),
+    ('Health', 4, 80.0, 1.0),
+    ('Rent', 3, 1200.0, 0.2),
+    ('Travel', 2, 400.0, 0.9),
+    ('Other', 2, 30.0, 1.0)
+]
+
+# Income categories with their relative frequency and typical amount (median, spread)
+INCOME_CATEGORIES = [
+    ('Salary', 70, 3500.0, 0.3),
+    ('Business', 15, 800.0, 0.9),
+    ('Interest', 10, 20.0, 0.8),
+    ('Gift', 5, 100.0, 1.0)
+]
+
+# Fraction of generated transactions that are income
+INCOME_SHARE = 0.08
+
+# Function to pick a category and draw an amount for it
+def _draw(rng, categories, weights):
+    """
+    Pick a category by weight and draw a log-normally distributed amount for it.
+
+    Args:
+        rng (random.Random): Random number generator.
+        categories (list): (name, weight, median, spread) tuples.
+        weights (list): The category weights.
+
+    Returns:
+        tuple: (category name, amount rounded to cents)
+    """
+    name, _, median, spread = rng.choices(categories, weights=weights)[0]
+    return name, round(rng.lognormvariate(0, spread) * median, 2)
+
+# Function to generate synthetic transactions
+def generate_transactions(num_rows, num_users, start_date=date(2020, 1, 1), years=5, seed=42):
+    """
+    Generate a deterministic stream of synthetic transactions spread over several years.
+
+    The same arguments always yield the same rows, so benchmark runs are comparable.
+
+    Args:
+        num_rows (int): Number of transactions to generate.
+        num_users (int): Number of users the transactions are spread across.
+        start_date (datetime.date): Date of the earliest transaction.
+        years (int): Number of years covered by the ledger.
+        seed (int): Random seed.
+
+    Yields:
+        tuple: (user_id, amount, category, type, date) rows.
+    """
+    rng = random.Random(seed)
+    expense_weights = [c[1] for c in EXPENSE_CATEGORIES]
+    income_weights = [c[1] for c in INCOME_CATEGORIES]
+    num_days = years * 365
+
+    for _ in range(num_rows):
+        user_id = rng.randint(1, num_users)
+        if rng.random() < INCOME_SHARE:
+            category, amount = _draw(rng, INCOME_CATEGORIES, income_weights)
+            transaction_type = 'income'
+        else:
+            category, amount = _draw(rng, EXPENSE_CATEGORIES, expense_weights)
+            transaction_type = 'expense'
+        day = start_date + timedelta(days=rng.randrange(num_days))
+        yield user_id, amount, category, transaction_type, day.strftime("%Y-%m-%d")
+
+# Function to generate synthetic FX rates
+def generate_fx_rates(currencies, start_date, years, seed=42):
+    """
+    Generate one rate per currency per day as a random walk around a starting rate.
+
+    Args:
+        currencies (list): Currency codes.
+        start_date (datetime.date): First date.
+        years (int): Number of years of rates.
+        seed (int): Random seed.
+
+    Yields:
+        tuple: (currency, date, rate) rows.
+    """
+    rng = random.Random(seed + 2)
+    for currency in currencies:
+        rate = rng.uniform(0.5, 1.5)
+        for offset in range(years * 366):
+            rate *= 1 + rng.gauss(0, 0.004)
+            yield currency, (start_date + timedelta(days=offset)).strftime("%Y-%m-%d"), round(rate, 6)
+
+# Function to build a synthetic ledger database
+def build_ledger(db_file, num_rows, num_users=None, years=5, seed=42, batch_size=50000,
+                 currencies=None, foreign_share=0.3):
+    """
+    Create a database populated with synthetic users, transactions and budgets.
+
+    Rows are inserted in batches so that even 10M-row ledgers are built with
+    constant memory.
+
+    Args:
+        db_file (str): The database file to create (existing tables are reused).
+        num_rows (int): Number of transactions to generate.
+        num_users (int, optional): Number of users. Defaults to one user per 1,000 rows.
+        years (int): Number of years of history ending in the current year.
+        seed (int): Random seed.
+        batch_size (int): Number of rows inserted per executemany call.
+        currencies (list, optional): Foreign currency codes. When given, foreign_share
+            of the transactions are recorded in one of them and daily FX rates are
+            generated for the whole period.
+        foreign_share (float): Fraction of transactions in a foreign currency.
+
+    Returns:
+        int: The number of users created.
+    """
+    num_users = num_users or max(1, num_rows // 1000)
+    start_date = date(date.today().year - years + 1, 1, 1)
+    rng = random.Random(seed)
+
+    # Create the schema through the application so the ledger matches it exactly
+    previous_db = database.DATABASE_FILE
+    database.DATABASE_FILE = db_file
+    try:
+        database.create_tables()
+        database.create_budget_table()
+    finally:
+        database.DATABASE_FILE = previous_db
+
+    conn = sqlite3.connect(db_file)
+    cursor = conn.cursor()
+
+    cursor.executemany("INSERT INTO users (username, password) VALUES (?, ?)",
+                       ((f"user{i}", 'x' * 64) for i in range(1, num_users + 1)))
+
+    budgets = []
+    for user_id in range(1, num_users + 1):
+        for name, _, median, _ in rng.sample(EXPENSE_CATEGORIES, 3):
+            budgets.append((user_id, name, round(median * 20, 2), 'monthly'))
+    cursor.executemany("INSERT INTO budgets (user_id, category, amount, period) VALUES (?, ?, ?, ?)", budgets)
+
+    if currencies:
+        cursor.executemany("INSERT INTO fx_rates (currency, date, rate) VALUES (?, ?, ?)",
+                           generate_fx_rates(currencies, start_date, years, seed))
+
+    # Currencies are drawn from their own generator so the base ledger does not change
+    currency_rng = random.Random(seed + 1)
+    batch = []
+    for row in generate_transactions(num_rows, num_users, start_date, years, seed):
+        if currencies and currency_rng.random() < foreign_share:
+            currency = currency_rng.choice(currencies)
+        else:
+            currency = database.DEFAULT_CURRENCY
+        batch.append(row + (currency,))
+        if len(batch) >= batch_size:
+            cursor.executemany('''INSERT INTO transactions (user_id, amount, category, type, date, currency)
+                                  VALUES (?, ?, ?, ?, ?, ?)''', batch)
+            batch = []
+    if batch:
+        cursor.executemany('''INSERT INTO transactions (user_id, amount, category, type, date, currency)
+                              VALUES (?, ?, ?, ?, ?, ?)''', batch)
+
+    conn.commit()
+    database.backfill_category_ids(conn)
+    database.rebuild_daily_balances(conn)
+    conn.close()
+    return num_users
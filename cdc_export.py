@@ -0,0 +1,101 @@
+import argparse
+import json
+import os
+import database
+
+# Name of the file in the export directory that stores the last exported sequence number
+CURSOR_FILENAME = 'cursor.json'
+
+# Function to read the stored export cursor
+def read_cursor(output_dir):
+    """
+    Read the last exported change log sequence number for an export directory.
+
+    Args:
+        output_dir (str): The export directory.
+
+    Returns:
+        int: The last exported sequence number, or 0 if nothing was exported yet.
+    """
+    path = os.path.join(output_dir, CURSOR_FILENAME)
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return json.load(f)['last_seq']
+
+# Function to store the export cursor
+def write_cursor(output_dir, last_seq):
+    """
+    Store the last exported sequence number. The file is replaced atomically so a
+    crash never leaves a half-written cursor behind.
+
+    Args:
+        output_dir (str): The export directory.
+        last_seq (int): The last exported sequence number.
+    """
+    path = os.path.join(output_dir, CURSOR_FILENAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'last_seq': last_seq}, f)
+    os.replace(path + '.tmp', path)
+
+# Function to export the changes since the stored cursor
+def export_changes(output_dir='exports'):
+    """
+    Stream the change log entries after the stored cursor to a new NDJSON file and
+    advance the cursor.
+
+    The file is named after the first and last sequence numbers it holds and only
+    becomes visible once complete, so a failed run is simply retried from the same
+    cursor. Work done depends on the number of new changes, not the ledger size.
+
+    Args:
+        output_dir (str): Directory for the NDJSON files and the cursor.
+
+    Returns:
+        dict: The file written (None if there were no changes), the number of changes
+        and the new cursor.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    after_seq = read_cursor(output_dir)
+    tmp_path = os.path.join(output_dir, 'changes.ndjson.tmp')
+
+    conn = database.create_readonly_connection()
+    first_seq, last_seq, count = None, after_seq, 0
+    try:
+        with open(tmp_path, 'w') as f:
+            for change in database.iter_changes(conn, after_seq):
+                f.write(json.dumps(change) + "\n")
+                first_seq = first_seq or change['seq']
+                last_seq = change['seq']
+                count += 1
+    finally:
+        conn.close()
+
+    if count == 0:
+        os.remove(tmp_path)
+        return {'path': None, 'changes': 0, 'last_seq': after_seq}
+
+    path = os.path.join(output_dir, f"changes_{first_seq:012d}_{last_seq:012d}.ndjson")
+    os.replace(tmp_path, path)
+    write_cursor(output_dir, last_seq)
+    return {'path': path, 'changes': count, 'last_seq': last_seq}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Incrementally export ledger changes to NDJSON.")
+    parser.add_argument('--db', default='finance.db', help="Database file (default: finance.db)")
+    parser.add_argument('--output-dir', default='exports', help="Export directory (default: exports)")
+    parser.add_argument('--compact', action='store_true',
+                        help="After exporting, keep only the latest exported change per row")
+    parser.add_argument('--purge', action='store_true',
+                        help="After exporting, remove all exported changes from the log")
+    args = parser.parse_args()
+
+    database.DATABASE_FILE = args.db
+    result = export_changes(args.output_dir)
+    if result['path']:
+        print(f"Exported {result['changes']} changes to {result['path']} (cursor {result['last_seq']})")
+    else:
+        print(f"No new changes since {result['last_seq']}")
+    if args.compact or args.purge:
+        removed = database.compact_change_log(result['last_seq'], purge=args.purge)
+        print(f"Removed {removed} change log entries")
@@ -0,0 +1,118 @@
+from bisect import bisect_right
+
+# Currency assumed for users and transactions that do not specify one
+DEFAULT_CURRENCY = 'USD'
+
+class FxRateIndex:
+    """
+    In-memory index of dated FX rates, used to convert report totals between currencies.
+
+    Every rate is the value of one unit of a currency in a common pivot currency,
+    valid from its date until the next rate for that currency. The pivot currency
+    itself always has rate 1. Rates are kept as sorted date/rate arrays per currency,
+    so the rate on any date is found with bisect.
+
+    Attributes:
+        pivot (str): The currency all rates are expressed in.
+    """
+
+    def __init__(self, rates, pivot=DEFAULT_CURRENCY):
+        """
+        Build the index.
+
+        Args:
+            rates (iterable): (currency, date, rate) rows, in any order.
+            pivot (str): The currency the rates are expressed in.
+        """
+        self.pivot = pivot
+        self.cross_rates = {}
+        by_currency = {}
+        for currency, date, rate in rates:
+            by_currency.setdefault(currency, []).append((date, rate))
+        self.dates = {}
+        self.rates = {}
+        for currency, entries in by_currency.items():
+            entries.sort()
+            self.dates[currency] = [date for date, _ in entries]
+            self.rates[currency] = [rate for _, rate in entries]
+
+    def rate_at(self, currency, date):
+        """
+        Get the rate of a currency on a date: the latest rate on or before the date,
+        or the earliest known rate for dates before the first one.
+
+        Args:
+            currency (str): The currency code.
+            date (str): The date as 'YYYY-MM-DD'.
+
+        Returns:
+            float: Value of one unit of the currency in the pivot currency.
+        """
+        if currency == self.pivot:
+            return 1.0
+        if currency not in self.dates:
+            raise ValueError(f"No FX rates loaded for currency '{currency}'")
+        position = bisect_right(self.dates[currency], date or '')
+        return self.rates[currency][max(position - 1, 0)]
+
+    def convert(self, amount, currency, target, date):
+        """
+        Convert a single amount at the rates of a date. The cross rate is cached per
+        currency pair and date, so converting many amounts costs one dictionary lookup
+        each rather than two rate searches.
+
+        Args:
+            amount (float): The amount in the source currency.
+            currency (str): The source currency.
+            target (str): The currency to convert to.
+            date (str): The date as 'YYYY-MM-DD'.
+
+        Returns:
+            float: The converted amount.
+        """
+        if currency == target:
+            return amount
+        key = (currency, target, date)
+        rate = self.cross_rates.get(key)
+        if rate is None:
+            rate = self.cross_rates[key] = self.rate_at(currency, date) / self.rate_at(target, date)
+        return amount * rate
+
+    def convert_totals(self, groups, target):
+        """
+        Convert many per-date totals at once with a sort-merge over the rate arrays.
+
+        The groups are sorted by currency and date, so each rate search starts from
+        the previous group's position instead of the start of the rate array; small
+        inputs such as one user's report do not walk the whole rate history. Rates of
+        the target currency are looked up once per distinct date.
+
+        Args:
+            groups (iterable): (key, currency, date, amount) tuples.
+            target (str): The currency to convert to.
+
+        Returns:
+            dict: The converted amounts summed per key.
+        """
+        totals = {}
+        target_rates = {}
+        current_currency, dates, rates, position = None, None, None, 0
+        for key, currency, date, amount in sorted(groups, key=lambda group: (group[1], group[2] or '')):
+            date = date or ''
+            if currency != current_currency:
+                current_currency, position = currency, 0
+                if currency == self.pivot:
+                    dates, rates = [''], [1.0]
+                elif currency in self.dates:
+                    dates, rates = self.dates[currency], self.rates[currency]
+                else:
+                    raise ValueError(f"No FX rates loaded for currency '{currency}'")
+            position = max(bisect_right(dates, date, position) - 1, position)
+
+            value = amount * rates[position]
+            if target != self.pivot:
+                if date not in target_rates:
+                    target_rates[date] = self.rate_at(target, date)
+                value /= target_rates[date]
+            totals[key] = totals.get(key, 0) + value
+        return totals
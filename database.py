@@ -1,9 +1,48 @@
+import csv
+import json
+import os
 import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+import instrumentation
+from currency import DEFAULT_CURRENCY, FxRateIndex
+from sketches import SpendStatistics
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
 from reportlab.lib import colors
 
-db_connection = sqlite3.connect('finance.db')  # This should establish a connection to the database
+# Path of the database used by the functions below; benchmarks and tools can point it elsewhere
+DATABASE_FILE = 'finance.db'
+
+db_connection = instrumentation.connect(DATABASE_FILE)  # This should establish a connection to the database
+
+# Read-optimized mode: report, budget and export functions reuse one tuned read-only
+# connection per thread instead of opening a new connection on every call
+READ_OPTIMIZED = False
+READ_MMAP_SIZE = 16 * 1024 ** 3  # Bytes of the file to memory-map (SQLite clamps this to its compile-time limit)
+READ_CACHE_SIZE_KIB = 256 * 1024  # Page cache size per read connection
+READ_STATEMENT_CACHE = 512  # Prepared statements kept per read connection
+
+read_connections = threading.local()
+
+# Reporting replica: when REPLICA_FILE is set, the report, budget and export functions
+# read from a snapshot copy of DATABASE_FILE that is at most REPLICA_MAX_STALENESS
+# seconds old, so long scans never hold locks on the database the app writes to
+REPLICA_FILE = None
+REPLICA_MAX_STALENESS = 60.0
+replica_state = {'source': None, 'refreshed_at': None, 'generation': 0, 'copy_seconds': None, 'refreshing': False}
+replica_lock = threading.Lock()
+replica_refresher = None
+replica_stop = threading.Event()
+replica_wakeup = threading.Event()
+
+# FX rate index per database file (or in-memory connection), with the fx_rates version it was built from
+fx_index_cache = {}
+FX_INDEX_CACHE_SIZE = 16  # Indexes kept; the oldest is dropped first
+
+# Columns copied to and read from the yearly tables of the archive database
+ARCHIVE_COLUMNS = "id, user_id, amount, category, type, date, currency, category_id"
 
 # Function to create a database connection
 def create_connection(db_file):
@@ -16,22 +55,286 @@ def create_connection(db_file):
     Returns:
         conn (sqlite3.Connection): SQLite database connection object.
     """
-    conn = sqlite3.connect(db_file)
+    conn = instrumentation.connect(db_file)
+    return conn
+
+# Function to create a read-only database connection
+def create_readonly_connection(db_file=None):
+    """
+    Create a read-only connection to a SQLite database.
+
+    The database is opened through a URI with mode=ro, so any attempt to write
+    through this connection raises sqlite3.OperationalError. Used by reporting
+    jobs that must never modify the ledger.
+
+    Args:
+        db_file (str, optional): The database file path. Defaults to DATABASE_FILE.
+
+    Returns:
+        conn (sqlite3.Connection): Read-only SQLite database connection object.
+    """
+    db_file = db_file or DATABASE_FILE
+    conn = instrumentation.connect(f"file:{db_file}?mode=ro", uri=True, cached_statements=READ_STATEMENT_CACHE)
+    # Tune the connection for large scans: memory-mapped reads, a large page cache
+    # and in-memory temporary tables for GROUP BY/ORDER BY
+    conn.execute(f"PRAGMA mmap_size = {READ_MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = -{READ_CACHE_SIZE_KIB}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA query_only = ON")
+    return conn
+
+# Function to switch the read-optimized connection mode on or off
+def set_read_optimized(enabled=True):
+    """
+    Switch the read-optimized mode for the report, budget and export functions.
+
+    When enabled, those functions reuse a per-thread connection from
+    get_read_connection, keeping its page cache and prepared statements warm
+    between calls. Disabling closes the calling thread's read connections.
+
+    Args:
+        enabled (bool): True to enable the mode, False to disable it.
+    """
+    global READ_OPTIMIZED
+    READ_OPTIMIZED = enabled
+    if not enabled:
+        close_read_connections()
+
+# Function to get the calling thread's tuned read-only connection
+def get_read_connection():
+    """
+    Get the calling thread's read-only connection to DATABASE_FILE, opening it on first use.
+
+    Returns:
+        conn (sqlite3.Connection): Read-only connection created by create_readonly_connection.
+    """
+    connections = read_connections.__dict__.setdefault('by_file', {})
+    conn = connections.get(DATABASE_FILE)
+    if conn is None:
+        conn = connections[DATABASE_FILE] = create_readonly_connection(DATABASE_FILE)
     return conn
 
+# Function to close the calling thread's read-only connections
+def close_read_connections():
+    """
+    Close the read-only connections opened by get_read_connection in the calling thread.
+    """
+    for conn in read_connections.__dict__.pop('by_file', {}).values():
+        conn.close()
+    replica = read_connections.__dict__.pop('replica', None)
+    if replica:
+        replica[1].close()
+
+# Function to refresh the reporting replica
+def refresh_replica(max_age=None, wait=True):
+    """
+    Copy DATABASE_FILE to REPLICA_FILE with the SQLite backup API.
+
+    The copy is written to a temporary file in one backup step, which reads a single
+    consistent snapshot. enable_replica puts the database in WAL mode, where that
+    snapshot read does not stop writers from committing, so the copy never blocks
+    the writer however large the database is. The finished file then atomically
+    replaces the replica, so reports that are still running on the previous
+    snapshot are not disturbed.
+
+    Args:
+        max_age (float, optional): Skip the refresh if the replica of the current
+            DATABASE_FILE is younger than this many seconds.
+        wait (bool): If another thread is refreshing the replica, wait for it and
+            then check again; with False, return at once and keep the current snapshot.
+
+    Returns:
+        bool: True if the replica was refreshed.
+    """
+    if not REPLICA_FILE:
+        raise ValueError("The reporting replica is not enabled")
+    if not replica_lock.acquire(blocking=wait):
+        return False
+    try:
+        refreshed_at = replica_state['refreshed_at']
+        if (max_age is not None and refreshed_at is not None and replica_state['source'] == DATABASE_FILE
+                and time.time() - refreshed_at <= max_age):
+            return False
+
+        started = time.time()
+        replica_state['refreshing'] = True
+        temp_file = REPLICA_FILE + '.tmp'
+        source = create_connection(DATABASE_FILE)
+        target = sqlite3.connect(temp_file)
+        try:
+            source.backup(target)
+            # The copy inherits WAL mode; a rollback-journal replica opens read-only without -shm/-wal files
+            target.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            target.close()
+            source.close()
+            replica_state['refreshing'] = False
+        os.replace(temp_file, REPLICA_FILE)
+        replica_state.update(source=DATABASE_FILE, refreshed_at=started,
+                             generation=replica_state['generation'] + 1, copy_seconds=time.time() - started)
+    finally:
+        replica_lock.release()
+    return True
+
+# Function to refresh the replica in the background
+def _refresh_replica_periodically(interval):
+    while not replica_stop.is_set():
+        replica_wakeup.wait(interval)
+        replica_wakeup.clear()
+        if replica_stop.is_set():
+            break
+        try:
+            refresh_replica()
+        except sqlite3.Error as e:
+            print(f"Error refreshing the reporting replica: {e}")
+
+# Function to ask the background refresher for a refresh now
+def request_replica_refresh():
+    """
+    Wake the background refresher so the replica picks up a write without waiting
+    for the next interval, e.g. after the user enters a transaction. Does nothing
+    when no refresher is running.
+    """
+    if replica_refresher is not None:
+        replica_wakeup.set()
+
+# Function to enable the reporting replica
+def enable_replica(replica_file=None, max_staleness=60.0, refresh_interval=None):
+    """
+    Route the report, budget and export functions to a snapshot copy of DATABASE_FILE.
+
+    DATABASE_FILE is switched to WAL mode (a persistent setting of the file) so that
+    copying it never delays a commit. Reads are served from the replica as long as it
+    is at most max_staleness seconds old; an older replica is refreshed on the next
+    read, unless a refresh is already running, in which case the read is served from
+    the current snapshot. With refresh_interval, a background thread refreshes the
+    replica periodically, so with an interval below max_staleness reads never copy.
+
+    Args:
+        replica_file (str, optional): Path of the replica. Defaults to DATABASE_FILE
+            with '.replica' before the extension.
+        max_staleness (float): Maximum age in seconds of the data served to reads.
+        refresh_interval (float, optional): Seconds between background refreshes.
+
+    Returns:
+        str: The replica file path.
+    """
+    global REPLICA_FILE, REPLICA_MAX_STALENESS, replica_refresher
+    disable_replica()
+    root, extension = os.path.splitext(DATABASE_FILE)
+    REPLICA_FILE = replica_file or f"{root}.replica{extension or '.db'}"
+    REPLICA_MAX_STALENESS = max_staleness
+    replica_state.update(source=None, refreshed_at=None)
+    conn = create_connection(DATABASE_FILE)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.close()
+    refresh_replica()
+
+    if refresh_interval:
+        replica_stop.clear()
+        replica_wakeup.clear()
+        replica_refresher = threading.Thread(target=_refresh_replica_periodically, args=(refresh_interval,),
+                                             name='replica-refresher', daemon=True)
+        replica_refresher.start()
+    return REPLICA_FILE
+
+# Function to disable the reporting replica
+def disable_replica():
+    """
+    Send reads back to DATABASE_FILE and stop the background refresher. The replica
+    file is left on disk.
+    """
+    global REPLICA_FILE, replica_refresher
+    if replica_refresher is not None:
+        replica_stop.set()
+        replica_wakeup.set()
+        replica_refresher.join()
+        replica_refresher = None
+    REPLICA_FILE = None
+    replica = read_connections.__dict__.pop('replica', None)
+    if replica:
+        replica[1].close()
+
+# Function to get the calling thread's connection to the replica
+def get_replica_connection():
+    """
+    Get the calling thread's read-only connection to the reporting replica, refreshing
+    the replica first if it is older than REPLICA_MAX_STALENESS and reopening the
+    connection after each refresh. While another thread is refreshing, the current
+    snapshot is served instead of waiting for the copy.
+
+    Returns:
+        conn (sqlite3.Connection): Read-only connection created by create_readonly_connection.
+    """
+    refresh_replica(max_age=REPLICA_MAX_STALENESS, wait=False)
+    generation = replica_state['generation']
+    replica = read_connections.__dict__.get('replica')
+    if replica is None or replica[0] != generation:
+        if replica:
+            replica[1].close()
+        replica = read_connections.replica = (generation, create_readonly_connection(REPLICA_FILE))
+    return replica[1]
+
+# Function to pick the connection used by a read-only function
+def _read_connection(conn=None):
+    """
+    Choose the connection for a read-only query: the caller's connection if given,
+    the reporting replica when enabled, the shared read connection in read-optimized
+    mode, or else a new connection.
+
+    Args:
+        conn (sqlite3.Connection, optional): Connection passed in by the caller.
+
+    Returns:
+        tuple: (connection, True if the caller must close it)
+    """
+    if conn is not None:
+        return conn, False
+    if REPLICA_FILE:
+        return get_replica_connection(), False
+    if READ_OPTIMIZED:
+        return get_read_connection(), False
+    return create_connection(DATABASE_FILE), True
+
+# Function to list the IDs of all registered users
+def get_all_user_ids(conn):
+    """
+    Get the IDs of all registered users, in ascending order.
+
+    Args:
+        conn (sqlite3.Connection): Database connection.
+
+    Returns:
+        list: A list of user IDs.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM users ORDER BY id")
+    return [row[0] for row in cursor.fetchall()]
+
 # Function to generate financial report
-def get_report(user_id, period='monthly'):
+def get_report(user_id, period='monthly', conn=None, year=None, with_statistics=False, statistics=None):
     """ 
     Generate a financial report for the given user and period ('monthly' or 'yearly').
     
     Args:
         user_id (int): The user ID for whom the report is generated.
         period (str): The period for the report, either 'monthly' or 'yearly'. Default is 'monthly'.
+        conn (sqlite3.Connection, optional): Connection to reuse. If not given, a new
+            connection is opened and closed by this function (or, in read-optimized
+            mode, the shared read connection is used).
+        year (int, optional): For yearly reports, the calendar year to report on instead
+            of the current one. Archived years are read from the archive database.
+        with_statistics (bool): Also compute the expense count, median and 90th percentile
+            per category ('category_stats'). This reads every expense row of the period.
+        statistics (dict, optional): SpendStatistics per category that this user's expenses
+            are merged into, for summaries across many users. Implies with_statistics.
         
     Returns:
-        dict: A dictionary containing income, expense, savings, and the date range for the report.
+        dict: A dictionary containing income, expense, savings (in the user's base currency),
+        the currency, the date range for the report, and, if requested, the per-category
+        expense statistics.
     """
-    conn = create_connection('finance.db')
+    conn, owns_connection = _read_connection(conn)
     cursor = conn.cursor()
 
     # Get the current date for filtering the report
@@ -42,38 +345,45 @@ def get_report(user_id, period='monthly'):
         start_date = f"{current_date.year}-{current_date.month:02d}-01"
         end_date = f"{current_date.year}-{current_date.month:02d}-{current_date.day:02d}"
     elif period == 'yearly':
-        start_date = f"{current_date.year}-01-01"
-        end_date = f"{current_date.year}-12-31"
+        start_date = f"{year or current_date.year}-01-01"
+        end_date = f"{year or current_date.year}-12-31"
     else:
         raise ValueError("Period must be 'monthly' or 'yearly'")
 
-    # Fetch transactions for the specified period
-    cursor.execute('''SELECT SUM(amount), type FROM transactions
-                      WHERE user_id = ? AND date BETWEEN ? AND ?
-                      GROUP BY type''', (user_id, start_date, end_date))
-
-    transactions = cursor.fetchall()
-    income, expense = 0, 0
-
-    # Categorize income and expense
-    for transaction in transactions:
-        if transaction[1] == 'income':
-            income = transaction[0] or 0
-        elif transaction[1] == 'expense':
-            expense = transaction[0] or 0
+    # Sum the transactions for the specified period in the user's base currency
+    base_currency = get_user_base_currency(cursor, user_id)
+    totals = _totals_in_base_currency(cursor, user_id, base_currency, 'type', 'date BETWEEN ? AND ?',
+                                      (start_date, end_date), _transactions_source(conn, start_date, end_date))
+    income = totals.get('income', 0)
+    expense = totals.get('expense', 0)
 
     savings = income - expense
-    conn.close()
-
-    # Return the financial report as a dictionary
-    return {
+    report = {
         'income': income,
         'expense': expense,
         'savings': savings,
+        'currency': base_currency,
         'start_date': start_date,
         'end_date': end_date
     }
 
+    # Typical and high spend per category, from fixed-size sketches
+    if with_statistics or statistics is not None:
+        category_statistics = get_spending_statistics(user_id, start_date, end_date, conn)
+        if statistics is not None:
+            for category, category_stats in category_statistics.items():
+                statistics.setdefault(category, SpendStatistics()).merge(category_stats)
+        report['category_stats'] = {}
+        for category, category_stats in category_statistics.items():
+            median, p90 = category_stats.sketch.quantiles([0.5, 0.9])
+            report['category_stats'][category] = {'count': category_stats.stats.count, 'median': median, 'p90': p90}
+
+    if owns_connection:
+        conn.close()
+
+    # Return the financial report as a dictionary
+    return report
+
 # Function to create tables for users and transactions
 def create_tables():
     """ 
@@ -81,7 +391,7 @@ def create_tables():
     
     This function checks if the 'users' and 'transactions' tables exist, and if not, creates them.
     """
-    conn = create_connection('finance.db')
+    conn = create_connection(DATABASE_FILE)
     cursor = conn.cursor()
 
     # Create table for Users
@@ -102,8 +412,32 @@ def create_tables():
                         FOREIGN KEY(user_id) REFERENCES users(id)
                     )''')
 
+    # Currency columns, added to databases created before multi-currency support
+    _add_column_if_missing(cursor, 'users', 'base_currency', f"TEXT NOT NULL DEFAULT '{DEFAULT_CURRENCY}'")
+    _add_column_if_missing(cursor, 'transactions', 'currency', f"TEXT NOT NULL DEFAULT '{DEFAULT_CURRENCY}'")
+
     conn.commit()
     conn.close()
+    create_change_log_table()
+    create_daily_balances_table()
+    create_fx_rates_table()
+    create_archive_tables()
+    create_categories_table()
+
+# Function to add a column to an existing table
+def _add_column_if_missing(cursor, table_name, column_name, definition):
+    """
+    Add a column to a table unless it already has it.
+
+    Args:
+        cursor (sqlite3.Cursor): Database cursor.
+        table_name (str): The table to alter.
+        column_name (str): The column to add.
+        definition (str): The column type and constraints.
+    """
+    cursor.execute(f"PRAGMA table_info({table_name})")
+    if column_name not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {definition}")
 
 # Function to register a new user
 def register_user(conn, username, password):
@@ -142,7 +476,7 @@ def authenticate_user(username, password):
     Returns:
         int or None: The user ID if authentication is successful, otherwise None.
     """
-    conn = create_connection('finance.db')
+    conn = create_connection(DATABASE_FILE)
     cursor = conn.cursor()
 
     # Check if the user exists and if the password matches
@@ -155,7 +489,8 @@ def authenticate_user(username, password):
     else:
         return None  # Authentication failed
 
-def add_transaction(db_connection, user_id, transaction_type, amount, description, category):
+def add_transaction(db_connection, user_id, transaction_type, amount, description, category, date=None,
+                    currency=None):
     """ 
     Add a new transaction (income or expense) to the database for a specified user.
     
@@ -163,29 +498,59 @@ def add_transaction(db_connection, user_id, transaction_type, amount, descriptio
         db_connection (sqlite3.Connection): Database connection.
         user_id (int): The user ID of the user adding the transaction.
         amount (float): The amount of the transaction.
-        category (str): The category of the transaction (e.g., 'food', 'salary').
+        category (str): The category of the transaction (e.g., 'food', 'salary'), or a
+            path in the category hierarchy (e.g., 'Food > Groceries').
         transaction_type (str): The type of transaction ('income' or 'expense').
+        date (str, optional): Transaction date as 'YYYY-MM-DD'. Defaults to today;
+            earlier dates may be given for backdated entries.
+        currency (str, optional): Currency code of the amount. Defaults to the user's base currency.
+
+    Raises:
+        ValueError: If the amount cannot be converted to the user's base currency
+            because no FX rates are loaded for one of the currencies. Nothing is written.
     """
     cursor = db_connection.cursor()
+    date = date or datetime.now().strftime("%Y-%m-%d")
+    base_currency = get_user_base_currency(cursor, user_id)
+    currency = currency or base_currency
+    if currency != base_currency:
+        # Fail before any write, so the caller's connection is not left with a half-applied transaction
+        get_fx_index(db_connection).convert(amount, currency, base_currency, date)
+    category, category_id = resolve_category(cursor, category)
     
     # Insert the transaction using user_id instead of username
-    cursor.execute('''INSERT INTO transactions (user_id, amount, category, type) 
-                      VALUES (?, ?, ?, ?)''', (user_id, amount, category, transaction_type))
+    cursor.execute('''INSERT INTO transactions (user_id, amount, category, category_id, type, date, currency) 
+                      VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                   (user_id, amount, category, category_id, transaction_type, date, currency))
+    transaction_id = cursor.lastrowid
+    apply_to_daily_balances(cursor, user_id, transaction_type, amount, date, currency, base_currency=base_currency)
+    record_change(cursor, 'transactions', 'insert', transaction_id)
     db_connection.commit()
 
-def view_transactions(db_connection, user_id):
+def view_transactions(db_connection, user_id, start_date=None, end_date=None):
     """ 
     View all transactions (income or expense) for a specified user.
     
     Args:
         db_connection (sqlite3.Connection): Database connection.
         user_id (int): The user ID whose transactions are to be viewed.
+        start_date (str, optional): Only show transactions on or after this date ('YYYY-MM-DD').
+        end_date (str, optional): Only show transactions on or before this date ('YYYY-MM-DD').
         
     Returns:
         list: A list of transactions for the user, including amount, category, and type.
     """
     cursor = db_connection.cursor()
-    cursor.execute("SELECT id, amount, category, type, date FROM transactions WHERE user_id = ?", (user_id,))
+    source = _transactions_source(db_connection, start_date, end_date)
+    condition, parameters = "user_id = ?", [user_id]
+    if start_date:
+        condition += " AND date >= ?"
+        parameters.append(start_date)
+    if end_date:
+        condition += " AND date <= ?"
+        parameters.append(end_date + '\uffff')
+    cursor.execute(f"SELECT id, amount, category, type, date FROM {source} WHERE {condition} ORDER BY id",
+                   parameters)
     transactions = cursor.fetchall()
 
     if not transactions:
@@ -209,11 +574,13 @@ def delete_transaction(db_connection, transaction_id, user_id):
     cursor = db_connection.cursor()
 
     # Check if the transaction exists and if the user is the owner
-    cursor.execute("SELECT user_id FROM transactions WHERE id = ?", (transaction_id,))
+    cursor.execute("SELECT user_id, type, amount, date, currency FROM transactions WHERE id = ?", (transaction_id,))
     transaction = cursor.fetchone()
 
     if transaction and transaction[0] == user_id:
         cursor.execute("DELETE FROM transactions WHERE id = ?", (transaction_id,))
+        apply_to_daily_balances(cursor, *transaction, sign=-1)
+        record_change(cursor, 'transactions', 'delete', transaction_id, user_id)
         db_connection.commit()
         print(f"Transaction {transaction_id} deleted successfully.")
     else:
@@ -230,12 +597,21 @@ def update_transaction(transaction_id, amount, category, transaction_type):
         category (str): The new category for the transaction.
         transaction_type (str): The new type of transaction ('income' or 'expense').
     """
-    conn = create_connection('finance.db')
+    conn = create_connection(DATABASE_FILE)
     cursor = conn.cursor()
 
+    cursor.execute("SELECT user_id, type, amount, date, currency FROM transactions WHERE id = ?", (transaction_id,))
+    previous = cursor.fetchone()
+    category, category_id = resolve_category(cursor, category)
+
     # Update the transaction details in the database
-    cursor.execute('''UPDATE transactions SET amount = ?, category = ?, type = ? WHERE id = ?''',
-                   (amount, category, transaction_type, transaction_id))
+    cursor.execute('''UPDATE transactions SET amount = ?, category = ?, category_id = ?, type = ? WHERE id = ?''',
+                   (amount, category, category_id, transaction_type, transaction_id))
+    if previous:
+        user_id, _, _, date, currency = previous
+        apply_to_daily_balances(cursor, *previous, sign=-1)
+        apply_to_daily_balances(cursor, user_id, transaction_type, amount, date, currency)
+        record_change(cursor, 'transactions', 'update', transaction_id)
     conn.commit()
     conn.close()
 
@@ -250,7 +626,7 @@ def create_budget_table():
     Returns:
         None
     """
-    conn = create_connection('finance.db')
+    conn = create_connection(DATABASE_FILE)
     cursor = conn.cursor()
 
     # Create table for Budgets if it doesn't exist
@@ -263,6 +639,10 @@ def create_budget_table():
                         FOREIGN KEY(user_id) REFERENCES users(id)
                     )''')
 
+    # Budgets reference a node of the category hierarchy
+    _add_column_if_missing(cursor, 'budgets', 'category_id', "INTEGER REFERENCES categories(id)")
+    backfill_category_ids(conn)
+
     conn.commit()
     conn.close()
 
@@ -271,70 +651,134 @@ def set_budget(user_id, category, amount, period='monthly'):
     """
     Set or update a budget for a specific category and period.
 
+    A budget on a parent category (e.g., 'Food') also covers all of its subcategories
+    (e.g., 'Food > Groceries').
+
     Parameters:
         user_id (int): The ID of the user.
-        category (str): The budget category (e.g., 'food', 'transport').
+        category (str): The budget category (e.g., 'food', 'transport') or category path.
         amount (float): The budget amount.
         period (str): The budget period ('monthly' or 'yearly'). Default is 'monthly'.
 
     Returns:
         None
     """
-    conn = create_connection('finance.db')
+    conn = create_connection(DATABASE_FILE)
     cursor = conn.cursor()
+    category, category_id = resolve_category(cursor, category)
 
     # Check if the user already has a budget for the given category and period
-    cursor.execute('''SELECT * FROM budgets WHERE user_id = ? AND category = ? AND period = ?''', 
-                   (user_id, category, period))
+    cursor.execute('''SELECT * FROM budgets WHERE user_id = ? AND category_id = ? AND period = ?''', 
+                   (user_id, category_id, period))
     existing_budget = cursor.fetchone()
 
     if existing_budget:
         # Update the existing budget
-        cursor.execute('''UPDATE budgets SET amount = ? WHERE user_id = ? AND category = ? AND period = ?''',
-                       (amount, user_id, category, period))
+        cursor.execute('''UPDATE budgets SET amount = ? WHERE id = ?''', (amount, existing_budget[0]))
+        record_change(cursor, 'budgets', 'update', existing_budget[0])
     else:
         # Insert a new budget
-        cursor.execute('''INSERT INTO budgets (user_id, category, amount, period)
-                          VALUES (?, ?, ?, ?)''', (user_id, category, amount, period))
+        cursor.execute('''INSERT INTO budgets (user_id, category, category_id, amount, period)
+                          VALUES (?, ?, ?, ?, ?)''', (user_id, category, category_id, amount, period))
+        record_change(cursor, 'budgets', 'insert', cursor.lastrowid)
     
     conn.commit()
     conn.close()
 
 # Function to get a user's budget for a specific period
-def get_budget(user_id, period='monthly'):
+def get_budget(user_id, period='monthly', conn=None):
     """
     Get all budgets for a user in a specific period.
 
     Parameters:
         user_id (int): The ID of the user.
         period (str): The budget period ('monthly' or 'yearly'). Default is 'monthly'.
+        conn (sqlite3.Connection, optional): Connection to reuse.
 
     Returns:
         list: A list of tuples, each containing a budget category and amount.
     """
-    conn = create_connection('finance.db')
+    conn, owns_connection = _read_connection(conn)
     cursor = conn.cursor()
 
     cursor.execute('''SELECT category, amount FROM budgets WHERE user_id = ? AND period = ?''',
                    (user_id, period))
     budgets = cursor.fetchall()
 
-    conn.close()
+    if owns_connection:
+        conn.close()
     return budgets
 
+# Function to compare a user's budgets with their expenses
+def get_budget_status(user_id, period='monthly', conn=None):
+    """
+    Compare each of a user's budgets with the expenses recorded in its category
+    for the current month or year.
+
+    Parameters:
+        user_id (int): The ID of the user.
+        period (str): The budget period ('monthly' or 'yearly'). Default is 'monthly'.
+        conn (sqlite3.Connection, optional): Connection to reuse. If not given, a new
+            connection is opened and closed by this function (or, in read-optimized
+            mode, the shared read connection is used).
+
+    Returns:
+        list: A list of dictionaries with the category, budget, total expenses (in the
+        user's base currency, including subcategories) and whether the budget has been exceeded.
+    """
+    conn, owns_connection = _read_connection(conn)
+    cursor = conn.cursor()
+
+    current_date = datetime.now()
+    if period == 'monthly':
+        date_pattern = f"{current_date.year}-{current_date.month:02d}%"
+    else:
+        date_pattern = f"{current_date.year}%"
+
+    cursor.execute("SELECT category, amount, category_id FROM budgets WHERE user_id = ? AND period = ?",
+                   (user_id, period))
+    budgets = cursor.fetchall()
+
+    # Expenses for the period under each budgeted category, including its subcategories,
+    # in the user's base currency. The closure table turns this into one indexed query.
+    expenses = {}
+    if budgets:
+        budget_ids = [budget[2] for budget in budgets]
+        placeholders = ", ".join("?" * len(budget_ids))
+        expenses = _totals_in_base_currency(
+            cursor, user_id, get_user_base_currency(cursor, user_id), 'category_closure.ancestor_id',
+            f"type = 'expense' AND date LIKE ? AND category_closure.ancestor_id IN ({placeholders})",
+            (date_pattern, *budget_ids),
+            "transactions JOIN category_closure ON category_closure.descendant_id = transactions.category_id")
+
+    statuses = []
+    for category, budget_amount, category_id in budgets:
+        total_expenses = expenses.get(category_id, 0)  # Default to 0 if no expenses
+        statuses.append({
+            'category': category,
+            'budget': budget_amount,
+            'total_expenses': total_expenses,
+            'exceeded': total_expenses > budget_amount
+        })
+
+    if owns_connection:
+        conn.close()
+    return statuses
+
 # Function to fetch total expenses for a user in a specific period
-def get_total_expenses(user_id, period='monthly'):
+def get_total_expenses(user_id, period='monthly', conn=None):
     """
     Get the total expenses for the user in a given period.
 
     Parameters:
         user_id (int): The ID of the user.
         period (str): The period for calculating expenses ('monthly' or 'yearly'). Default is 'monthly'.
+        conn (sqlite3.Connection, optional): Connection to reuse.
 
     Returns:
-        float: The total amount of expenses in the given period.
+        float: The total amount of expenses in the given period, in the user's base currency.
     """
-    conn = create_connection('finance.db')
+    conn, owns_connection = _read_connection(conn)
     cursor = conn.cursor()
 
     current_date = datetime.now()
@@ -345,51 +789,1008 @@ def get_total_expenses(user_id, period='monthly'):
         start_date = f"{current_date.year}-01-01"
         end_date = f"{current_date.year}-12-31"
     
-    # Fetch total expenses within the period
-    cursor.execute('''SELECT SUM(amount) FROM transactions
-                      WHERE user_id = ? AND type = 'expense' AND date BETWEEN ? AND ?''', 
+    # Sum the expenses within the period in the user's base currency, as get_report does
+    totals = _totals_in_base_currency(cursor, user_id, get_user_base_currency(cursor, user_id), 'type',
+                                      "type = 'expense' AND date BETWEEN ? AND ?", (start_date, end_date),
+                                      _transactions_source(conn, start_date, end_date))
+    total_expenses = totals.get('expense', 0)  # Default to 0 if no expenses
+
+    if owns_connection:
+        conn.close()
+    return total_expenses
+
+# Function to create the daily balances table
+def create_daily_balances_table():
+    """
+    Create the table of per-user daily running balances.
+
+    Each row holds the net amount of one user's transactions on one date ('net') and
+    the running balance up to and including that date ('balance'), i.e. a prefix sum
+    over the ledger. Both are in the user's base currency: foreign-currency
+    transactions are converted at the rate of their date when they are applied. The (user_id, date) key makes balance lookups a single index
+    seek. The table is kept up to date by the transaction write functions; when it
+    is first created it is filled from the existing transactions.
+
+    Returns:
+        None
+    """
+    conn = create_connection(DATABASE_FILE)
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_balances'")
+    table_exists = cursor.fetchone() is not None
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS daily_balances (
+                        user_id INTEGER NOT NULL,
+                        date TEXT NOT NULL,
+                        net REAL NOT NULL,
+                        balance REAL NOT NULL,
+                        PRIMARY KEY (user_id, date)
+                    ) WITHOUT ROWID''')
+
+    # Populate the balances of an existing ledger the first time the table is created
+    if not table_exists:
+        rebuild_daily_balances(conn)
+
+    conn.commit()
+    conn.close()
+
+# Function to apply a transaction to the daily balances
+def apply_to_daily_balances(cursor, user_id, transaction_type, amount, date, currency=None, sign=1,
+                            base_currency=None):
+    """
+    Add a transaction to (sign=1) or remove it from (sign=-1) the daily balances.
+
+    Only the transaction's date and the dates after it are touched, so a backdated
+    entry repairs the suffix of the running balance rather than rebuilding it.
+    Must be called on the writing cursor, before the commit.
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor of the writing connection.
+        user_id (int): The owner of the transaction.
+        transaction_type (str): 'income' or 'expense'; other types do not change the balance.
+        amount (float): The transaction amount.
+        date (str): The transaction date ('YYYY-MM-DD'); undated transactions are ignored.
+        currency (str, optional): The transaction currency; converted to the user's base
+            currency if different. Defaults to the base currency.
+        sign (int): 1 to add the transaction, -1 to remove it.
+        base_currency (str, optional): The user's base currency, if the caller already
+            looked it up; saves a query per write.
+
+    Returns:
+        None
+    """
+    if not date or transaction_type not in ('income', 'expense'):
+        return
+    base_currency = base_currency or get_user_base_currency(cursor, user_id)
+    if currency and currency != base_currency:
+        amount = get_fx_index(cursor.connection).convert(amount, currency, base_currency, date)
+    delta = sign * (amount if transaction_type == 'income' else -amount)
+    date = date[:10]
+
+    cursor.execute('''UPDATE daily_balances SET net = net + ?, balance = balance + ?
+                      WHERE user_id = ? AND date = ?''', (delta, delta, user_id, date))
+    if cursor.rowcount == 0:
+        cursor.execute('''SELECT balance FROM daily_balances WHERE user_id = ? AND date < ?
+                          ORDER BY date DESC LIMIT 1''', (user_id, date))
+        previous = cursor.fetchone()
+        cursor.execute('''INSERT INTO daily_balances (user_id, date, net, balance) VALUES (?, ?, ?, ?)''',
+                       (user_id, date, delta, (previous[0] if previous else 0) + delta))
+
+    # Shift the running balance of every later date
+    cursor.execute('''UPDATE daily_balances SET balance = balance + ? WHERE user_id = ? AND date > ?''',
+                   (delta, user_id, date))
+
+# Function to rebuild the daily balances from the transactions table
+def rebuild_daily_balances(conn, user_id=None):
+    """
+    Recompute the daily balances from scratch, for one user or for everybody.
+    Used to populate the table for existing ledgers, after bulk imports that
+    bypass add_transaction, and when base currencies or FX rates change.
+
+    Base-currency amounts are summed per user and day in SQL; foreign-currency
+    groups are converted in one sort-merge pass over the rate index.
+
+    Args:
+        conn (sqlite3.Connection): Database connection.
+        user_id (int, optional): Only rebuild this user's balances.
+
+    Returns:
+        None
+    """
+    cursor = conn.cursor()
+    user_filter = "AND user_id = ?" if user_id is not None else ""
+    transaction_filter = "AND t.user_id = ?" if user_id is not None else ""
+    parameters = (user_id,) if user_id is not None else ()
+
+    cursor.execute(f"DELETE FROM daily_balances WHERE 1 = 1 {user_filter}", parameters)
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS balance_nets (user_id INTEGER, day TEXT, net REAL)")
+    cursor.execute("DELETE FROM balance_nets")
+
+    # Net per user, day and currency, with the user's base currency alongside
+    cursor.execute(f'''SELECT t.user_id, substr(t.date, 1, 10) AS day, t.currency,
+                              COALESCE(users.base_currency, ?) AS base_currency,
+                              SUM(CASE t.type WHEN 'income' THEN t.amount ELSE -t.amount END)
+                       FROM {_transactions_source(conn)} AS t LEFT JOIN users ON users.id = t.user_id
+                       WHERE t.date IS NOT NULL AND t.type IN ('income', 'expense') {transaction_filter}
+                       GROUP BY t.user_id, day, t.currency''', (DEFAULT_CURRENCY,) + parameters)
+    foreign_groups = {}
+    batch = []
+    for row_user_id, day, currency, base_currency, net in cursor:
+        if currency == base_currency:
+            batch.append((row_user_id, day, net))
+        else:
+            foreign_groups.setdefault(base_currency, []).append(((row_user_id, day), currency, day, net))
+    for base_currency, groups in foreign_groups.items():
+        converted = get_fx_index(conn).convert_totals(groups, base_currency)
+        batch.extend((row_user_id, day, net) for (row_user_id, day), net in converted.items())
+    cursor.executemany("INSERT INTO balance_nets (user_id, day, net) VALUES (?, ?, ?)", batch)
+
+    cursor.execute('''INSERT INTO daily_balances (user_id, date, net, balance)
+                      SELECT user_id, day, net, SUM(net) OVER (PARTITION BY user_id ORDER BY day)
+                      FROM (SELECT user_id, day, SUM(net) AS net FROM balance_nets GROUP BY user_id, day)''')
+    cursor.execute("DELETE FROM balance_nets")
+    conn.commit()
+
+# Function to get a user's balance on a date
+def get_balance_at(user_id, date, conn=None):
+    """
+    Get a user's balance (all income minus all expenses) at the end of a date.
+
+    This is one seek on the daily balances key, independent of the ledger size.
+
+    Args:
+        user_id (int): The ID of the user.
+        date (str): The date as 'YYYY-MM-DD'.
+        conn (sqlite3.Connection, optional): Connection to reuse.
+
+    Returns:
+        float: The balance, or 0 if the user had no transactions up to that date.
+    """
+    conn, owns_connection = _read_connection(conn)
+    cursor = conn.cursor()
+
+    cursor.execute('''SELECT balance FROM daily_balances WHERE user_id = ? AND date <= ?
+                      ORDER BY date DESC LIMIT 1''', (user_id, date))
+    row = cursor.fetchone()
+
+    if owns_connection:
+        conn.close()
+    return row[0] if row else 0
+
+# Function to get a user's balance over a date range
+def get_balance_series(user_id, start_date, end_date, conn=None):
+    """
+    Get a user's balance over a date range for charting, with one range read.
+
+    The first point is the opening balance on start_date; after that there is one
+    point per date with transactions, and the balance is constant in between.
+
+    Args:
+        user_id (int): The ID of the user.
+        start_date (str): First date of the range ('YYYY-MM-DD').
+        end_date (str): Last date of the range ('YYYY-MM-DD').
+        conn (sqlite3.Connection, optional): Connection to reuse.
+
+    Returns:
+        list: A list of (date, balance) tuples in date order.
+    """
+    conn, owns_connection = _read_connection(conn)
+    cursor = conn.cursor()
+
+    cursor.execute('''SELECT date, balance FROM daily_balances WHERE user_id = ? AND date <= ?
+                      ORDER BY date DESC LIMIT 1''', (user_id, start_date))
+    opening = cursor.fetchone()
+    cursor.execute('''SELECT date, balance FROM daily_balances
+                      WHERE user_id = ? AND date > ? AND date <= ? ORDER BY date''',
                    (user_id, start_date, end_date))
-    total_expenses = cursor.fetchone()[0] or 0  # Default to 0 if None
+    series = [(start_date, opening[1] if opening else 0)] + cursor.fetchall()
+
+    if owns_connection:
+        conn.close()
+    return series
+
+# Function to create the FX rates table
+def create_fx_rates_table():
+    """
+    Create the table of dated FX rates used to convert reports to a user's base currency.
+
+    Each rate is the value of one unit of the currency in DEFAULT_CURRENCY, valid from
+    its date until the currency's next rate.
+
+    'fx_rates_version' holds a single value that triggers set to a new random number
+    on every insert, update or delete of a rate, however it is made, so cached rate
+    indexes can tell cheaply whether they are still current.
 
+    Returns:
+        None
+    """
+    conn = create_connection(DATABASE_FILE)
+    cursor = conn.cursor()
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS fx_rates (
+                        currency TEXT NOT NULL,
+                        date TEXT NOT NULL,
+                        rate REAL NOT NULL,
+                        PRIMARY KEY (currency, date)
+                    )''')
+    cursor.execute("CREATE TABLE IF NOT EXISTS fx_rates_version (version INTEGER NOT NULL)")
+    cursor.execute("INSERT INTO fx_rates_version (version) SELECT random() WHERE NOT EXISTS (SELECT 1 FROM fx_rates_version)")
+    for operation in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS fx_rates_{operation.lower()}_version
+                           AFTER {operation} ON fx_rates
+                           BEGIN UPDATE fx_rates_version SET version = random(); END''')
+
+    conn.commit()
     conn.close()
-    return total_expenses
 
-def backup_data():
+# Function to load FX rates from a CSV file
+def load_fx_rates(csv_path):
+    """
+    Load dated FX rates from a CSV file with 'date', 'currency' and 'rate' columns.
+    Rates already stored for the same currency and date are replaced, and the daily
+    balances are recomputed with the new rates.
+
+    Args:
+        csv_path (str): Path to the CSV file.
+
+    Returns:
+        int: The number of rates loaded.
+    """
+    with open(csv_path, newline='') as f:
+        rates = [(row['currency'].strip().upper(), row['date'].strip(), float(row['rate']))
+                 for row in csv.DictReader(f)]
+
+    conn = create_connection(DATABASE_FILE)
+    cursor = conn.cursor()
+    cursor.executemany("INSERT OR REPLACE INTO fx_rates (currency, date, rate) VALUES (?, ?, ?)", rates)
+    conn.commit()
+    rebuild_daily_balances(conn)
+    conn.close()
+    return len(rates)
+
+# Function to get the cached FX rate index
+def get_fx_index(conn):
+    """
+    Get the FX rate index for the connection's database, rebuilding it only when the
+    fx_rates table has changed since it was cached, as recorded in fx_rates_version.
+
+    Indexes are cached per database file; in-memory databases have no file, so each
+    connection to one gets its own entry.
+
+    Args:
+        conn (sqlite3.Connection): Database connection.
+
+    Returns:
+        FxRateIndex: The rate index.
+    """
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA database_list")
+    cache_key = cursor.fetchone()[2] or id(conn)
+    try:
+        cursor.execute("SELECT version FROM fx_rates_version")
+        version = cursor.fetchone()
+    except sqlite3.OperationalError:
+        version = None  # Database created before the version table; rebuilt on every call until create_tables runs
+
+    cached = fx_index_cache.get(cache_key)
+    if cached is None or version is None or cached[0] != version:
+        cursor.execute("SELECT currency, date, rate FROM fx_rates")
+        fx_index_cache.pop(cache_key, None)
+        while len(fx_index_cache) >= FX_INDEX_CACHE_SIZE:
+            fx_index_cache.pop(next(iter(fx_index_cache)))
+        cached = fx_index_cache[cache_key] = (version, FxRateIndex(cursor.fetchall(), DEFAULT_CURRENCY))
+    return cached[1]
+
+# Function to get a user's base currency
+def get_user_base_currency(cursor, user_id):
+    """
+    Get the currency a user's reports are shown in.
+
+    Args:
+        cursor (sqlite3.Cursor): Database cursor.
+        user_id (int): The ID of the user.
+
+    Returns:
+        str: The currency code, DEFAULT_CURRENCY if the user is unknown.
+    """
+    cursor.execute("SELECT base_currency FROM users WHERE id = ?", (user_id,))
+    row = cursor.fetchone()
+    return row[0] if row and row[0] else DEFAULT_CURRENCY
+
+# Function to set a user's base currency
+def set_base_currency(user_id, currency):
+    """
+    Set the currency a user's reports and balances are shown in. The user's daily
+    balances are recomputed in the new currency.
+
+    Args:
+        user_id (int): The ID of the user.
+        currency (str): The currency code (e.g., 'EUR').
+
+    Returns:
+        None
+    """
+    conn = create_connection(DATABASE_FILE)
+    cursor = conn.cursor()
+    cursor.execute("UPDATE users SET base_currency = ? WHERE id = ?", (currency.upper(), user_id))
+    conn.commit()
+    rebuild_daily_balances(conn, user_id)
+    conn.close()
+
+# Function to sum a user's transactions in their base currency
+def _totals_in_base_currency(cursor, user_id, base_currency, key_column, condition, parameters,
+                             source='transactions'):
+    """
+    Sum a user's transaction amounts per key column, converted to the base currency.
+
+    A single grouped scan sums base-currency amounts per key and foreign amounts per
+    key, currency and date. Only the foreign groups are converted, in one pass over
+    the cached rate index, so single-currency ledgers pay no conversion cost.
+
+    Args:
+        cursor (sqlite3.Cursor): Database cursor.
+        user_id (int): The ID of the user.
+        base_currency (str): The currency to convert to.
+        key_column (str): The column to group by ('type' or 'category').
+        condition (str): Extra SQL condition on the transactions.
+        parameters (tuple): Parameters for the condition.
+        source (str): Table or subquery to read the transactions from.
+
+    Returns:
+        dict: The total amount per key.
+    """
+    cursor.execute(f'''SELECT {key_column}, currency,
+                              CASE WHEN currency = ? THEN NULL ELSE date END AS fx_date,
+                              SUM(amount)
+                       FROM {source}
+                       WHERE user_id = ? AND {condition}
+                       GROUP BY {key_column}, currency, fx_date''', (base_currency, user_id) + parameters)
+    totals = {}
+    foreign_groups = []
+    for key, currency, date, total in cursor.fetchall():
+        if currency == base_currency:
+            totals[key] = totals.get(key, 0) + (total or 0)
+        else:
+            foreign_groups.append((key, currency, date, total or 0))
+
+    if foreign_groups:
+        converted = get_fx_index(cursor.connection).convert_totals(foreign_groups, base_currency)
+        for key, total in converted.items():
+            totals[key] = totals.get(key, 0) + total
+    return totals
+
+# Function to stream expenses through per-category sketches
+def get_spending_statistics(user_id=None, start_date=None, end_date=None, conn=None, statistics=None):
+    """
+    Compute per-category expense statistics (count, mean, spread and approximate
+    quantiles) by iterating over the cursor, so memory stays fixed however many
+    transactions are read.
+
+    Amounts are converted to the user's base currency, or to the default currency when
+    summarizing the whole ledger, with cross rates cached per currency and date.
+
+    Args:
+        user_id (int, optional): The ID of the user. All users if not given.
+        start_date (str, optional): First date to include ('YYYY-MM-DD').
+        end_date (str, optional): Last date to include ('YYYY-MM-DD').
+        conn (sqlite3.Connection, optional): Connection to reuse.
+        statistics (dict, optional): Existing SpendStatistics per category to add to,
+            so results from several calls or databases merge.
+
+    Returns:
+        dict: SpendStatistics per category.
+    """
+    conn, owns_connection = _read_connection(conn)
+    cursor = conn.cursor()
+    target_currency = get_user_base_currency(cursor, user_id) if user_id else DEFAULT_CURRENCY
+
+    conditions = ["type = 'expense'"]
+    parameters = []
+    for condition, value in (("user_id = ?", user_id), ("date >= ?", start_date), ("date <= ?", end_date)):
+        if value:
+            conditions.append(condition)
+            parameters.append(value)
+
+    statistics = {} if statistics is None else statistics
+    fx_index = None
+    cursor.execute(f'''SELECT category, amount, currency, date FROM {_transactions_source(conn, start_date, end_date)}
+                       WHERE {' AND '.join(conditions)}''', parameters)
+    for category, amount, currency, date in cursor:
+        if currency != target_currency:
+            fx_index = fx_index or get_fx_index(conn)
+            amount = fx_index.convert(amount, currency, target_currency, date)
+        category_stats = statistics.get(category)
+        if category_stats is None:
+            category_stats = statistics[category] = SpendStatistics()
+        category_stats.add(amount)
+
+    if owns_connection:
+        conn.close()
+    return statistics
+
+# Function to create the archive tables
+def create_archive_tables():
+    """
+    Create the tables that track archived years in the hot database.
+
+    'archive_partitions' lists the archive database that each closed year was moved
+    to, as the table 'transactions_<year>'; 'transactions_rollup' keeps monthly totals
+    of the archived transactions so summaries over old years do not need to open the
+    archive.
+
+    Returns:
+        None
+    """
+    conn = create_connection(DATABASE_FILE)
+    cursor = conn.cursor()
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS archive_partitions (
+                        year INTEGER PRIMARY KEY,
+                        path TEXT NOT NULL,
+                        rows INTEGER NOT NULL,
+                        archived_at TEXT NOT NULL
+                    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS transactions_rollup (
+                        user_id INTEGER NOT NULL,
+                        year INTEGER NOT NULL,
+                        month INTEGER NOT NULL,
+                        category TEXT,
+                        type TEXT,
+                        currency TEXT,
+                        total REAL NOT NULL,
+                        count INTEGER NOT NULL,
+                        PRIMARY KEY (user_id, year, month, category, type, currency)
+                    )''')
+
+    conn.commit()
+    conn.close()
+
+# Function to build the transaction source for a date range
+def _transactions_source(conn, start_date=None, end_date=None):
+    """
+    Get the table expression to read transactions in a date range from.
+
+    If no archived year overlaps the range this is just the hot 'transactions' table.
+    Otherwise the archive database is attached to the connection (once; it holds
+    one table per archived year) and a UNION ALL of the hot table and the
+    overlapping archived tables is returned.
+
+    Args:
+        conn (sqlite3.Connection): Database connection.
+        start_date (str, optional): First date of the range; open-ended if not given.
+        end_date (str, optional): Last date of the range; open-ended if not given.
+
+    Returns:
+        str: A table name or parenthesized subquery usable in a FROM clause.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT year, path FROM archive_partitions ORDER BY year")
+        partitions = cursor.fetchall()
+    except sqlite3.OperationalError:
+        return 'transactions'  # Database created before archiving existed
+
+    needed = [(year, path) for year, path in partitions
+              if (not start_date or start_date[:4] <= str(year)) and (not end_date or str(year) <= end_date[:4])]
+    if not needed:
+        return 'transactions'
+
+    cursor.execute("PRAGMA database_list")
+    aliases = {row[2]: row[1] for row in cursor.fetchall()}
+    selects = [f"SELECT {ARCHIVE_COLUMNS} FROM main.transactions"]
+    for year, path in needed:
+        alias = aliases.get(path)
+        if alias is None:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Archive for {year} not found: {path}")
+            # Usually a single archive database; another one only if archive_dir changed
+            alias = "archive" if "archive" not in aliases.values() else f"archive_{len(aliases)}"
+            cursor.execute("ATTACH DATABASE ? AS " + alias, (path,))
+            aliases[path] = alias
+        selects.append(f"SELECT {ARCHIVE_COLUMNS} FROM {alias}.transactions_{year}")
+    return "(" + " UNION ALL ".join(selects) + ")"
+
+# Function to list the archive databases
+def _archive_paths(conn):
+    """
+    Get the paths of the archive databases that hold archived years.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the hot database.
+
+    Returns:
+        list: The distinct archive database paths, empty if nothing is archived.
+    """
+    try:
+        return [row[0] for row in conn.execute("SELECT DISTINCT path FROM archive_partitions ORDER BY path")]
+    except sqlite3.OperationalError:
+        return []  # Database created before archiving existed
+
+# Schema of the categories table; paths are unique regardless of case
+CATEGORIES_SCHEMA = '''CREATE TABLE IF NOT EXISTS {table_name} (
+                         id INTEGER PRIMARY KEY AUTOINCREMENT,
+                         name TEXT NOT NULL,
+                         parent_id INTEGER REFERENCES categories(id),
+                         path TEXT NOT NULL UNIQUE COLLATE NOCASE  -- e.g. 'Food > Groceries'
+                     )'''
+
+# Function to create the category hierarchy tables
+def create_categories_table():
+    """
+    Create the category hierarchy (e.g., Food > Groceries > Produce).
+
+    'categories' holds one row per node with its parent and full path. The hierarchy
+    is also stored as a closure table, 'category_closure', with one row for every
+    (ancestor, descendant) pair including each node with itself, so everything under
+    a node is found with a single indexed lookup on ancestor_id. Transactions reference
+    their category through 'category_id'; existing transactions are linked to
+    categories named after their category text.
+
+    Paths are compared case-insensitively (COLLATE NOCASE), so 'food' and 'Food' are
+    the same category. A categories table created before that is rebuilt once, see
+    _merge_case_duplicate_categories.
+
+    Returns:
+        None
+    """
+    conn = create_connection(DATABASE_FILE)
+    cursor = conn.cursor()
+
+    cursor.execute(CATEGORIES_SCHEMA.format(table_name='categories'))
+    cursor.execute('''CREATE TABLE IF NOT EXISTS category_closure (
+                        ancestor_id INTEGER NOT NULL REFERENCES categories(id),
+                        descendant_id INTEGER NOT NULL REFERENCES categories(id),
+                        depth INTEGER NOT NULL,
+                        PRIMARY KEY (ancestor_id, descendant_id)
+                    ) WITHOUT ROWID''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_category_closure_descendant
+                      ON category_closure (descendant_id, ancestor_id)''')
+
+    _add_column_if_missing(cursor, 'transactions', 'category_id', "INTEGER REFERENCES categories(id)")
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_transactions_user_category
+                      ON transactions (user_id, category_id)''')
+    _merge_case_duplicate_categories(conn)
+    backfill_category_ids(conn)
+
+    conn.commit()
+    conn.close()
+
+# Function to merge categories that only differ in case
+def _merge_case_duplicate_categories(conn):
+    """
+    Rebuild a categories table created before paths were compared case-insensitively,
+    merging paths that only differ in case (e.g. 'food' and 'Food') into the one
+    created first.
+
+    The closure table is rebuilt from the merged parents, archived transactions are
+    pointed at the surviving IDs, and hot transactions and budgets on a merged category
+    get their category_id cleared, so backfill_category_ids relinks them with the
+    surviving path as their category text and logs the change. Does nothing once the
+    table compares paths case-insensitively.
+
+    Args:
+        conn (sqlite3.Connection): Database connection.
+
+    Returns:
+        None
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'categories'")
+    row = cursor.fetchone()
+    if row is None or 'NOCASE' in row[0].upper():
+        return
+
+    # Archives have to be attached before the transaction starts
+    archives = {f"category_archive_{index}": path for index, path in enumerate(_archive_paths(conn))}
+    for alias, path in archives.items():
+        cursor.execute("ATTACH DATABASE ? AS " + alias, (path,))
+    try:
+        cursor.execute("BEGIN")
+        cursor.execute(CATEGORIES_SCHEMA.format(table_name='categories_nocase'))
+        cursor.execute('''INSERT OR IGNORE INTO categories_nocase (id, name, parent_id, path)
+                          SELECT id, name, parent_id, path FROM categories ORDER BY id''')
+        cursor.execute('''CREATE TEMP TABLE category_merge AS
+                          SELECT old.id AS old_id, new.id AS new_id
+                          FROM categories AS old JOIN categories_nocase AS new ON new.path = old.path
+                          WHERE new.id != old.id''')
+        cursor.execute('''UPDATE categories_nocase SET parent_id = (SELECT new_id FROM category_merge WHERE old_id = parent_id)
+                          WHERE parent_id IN (SELECT old_id FROM category_merge)''')
+        cursor.execute("DROP TABLE categories")
+        cursor.execute("ALTER TABLE categories_nocase RENAME TO categories")
+
+        cursor.execute("DELETE FROM category_closure")
+        cursor.execute('''INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+                          WITH RECURSIVE closure (ancestor_id, descendant_id, depth) AS (
+                              SELECT id, id, 0 FROM categories
+                              UNION ALL
+                              SELECT categories.parent_id, closure.descendant_id, closure.depth + 1
+                              FROM closure JOIN categories ON categories.id = closure.ancestor_id
+                              WHERE categories.parent_id IS NOT NULL)
+                          SELECT ancestor_id, descendant_id, depth FROM closure''')
+
+        for table_name in ('transactions', 'budgets'):
+            cursor.execute(f'''UPDATE {table_name} SET category_id = NULL
+                               WHERE category_id IN (SELECT old_id FROM category_merge)''')
+        for alias in archives:
+            cursor.execute(f"SELECT name FROM {alias}.sqlite_master WHERE type = 'table' AND name GLOB 'transactions_[0-9]*'")
+            for (table_name,) in cursor.fetchall():
+                cursor.execute(f'''UPDATE {alias}.{table_name}
+                                   SET category_id = (SELECT new_id FROM category_merge WHERE old_id = category_id)
+                                   WHERE category_id IN (SELECT old_id FROM category_merge)''')
+        cursor.execute("DROP TABLE temp.category_merge")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        for alias in archives:
+            cursor.execute("DETACH DATABASE " + alias)
+
+# Function to normalize a category path
+def normalize_category_path(category):
+    """
+    Normalize a category name or path such as 'Food>Groceries ' to 'Food > Groceries'.
+
+    Args:
+        category (str): A category name, or names separated by '>'.
+
+    Returns:
+        str: The normalized path.
+    """
+    return " > ".join(part.strip() for part in (category or '').split(">") if part.strip())
+
+# Function to look up or create a category
+def get_or_create_category(cursor, path):
+    """
+    Get the ID of the category with the given path, creating it and any missing
+    ancestors (and their closure rows) on the way.
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor of the writing connection.
+        path (str): A normalized category path (e.g., 'Food > Groceries').
+
+    Returns:
+        int or None: The category ID, or None for an empty path.
+    """
+    if not path:
+        return None
+    cursor.execute("SELECT id FROM categories WHERE path = ?", (path,))
+    row = cursor.fetchone()
+    if row:
+        return row[0]
+
+    parent_path, _, name = path.rpartition(" > ")
+    parent_id = get_or_create_category(cursor, parent_path)
+    cursor.execute("INSERT INTO categories (name, parent_id, path) VALUES (?, ?, ?)", (name, parent_id, path))
+    category_id = cursor.lastrowid
+
+    # The new node descends from itself and from every ancestor of its parent
+    cursor.execute('''INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+                      SELECT ancestor_id, ?, depth + 1 FROM category_closure WHERE descendant_id = ?
+                      UNION ALL SELECT ?, ?, 0''', (category_id, parent_id, category_id, category_id))
+    return category_id
+
+# Function to resolve category text to a category
+def resolve_category(cursor, category):
+    """
+    Normalize category text and get the category it names, creating it if needed.
+    Paths match regardless of case, and the path is returned as first stored, so
+    'food' written after 'Food' is stored as 'Food'.
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor of the writing connection.
+        category (str): A category name or path as entered.
+
+    Returns:
+        tuple: The stored path and the category ID (None for empty text).
+    """
+    path = normalize_category_path(category)
+    if not path:
+        return path, None
+    cursor.execute("SELECT path, id FROM categories WHERE path = ?", (path,))
+    row = cursor.fetchone()
+    if row:
+        return row[0], row[1]
+    return path, get_or_create_category(cursor, path)
+
+# Function to link category text to category IDs
+def backfill_category_ids(conn):
+    """
+    Set category_id on transactions and budgets that only have category text, e.g.
+    rows written before the hierarchy existed or loaded by bulk imports. The category
+    text is set to the stored path too, so 'food' becomes 'Food' when 'Food' exists.
+
+    Each updated row is logged as an 'update' in the change log, so change data
+    consumers see the new category_id. The log entries are written with one
+    INSERT ... SELECT per category rather than a record_change call per row.
+
+    Args:
+        conn (sqlite3.Connection): Database connection.
+
+    Returns:
+        None
+    """
+    cursor = conn.cursor()
+    changed_at = datetime.now().isoformat(timespec='seconds')
+    for table_name in ('transactions', 'budgets'):
+        cursor.execute(f"PRAGMA table_info({table_name})")
+        columns = [column[1] for column in cursor.fetchall()]
+        if 'category_id' not in columns:
+            continue
+        row_image = "json_object(" + ", ".join(f"'{column}', {column}" for column in columns) + ")"
+        cursor.execute(f'''SELECT DISTINCT category FROM {table_name}
+                           WHERE category_id IS NULL AND category IS NOT NULL''')
+        for (category,) in cursor.fetchall():
+            path, category_id = resolve_category(cursor, category)
+            if category_id is None:
+                continue  # Blank category text, nothing to link
+            cursor.execute(f'''INSERT INTO change_log (table_name, operation, row_id, user_id, data, changed_at)
+                               SELECT ?, 'update', id, user_id,
+                                      json_set({row_image}, '$.category', ?, '$.category_id', ?), ?
+                               FROM {table_name} WHERE category_id IS NULL AND category = ?''',
+                           (table_name, path, category_id, changed_at, category))
+            cursor.execute(f'''UPDATE {table_name} SET category = ?, category_id = ?
+                               WHERE category_id IS NULL AND category = ?''', (path, category_id, category))
+    conn.commit()
+
+# Function to total a category subtree
+def get_category_rollup(user_id, category, start_date=None, end_date=None, conn=None):
+    """
+    Get a user's income and expense totals for a category and all its subcategories,
+    in the user's base currency, with a single query through the closure table.
+    Archived years in the date range are included.
+
+    Args:
+        user_id (int): The ID of the user.
+        category (str): The category path (e.g., 'Food' or 'Food > Groceries').
+        start_date (str, optional): First date to include ('YYYY-MM-DD').
+        end_date (str, optional): Last date to include ('YYYY-MM-DD').
+        conn (sqlite3.Connection, optional): Connection to reuse.
+
+    Returns:
+        dict: Totals per transaction type (e.g., {'expense': 120.0}).
+    """
+    conn, owns_connection = _read_connection(conn)
+    cursor = conn.cursor()
+
+    totals = _totals_in_base_currency(
+        cursor, user_id, get_user_base_currency(cursor, user_id), 'type',
+        '''category_id IN (SELECT cc.descendant_id FROM categories AS c
+                            JOIN category_closure AS cc ON cc.ancestor_id = c.id
+                            WHERE c.path = ?)
+           AND date >= ? AND date <= ?''',
+        (normalize_category_path(category), start_date or '', (end_date or '9999') + '\uffff'),
+        _transactions_source(conn, start_date, end_date))
+
+    if owns_connection:
+        conn.close()
+    return totals
+
+# Function to list the subcategories of categories
+def get_category_subtrees(categories, conn=None):
+    """
+    Get the paths of every category under each of the given categories, with one
+    query through the closure table. Paths match regardless of case.
+
+    Args:
+        categories (list): Category paths (e.g., ['Food', 'Transport']).
+        conn (sqlite3.Connection, optional): Connection to reuse.
+
+    Returns:
+        dict: Per given path, the list of paths in its subtree (including itself).
+    """
+    paths = [normalize_category_path(category) for category in categories]
+    subtrees = {path: [] for path in paths}
+    if not paths:
+        return subtrees
+    conn, owns_connection = _read_connection(conn)
+    cursor = conn.cursor()
+
+    placeholders = ", ".join("?" * len(paths))
+    cursor.execute(f'''SELECT a.path, d.path FROM categories AS a
+                       JOIN category_closure AS cc ON cc.ancestor_id = a.id
+                       JOIN categories AS d ON d.id = cc.descendant_id
+                       WHERE a.path IN ({placeholders})''', paths)
+    requested = {}
+    for path in paths:
+        requested.setdefault(path.lower(), []).append(path)
+    for ancestor, descendant in cursor.fetchall():
+        for path in requested[ancestor.lower()]:
+            subtrees[path].append(descendant)
+
+    if owns_connection:
+        conn.close()
+    return subtrees
+
+# Function to create the change log table
+def create_change_log_table():
+    """
+    Create the append-only change log used for incremental exports.
+
+    Every write made through add_transaction, update_transaction, delete_transaction
+    and set_budget appends one row, in the same database transaction as the write.
+    'seq' is an AUTOINCREMENT key, so sequence numbers only ever increase and are
+    never reused, even after compaction.
+
+    Returns:
+        None
+    """
+    conn = create_connection(DATABASE_FILE)
+    cursor = conn.cursor()
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS change_log (
+                        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                        table_name TEXT NOT NULL,
+                        operation TEXT NOT NULL,  -- 'insert', 'update' or 'delete'
+                        row_id INTEGER NOT NULL,
+                        user_id INTEGER,
+                        data TEXT,  -- JSON image of the row after the change (NULL for deletes)
+                        changed_at TEXT NOT NULL
+                    )''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_change_log_row
+                      ON change_log (table_name, row_id, seq)''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_change_log_user
+                      ON change_log (user_id, table_name, seq)''')
+
+    conn.commit()
+    conn.close()
+
+# Function to append a row change to the change log
+def record_change(cursor, table_name, operation, row_id, user_id=None):
+    """
+    Append a change to the change log. Must be called on the cursor that made the
+    change, before the commit, so the change and its log entry commit together.
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor of the writing connection.
+        table_name (str): 'transactions' or 'budgets'.
+        operation (str): 'insert', 'update' or 'delete'.
+        row_id (int): ID of the changed row.
+        user_id (int, optional): Owner of the row; read from the row unless it was deleted.
+
+    Returns:
+        None
+    """
+    data = None
+    if operation != 'delete':
+        cursor.execute(f"SELECT * FROM {table_name} WHERE id = ?", (row_id,))
+        row = cursor.fetchone()
+        data = dict(zip([column[0] for column in cursor.description], row))
+        user_id = data.get('user_id', user_id)
+    cursor.execute('''INSERT INTO change_log (table_name, operation, row_id, user_id, data, changed_at)
+                      VALUES (?, ?, ?, ?, ?, ?)''',
+                   (table_name, operation, row_id, user_id,
+                    json.dumps(data) if data is not None else None,
+                    datetime.now().isoformat(timespec='seconds')))
+
+# Function to read the changes after a sequence number
+def iter_changes(conn, after_seq=0, batch_size=1000):
+    """
+    Iterate over the change log entries with a sequence number above after_seq, in order.
+
+    The scan is a range read on the sequence key, so its cost depends on the number
+    of new changes only, not on the size of the log or the ledger.
+
+    Args:
+        conn (sqlite3.Connection): Database connection.
+        after_seq (int): Last sequence number already processed.
+        batch_size (int): Rows fetched from SQLite at a time.
+
+    Yields:
+        dict: Change entries with seq, table, operation, row_id, user_id, data and changed_at.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''SELECT seq, table_name, operation, row_id, user_id, data, changed_at
+                      FROM change_log WHERE seq > ? ORDER BY seq''', (after_seq,))
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for seq, table_name, operation, row_id, user_id, data, changed_at in rows:
+            yield {
+                'seq': seq,
+                'table': table_name,
+                'operation': operation,
+                'row_id': row_id,
+                'user_id': user_id,
+                'data': json.loads(data) if data is not None else None,
+                'changed_at': changed_at
+            }
+
+# Function to compact the change log
+def compact_change_log(up_to_seq, purge=False):
+    """
+    Compact the change log entries with a sequence number up to up_to_seq.
+
+    By default only the latest entry per row is kept, which still lets a new
+    consumer rebuild the current state from the log. With purge=True the entries
+    are removed entirely; only do this once every consumer's cursor is past up_to_seq.
+
+    Args:
+        up_to_seq (int): Highest sequence number that may be compacted.
+        purge (bool): Remove the entries instead of collapsing them.
+
+    Returns:
+        int: The number of entries removed.
+    """
+    conn = create_connection(DATABASE_FILE)
+    cursor = conn.cursor()
+
+    if purge:
+        cursor.execute("DELETE FROM change_log WHERE seq <= ?", (up_to_seq,))
+    else:
+        cursor.execute('''DELETE FROM change_log
+                          WHERE seq <= ? AND EXISTS (
+                              SELECT 1 FROM change_log AS newer
+                              WHERE newer.table_name = change_log.table_name
+                                AND newer.row_id = change_log.row_id
+                                AND newer.seq > change_log.seq
+                                AND newer.seq <= ?)''', (up_to_seq, up_to_seq))
+    removed = cursor.rowcount
+
+    conn.commit()
+    conn.close()
+    return removed
+
+def backup_data(backup_file=None):
     """
     Backup the database to a specified file.
     
     Prompts the user for a file path to store the backup. If no path is provided, 
-    a default file name 'backup.sql' is used.
+    a default file name 'backup.sql' is used. Archived years live in a separate
+    archive database, which is dumped next to it (e.g., 'backup.archive.sql'), so
+    each dump restores into the file it was taken from.
+
+    Args:
+        backup_file (str, optional): Backup file path. If given, the user is not prompted.
     
     Returns:
         None
     """
-    backup_file = input("Enter the file path for backup (default: backup.sql): ") or "backup.sql"
+    if backup_file is None:
+        backup_file = input("Enter the file path for backup (default: backup.sql): ") or "backup.sql"
+    conn, owns_connection = None, False
     try:
-        conn = create_connection('finance.db')
+        conn, owns_connection = _read_connection()
         with open(backup_file, 'w') as f:
             for line in conn.iterdump():
                 f.write(f"{line}\n")
         print(f"Database backup successful! Backup file: {backup_file}")
+
+        root, extension = os.path.splitext(backup_file)
+        for path in _archive_paths(conn):
+            archive_backup_file = f"{root}.{os.path.splitext(os.path.basename(path))[0]}{extension or '.sql'}"
+            archive_conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            try:
+                with open(archive_backup_file, 'w') as f:
+                    for line in archive_conn.iterdump():
+                        f.write(f"{line}\n")
+            finally:
+                archive_conn.close()
+            print(f"Archive backup successful! Backup file: {archive_backup_file}")
     except Exception as e:
         print(f"Failed to create backup: {e}")
     finally:
-        if conn:
+        if owns_connection:
             conn.close()
 
 # Function to generate a PDF of the database backup
-def generate_backup_pdf():
+def generate_backup_pdf(filename="database_backup.pdf"):
     """
     Generate a PDF report of the database backup, including user and transaction data.
 
     This function creates a PDF file containing the contents of the 'users' and 'transactions' 
-    tables from the database, which serves as a report for the backup.
+    tables from the database, which serves as a report for the backup. Transactions of
+    archived years are read from the archive database and included.
+
+    Args:
+        filename (str): The PDF file to write. Default is 'database_backup.pdf'.
 
     Returns:
         None
     """
     # Create a new PDF file
-    filename = "database_backup.pdf"
     c = canvas.Canvas(filename, pagesize=letter)
     
     # Set up some initial settings for the PDF
@@ -404,7 +1805,7 @@ def generate_backup_pdf():
     y_position = height - 100  # Starting Y position for user data
     
     # Connect to the database
-    conn = create_connection('finance.db')
+    conn, owns_connection = _read_connection()
     cursor = conn.cursor()
 
     # Get all users
@@ -422,7 +1823,7 @@ def generate_backup_pdf():
     y_position -= 20
     
     # Get all transactions
-    cursor.execute("SELECT * FROM transactions")
+    cursor.execute(f"SELECT {ARCHIVE_COLUMNS} FROM {_transactions_source(conn)} ORDER BY id")
     transactions = cursor.fetchall()
 
     # Write each transaction's data to the PDF
@@ -431,7 +1832,8 @@ def generate_backup_pdf():
         y_position -= 15
 
     # Close the connection
-    conn.close()
+    if owns_connection:
+        conn.close()
     
     # Save the PDF
     c.save()
@@ -0,0 +1,294 @@
+import calendar
+import sqlite3
+from collections import OrderedDict
+from datetime import datetime
+import database
+from sketches import QuantileSketch, weighted_quantiles
+
+# Robust z-score above which a transaction is reported as anomalous
+ANOMALY_THRESHOLD = 3.5
+
+# Scales the median absolute deviation to a standard deviation for normal data
+MAD_SCALE = 0.6745
+
+class CategoryModel:
+    """
+    Fitted spending parameters for one expense category.
+
+    Amounts go into a fixed-size quantile sketch, so adding one costs the same however
+    many the category has. The median and median absolute deviation are estimated
+    from the sketch's retained items (exact while the category has fewer than about
+    k amounts) and refitted only when new amounts have arrived, at a cost that does
+    not grow with the history. Monthly totals are kept per (year, month) for the
+    seasonality estimate.
+
+    Attributes:
+        sketch (QuantileSketch): Sketch of the expense amounts in the category.
+        monthly_totals (dict): Total spend per (year, month).
+        median (float): Median amount.
+        mad (float): Median absolute deviation of the amounts.
+    """
+
+    def __init__(self):
+        self.sketch = QuantileSketch(seed=0)
+        self.monthly_totals = {}
+        self.median = 0.0
+        self.mad = 0.0
+        self.stale = False
+
+    def add(self, amount, date):
+        self.sketch.add(amount)
+        if date:
+            month = (int(date[:4]), int(date[5:7]))
+            self.monthly_totals[month] = self.monthly_totals.get(month, 0) + amount
+        self.stale = True
+
+    def refit(self):
+        """
+        Re-estimate the median and median absolute deviation if amounts were added since the last fit.
+        """
+        if not self.stale:
+            return
+        weighted = self.sketch.weighted_items()
+        self.median = weighted_quantiles(weighted, [0.5])[0]
+        deviations = sorted((abs(amount - self.median), weight) for amount, weight in weighted)
+        self.mad = weighted_quantiles(deviations, [0.5])[0]
+        if self.mad == 0:
+            # Fall back to the mean absolute deviation when over half the amounts are identical
+            self.mad = sum(deviation * weight for deviation, weight in deviations) / self.sketch.count * 0.7979
+        self.stale = False
+
+    def robust_z(self, amount):
+        """
+        Robust z-score of an amount: its distance from the median in scaled MAD units.
+
+        Args:
+            amount (float): The transaction amount.
+
+        Returns:
+            float: The robust z-score, 0 if the category has no spread.
+        """
+        self.refit()
+        if self.mad == 0:
+            return 0.0
+        return MAD_SCALE * (amount - self.median) / self.mad
+
+    def expected_month_total(self, month, exclude=None):
+        """
+        Expected spend for a calendar month: the average total of the same calendar
+        month in the history (capturing seasonality), or the average of all months
+        when that month has not been seen before.
+
+        Args:
+            month (int): Calendar month (1-12).
+            exclude (tuple, optional): A (year, month) to leave out, such as the current month.
+
+        Returns:
+            float or None: The expected total, or None without any history.
+        """
+        history = {key: total for key, total in self.monthly_totals.items() if key != exclude}
+        if not history:
+            return None
+        same_month = [total for (_, m), total in history.items() if m == month]
+        if same_month:
+            return sum(same_month) / len(same_month)
+        return sum(history.values()) / len(history)
+
+class SpendingModel:
+    """
+    Per-user spending model with one CategoryModel per expense category.
+
+    The model remembers the highest transaction ID it has seen and the last change log
+    entry for the user's transactions. refresh() then only reads and fits transactions
+    added since the last call, and a full refit happens when the change log shows an
+    earlier row was updated or deleted. Both checks are index lookups, so a refresh
+    with nothing new does not scan the user's expenses. Edits made without going
+    through the logged write functions are not seen; call reset() after them.
+
+    Amounts are converted to the user's base currency at the rate of their date.
+
+    Attributes:
+        user_id (int): The user the model belongs to.
+        currency (str): The currency the model's amounts are in.
+        categories (dict): CategoryModel per category name.
+        transactions (list): (id, category, amount, date) of every expense seen.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.reset()
+
+    def reset(self):
+        """
+        Forget everything fitted so far; the next refresh refits from scratch.
+        """
+        self.currency = None
+        self.categories = {}
+        self.transactions = []
+        self.last_id = 0
+        self.last_seq = 0
+
+    def _latest_seq(self, cursor):
+        try:
+            cursor.execute('''SELECT MAX(seq) FROM change_log WHERE user_id = ? AND table_name = 'transactions' ''',
+                           (self.user_id,))
+        except sqlite3.OperationalError:
+            return 0  # Database created before the change log existed
+        return cursor.fetchone()[0] or 0
+
+    def _edited(self, cursor):
+        # Any logged update or delete, or an insert at or below the last fitted ID,
+        # since the last refresh changes rows the model has already fitted
+        try:
+            cursor.execute('''SELECT 1 FROM change_log
+                              WHERE user_id = ? AND table_name = 'transactions' AND seq > ?
+                                AND (operation != 'insert' OR row_id <= ?) LIMIT 1''',
+                           (self.user_id, self.last_seq, self.last_id))
+        except sqlite3.OperationalError:
+            return False
+        return cursor.fetchone() is not None
+
+    def _convert(self, conn, amount, currency, date):
+        if currency == self.currency:
+            return amount
+        return database.get_fx_index(conn).convert(amount, currency, self.currency, date)
+
+    def _load_archived_months(self, conn, cursor):
+        # Archived years only survive in the hot database as monthly rollups, which
+        # is all the seasonality estimate needs
+        try:
+            cursor.execute('''SELECT category, year, month, currency, SUM(total) FROM transactions_rollup
+                              WHERE user_id = ? AND type = 'expense'
+                              GROUP BY category, year, month, currency''', (self.user_id,))
+        except sqlite3.OperationalError:
+            return
+        for category, year, month, currency, total in cursor.fetchall():
+            total = self._convert(conn, total, currency, f"{year}-{month:02d}-15")
+            model = self.categories.setdefault(category, CategoryModel())
+            model.monthly_totals[(year, month)] = model.monthly_totals.get((year, month), 0) + total
+
+    def refresh(self, conn):
+        """
+        Bring the model up to date with the user's expense transactions.
+
+        Args:
+            conn (sqlite3.Connection): Database connection.
+
+        Returns:
+            int: The number of transactions newly fitted.
+        """
+        cursor = conn.cursor()
+        currency = database.get_user_base_currency(cursor, self.user_id)
+        seq = self._latest_seq(cursor)
+        if self.currency is not None and (currency != self.currency or self._edited(cursor)):
+            self.reset()
+        if self.currency is None:
+            self.currency = currency
+            self._load_archived_months(conn, cursor)
+        self.last_seq = seq
+
+        cursor.execute('''SELECT id, category, amount, date, currency FROM transactions
+                          WHERE user_id = ? AND type = 'expense' AND id > ? ORDER BY id''',
+                       (self.user_id, self.last_id))
+        new_rows = cursor.fetchall()
+        for transaction_id, category, amount, date, transaction_currency in new_rows:
+            amount = self._convert(conn, amount, transaction_currency, date)
+            self.categories.setdefault(category, CategoryModel()).add(amount, date)
+            self.transactions.append((transaction_id, category, amount, date))
+        if new_rows:
+            self.last_id = new_rows[-1][0]
+        return len(new_rows)
+
+    def forecast(self, period='monthly', today=None):
+        """
+        Project each category's spend at the end of the current month or year.
+
+        For monthly forecasts the projection blends the current month's trajectory
+        (spend so far extrapolated over the whole month) with the seasonal expectation
+        from earlier months, trusting the trajectory more as the month progresses.
+        Yearly forecasts add the seasonal expectation of the remaining months to the
+        spend so far.
+
+        Args:
+            period (str): 'monthly' or 'yearly'.
+            today (datetime, optional): The current date. Defaults to now.
+
+        Returns:
+            dict: Per category, the amount spent so far and the projected total.
+        """
+        today = today or datetime.now()
+        current_month = (today.year, today.month)
+        forecasts = {}
+
+        for category, model in self.categories.items():
+            if period == 'monthly':
+                spent = model.monthly_totals.get(current_month, 0)
+                days_in_month = calendar.monthrange(today.year, today.month)[1]
+                progress = today.day / days_in_month
+                trajectory = spent / progress
+                expected = model.expected_month_total(today.month, exclude=current_month)
+                projected = trajectory if expected is None else progress * trajectory + (1 - progress) * max(expected, spent)
+            elif period == 'yearly':
+                spent = sum(total for (year, _), total in model.monthly_totals.items() if year == today.year)
+                current = model.monthly_totals.get(current_month, 0)
+                days_in_month = calendar.monthrange(today.year, today.month)[1]
+                expected = model.expected_month_total(today.month, exclude=current_month)
+                rest_of_month = (expected or current) * (1 - today.day / days_in_month)
+                later_months = sum(model.expected_month_total(month, exclude=current_month) or 0
+                                   for month in range(today.month + 1, 13))
+                projected = spent + max(rest_of_month, 0) + later_months
+            else:
+                raise ValueError("Period must be 'monthly' or 'yearly'")
+            forecasts[category] = {'spent': spent, 'projected': projected}
+        return forecasts
+
+    def anomalies(self, threshold=ANOMALY_THRESHOLD, since=None):
+        """
+        Find transactions whose amount is unusual for their category.
+
+        Args:
+            threshold (float): Robust z-score above which a transaction is flagged.
+            since (str, optional): Only consider transactions on or after this date.
+
+        Returns:
+            list: (transaction ID, category, amount, date, robust z-score) tuples, highest score first.
+        """
+        flagged = []
+        for transaction_id, category, amount, date in self.transactions:
+            if since and (date or '') < since:
+                continue
+            z = self.categories[category].robust_z(amount)
+            if abs(z) > threshold:
+                flagged.append((transaction_id, category, amount, date, z))
+        flagged.sort(key=lambda item: abs(item[4]), reverse=True)
+        return flagged
+
+# Fitted models per (database file, user ID), kept between calls; the least recently
+# used model is dropped once there are more than SPENDING_MODEL_CACHE_SIZE
+spending_models = OrderedDict()
+SPENDING_MODEL_CACHE_SIZE = 64
+
+# Function to get an up-to-date spending model for a user
+def get_spending_model(user_id, conn=None):
+    """
+    Get the cached spending model for a user, refreshed with any new transactions.
+    Reads go through the same connection choice as the reports (reporting replica,
+    read-optimized connection or a new connection).
+
+    Args:
+        user_id (int): The ID of the user.
+        conn (sqlite3.Connection, optional): Connection to reuse.
+
+    Returns:
+        SpendingModel: The user's spending model.
+    """
+    key = (database.DATABASE_FILE, user_id)
+    model = spending_models.pop(key, None) or SpendingModel(user_id)
+    spending_models[key] = model
+    while len(spending_models) > SPENDING_MODEL_CACHE_SIZE:
+        spending_models.popitem(last=False)
+    conn, owns_connection = database._read_connection(conn)
+    model.refresh(conn)
+    if owns_connection:
+        conn.close()
+    return model
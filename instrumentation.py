@@ -0,0 +1,295 @@
+import argparse
+import atexit
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+
+# Upper bounds (in milliseconds) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+slow_query_logger = logging.getLogger('finance.slow_query')
+
+# Instrumentation settings; when ENABLED is False connect() returns plain sqlite3 connections
+ENABLED = False
+SLOW_QUERY_MS = 100.0
+
+# File the statistics are written to at exit, if any; the exit hook is registered once
+EXPORT_PATH = None
+export_registered = False
+
+class QueryStats:
+    """
+    Collects per-statement call counts, latency histograms and rows returned.
+
+    Statements are keyed by their SQL text with whitespace collapsed, so the same
+    query issued from different places is counted together.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.statements = {}
+
+    def _entry(self, sql):
+        entry = self.statements.get(sql)
+        if entry is None:
+            entry = self.statements[sql] = {
+                'calls': 0,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+                'rows': 0,
+                'histogram': [0] * (len(LATENCY_BUCKETS_MS) + 1)
+            }
+        return entry
+
+    def record_call(self, sql, elapsed_ms):
+        with self.lock:
+            entry = self._entry(sql)
+            entry['calls'] += 1
+            entry['total_ms'] += elapsed_ms
+            entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+            entry['histogram'][bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+
+    def record_rows(self, sql, rows):
+        with self.lock:
+            self._entry(sql)['rows'] += rows
+
+    def reset(self):
+        with self.lock:
+            self.statements = {}
+
+    def snapshot(self):
+        """
+        Return a JSON-serializable copy of the statistics, slowest total time first.
+
+        Returns:
+            dict: Histogram bucket bounds and one entry per statement.
+        """
+        with self.lock:
+            statements = [dict(entry, sql=sql, histogram=list(entry['histogram']),
+                               mean_ms=entry['total_ms'] / entry['calls'] if entry['calls'] else 0.0)
+                          for sql, entry in self.statements.items()]
+        statements.sort(key=lambda entry: entry['total_ms'], reverse=True)
+        return {'buckets_ms': LATENCY_BUCKETS_MS, 'statements': statements}
+
+# Statistics shared by every instrumented connection in the process
+query_stats = QueryStats()
+
+# Function to normalize SQL text into a statistics key
+def normalize_sql(sql):
+    """
+    Collapse runs of whitespace so that differently formatted copies of a query share a key.
+
+    Args:
+        sql (str): The SQL statement.
+
+    Returns:
+        str: The normalized statement.
+    """
+    return re.sub(r'\s+', ' ', sql).strip()
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Cursor that times every statement and counts the rows fetched from it.
+    """
+
+    current_sql = None
+
+    def _timed(self, method, sql, parameters, explain):
+        key = normalize_sql(sql)
+        self.current_sql = key
+        started = time.perf_counter()
+        result = method(sql, parameters)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        query_stats.record_call(key, elapsed_ms)
+        if elapsed_ms >= SLOW_QUERY_MS:
+            self._log_slow_query(key, sql, parameters, elapsed_ms, explain)
+        return result
+
+    def _log_slow_query(self, key, sql, parameters, elapsed_ms, explain):
+        plan = []
+        if explain and key.split(' ', 1)[0].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+            try:
+                plan = [row[-1] for row in
+                        sqlite3.Cursor(self.connection).execute(f"EXPLAIN QUERY PLAN {sql}", parameters)]
+            except sqlite3.Error:
+                pass
+        slow_query_logger.warning("Slow query (%.1f ms): %s\n  plan: %s", elapsed_ms, key,
+                                  "; ".join(plan) or "n/a")
+
+    def execute(self, sql, parameters=()):
+        return self._timed(super().execute, sql, parameters, True)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(super().executemany, sql, seq_of_parameters, False)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None and self.current_sql:
+            query_stats.record_rows(self.current_sql, 1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        if self.current_sql:
+            query_stats.record_rows(self.current_sql, len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        if self.current_sql:
+            query_stats.record_rows(self.current_sql, len(rows))
+        return rows
+
+    def __next__(self):
+        row = super().__next__()
+        if self.current_sql:
+            query_stats.record_rows(self.current_sql, 1)
+        return row
+
+class InstrumentedConnection(sqlite3.Connection):
+    """
+    Connection whose cursors, including the ones behind Connection.execute, are instrumented.
+    """
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+# Function to open a connection, instrumented only when enabled
+def connect(database, **kwargs):
+    """
+    Open a SQLite connection. When instrumentation is enabled the connection records
+    query statistics; otherwise a plain sqlite3 connection is returned, so the
+    disabled path costs a single flag check per connection.
+
+    Args:
+        database (str): The database file path or URI.
+        **kwargs: Passed through to sqlite3.connect.
+
+    Returns:
+        sqlite3.Connection: The database connection object.
+    """
+    if ENABLED:
+        kwargs.setdefault('factory', InstrumentedConnection)
+    return sqlite3.connect(database, **kwargs)
+
+# Function to switch instrumentation on
+def enable(slow_query_ms=None, export_path=None):
+    """
+    Instrument connections opened from now on.
+
+    Connections that are already open stay plain sqlite3 connections and are not
+    counted. Setting FINANCE_QUERY_STATS enables instrumentation when this module is
+    first imported, before the database module opens any connection; when enabling
+    from code, do it before opening connections, or call
+    database.close_read_connections() so the cached read connections are reopened.
+
+    Args:
+        slow_query_ms (float, optional): Statements slower than this are logged with
+            their query plan. Keeps the current threshold if not given.
+        export_path (str, optional): File the statistics are written to when the
+            process exits. Replaces a path given earlier; the statistics are written once.
+    """
+    global ENABLED, SLOW_QUERY_MS, EXPORT_PATH, export_registered
+    ENABLED = True
+    if slow_query_ms is not None:
+        SLOW_QUERY_MS = slow_query_ms
+    if export_path:
+        EXPORT_PATH = export_path
+        if not export_registered:
+            atexit.register(_export_at_exit)
+            export_registered = True
+
+# Function to write the statistics when the process exits
+def _export_at_exit():
+    if EXPORT_PATH:
+        export_stats(EXPORT_PATH)
+
+# Function to switch instrumentation off
+def disable():
+    """
+    Stop instrumenting new connections. Collected statistics are kept.
+    """
+    global ENABLED
+    ENABLED = False
+
+# Function to export the collected statistics
+def export_stats(path):
+    """
+    Write the collected query statistics to a JSON file.
+
+    Args:
+        path (str): The output file path.
+
+    Returns:
+        dict: The exported statistics.
+    """
+    stats = query_stats.snapshot()
+    with open(path, 'w') as f:
+        json.dump(stats, f, indent=2)
+    return stats
+
+# Function to print a summary of exported statistics
+def print_stats(stats, top=20):
+    """
+    Print the statements with the highest total time.
+
+    Args:
+        stats (dict): Statistics as returned by QueryStats.snapshot or read from an export.
+        top (int): Number of statements to show.
+    """
+    print(f"{'calls':>8} {'total ms':>10} {'mean ms':>9} {'max ms':>9} {'rows':>9}  statement")
+    for entry in stats['statements'][:top]:
+        print(f"{entry['calls']:>8} {entry['total_ms']:>10.2f} {entry['mean_ms']:>9.3f} "
+              f"{entry['max_ms']:>9.2f} {entry['rows']:>9}  {entry['sql'][:100]}")
+
+# Instrumentation can be switched on without code changes, e.g.
+# FINANCE_QUERY_STATS=query_stats.json FINANCE_SLOW_QUERY_MS=50 python app.py
+if os.environ.get('FINANCE_QUERY_STATS'):
+    logging.basicConfig()
+    enable(float(os.environ.get('FINANCE_SLOW_QUERY_MS', SLOW_QUERY_MS)), os.environ['FINANCE_QUERY_STATS'])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Collect and show SQLite query statistics of the application.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help="Run a script with instrumentation on and export its statistics")
+    run_parser.add_argument('--output', default='query_stats.json', help="Statistics file (default: query_stats.json)")
+    run_parser.add_argument('--slow-query-ms', type=float, default=SLOW_QUERY_MS,
+                            help=f"Log statements slower than this with their plan (default: {SLOW_QUERY_MS})")
+    run_parser.add_argument('--top', type=int, default=20, help="Number of statements to show afterwards")
+    run_parser.add_argument('script', help="Python script to run, e.g. app.py")
+    run_parser.add_argument('script_args', nargs=argparse.REMAINDER, help="Arguments passed to the script")
+    show_parser = commands.add_parser('show', help="Show statistics exported earlier")
+    show_parser.add_argument('stats_file', help="JSON file written by 'run', FINANCE_QUERY_STATS or export_stats")
+    show_parser.add_argument('--top', type=int, default=20, help="Number of statements to show")
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        import runpy
+        import sys
+        # The script imports this file as 'instrumentation', a different module object
+        # from this __main__ one, so enable and export through that module
+        import instrumentation
+        logging.basicConfig()
+        instrumentation.enable(args.slow_query_ms)
+        sys.argv = [args.script] + args.script_args
+        sys.path[0] = os.path.dirname(os.path.abspath(args.script))
+        try:
+            runpy.run_path(args.script, run_name='__main__')
+        finally:
+            stats = instrumentation.export_stats(args.output)
+            print(f"Query statistics written to {args.output}")
+            print_stats(stats, args.top)
+    else:
+        with open(args.stats_file) as f:
+            print_stats(json.load(f), args.top)
@@ -0,0 +1,101 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import time
+import tracemalloc
+from datetime import datetime
+
+# Profile file names start with their sequence number, e.g. '0007_view_report.prof'
+PROFILE_FILE_PATTERN = re.compile(r'^(\d+)_')
+
+class ActionProfiler:
+    """
+    Runs application actions under cProfile and tracemalloc and writes the results to a directory.
+
+    For every profiled action three things are kept:
+        <seq>_<action>.prof   raw cProfile data (open with pstats or snakeviz)
+        <seq>_<action>.txt    the top-N functions by cumulative time and the memory peak
+        profile_summary.jsonl one line per action with its duration and memory peak
+
+    Only a fraction of actions is profiled when sample_rate is below 1, so profiling
+    can be left on in production. Sequence numbers continue from the profiles already
+    in the directory, so every summary line keeps pointing at its own files.
+
+    Attributes:
+        output_dir (str): Directory the profiles are written to.
+        sample_rate (float): Fraction of actions to profile, between 0 and 1.
+        top (int): Number of hotspots written to each text report.
+    """
+
+    def __init__(self, output_dir, sample_rate=1.0, top=20, seed=None):
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("Sample rate must be between 0 and 1")
+        self.output_dir = output_dir
+        self.sample_rate = sample_rate
+        self.top = top
+        self.rng = random.Random(seed)
+        os.makedirs(output_dir, exist_ok=True)
+        # Continue the numbering of earlier sessions so their profiles are not overwritten
+        self.sequence = 0
+        for name in os.listdir(output_dir):
+            match = PROFILE_FILE_PATTERN.match(name)
+            if match:
+                self.sequence = max(self.sequence, int(match.group(1)))
+
+    def run(self, action, func, *args, **kwargs):
+        """
+        Call func(*args, **kwargs), profiling the call if it is sampled.
+
+        Args:
+            action (str): Name of the action, used in file names and the summary.
+            func (callable): The function implementing the action.
+
+        Returns:
+            The return value of func.
+        """
+        if self.sample_rate < 1 and self.rng.random() >= self.sample_rate:
+            return func(*args, **kwargs)
+
+        self.sequence += 1
+        base_name = f"{self.sequence:04d}_{re.sub(r'[^A-Za-z0-9_]+', '_', action)}"
+        owns_tracemalloc = not tracemalloc.is_tracing()
+        if owns_tracemalloc:
+            tracemalloc.start()
+        else:
+            tracemalloc.reset_peak()
+        profiler = cProfile.Profile()
+
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            duration = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            if owns_tracemalloc:
+                tracemalloc.stop()
+            self._write(base_name, action, profiler, duration, peak)
+
+    def _write(self, base_name, action, profiler, duration, peak):
+        profiler.dump_stats(os.path.join(self.output_dir, base_name + '.prof'))
+
+        report = io.StringIO()
+        report.write(f"Action: {action}\nDuration: {duration * 1000:.2f} ms\n"
+                     f"Memory peak: {peak / 1024:.1f} KiB\n\n")
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(self.top)
+        with open(os.path.join(self.output_dir, base_name + '.txt'), 'w') as f:
+            f.write(report.getvalue())
+
+        with open(os.path.join(self.output_dir, 'profile_summary.jsonl'), 'a') as f:
+            f.write(json.dumps({
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'action': action,
+                'profile': base_name + '.prof',
+                'duration_ms': duration * 1000,
+                'memory_peak_bytes': peak
+            }) + "\n")
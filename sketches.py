@@ -0,0 +1,301 @@
+import math
+import random
+from hashlib import blake2b
+
+class RunningStats:
+    """
+    Count, mean, variance, minimum and maximum of a stream of values in constant
+    memory, using Welford's online algorithm. Two instances built over different
+    parts of a stream merge into the statistics of the whole stream.
+
+    Attributes:
+        count (int): Number of values seen.
+        mean (float): Mean of the values.
+        minimum (float): Smallest value, None before the first value.
+        maximum (float): Largest value, None before the first value.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # Sum of squared deviations from the mean
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def merge(self, other):
+        """
+        Combine another instance into this one (Chan et al.'s parallel update).
+
+        Args:
+            other (RunningStats): Statistics over a disjoint part of the stream.
+
+        Returns:
+            RunningStats: This instance.
+        """
+        if not other.count:
+            return self
+        if not self.count:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.minimum, self.maximum = other.minimum, other.maximum
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        return self
+
+    @property
+    def variance(self):
+        """Sample variance, 0 for fewer than two values."""
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def stddev(self):
+        """Sample standard deviation."""
+        return math.sqrt(self.variance)
+
+# Function to read quantiles off sorted weighted values
+def weighted_quantiles(weighted, fractions):
+    """
+    Get quantiles of values that each stand for a number of original values.
+
+    Args:
+        weighted (list): (value, weight) tuples sorted by value.
+        fractions (iterable): Quantiles to get, between 0 and 1.
+
+    Returns:
+        list: The smallest value at or above each quantile's rank, None if there are no values.
+    """
+    total = sum(weight for _, weight in weighted)
+    results = []
+    for fraction in fractions:
+        if not weighted:
+            results.append(None)
+            continue
+        target = fraction * total
+        cumulative = 0
+        value = weighted[-1][0]
+        for item, weight in weighted:
+            cumulative += weight
+            if cumulative >= target:
+                value = item
+                break
+        results.append(value)
+    return results
+
+class QuantileSketch:
+    """
+    KLL quantile sketch: approximate quantiles of a stream in memory that grows only
+    with the logarithm of the stream length.
+
+    Values are kept in a stack of compactors. Level h holds items that each stand
+    for 2**h original values; when the sketch is full, the lowest full level is
+    sorted and every other item (starting at a random offset) is promoted to the
+    next level. The rank error of any quantile is about 1.7 / k of the stream
+    length with high probability, and sketches merge level by level.
+
+    Attributes:
+        k (int): Accuracy parameter; memory is about 3 * k items.
+        count (int): Number of values seen.
+    """
+
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.count = 0
+        self.compactors = [[]]
+        self.size = 0
+        self.max_size = self._capacity(0)
+        self.rng = random.Random(seed)
+
+    def _capacity(self, level):
+        depth = len(self.compactors) - level - 1
+        return int(math.ceil(self.k * (2 / 3) ** depth)) + 1
+
+    def _grow(self):
+        self.compactors.append([])
+        self.max_size = sum(self._capacity(level) for level in range(len(self.compactors)))
+
+    def _compress(self):
+        for level in range(len(self.compactors)):
+            items = self.compactors[level]
+            if len(items) < self._capacity(level):
+                continue
+            if level + 1 == len(self.compactors):
+                self._grow()
+            items.sort()
+            # An odd item out stays at this level so no weight is lost
+            kept = [items.pop()] if len(items) % 2 else []
+            self.compactors[level + 1].extend(items[self.rng.random() < 0.5::2])
+            self.compactors[level] = kept
+            self.size = sum(len(compactor) for compactor in self.compactors)
+            if self.size < self.max_size:
+                break
+
+    def add(self, value):
+        self.compactors[0].append(value)
+        self.count += 1
+        self.size += 1
+        if self.size >= self.max_size:
+            self._compress()
+
+    def merge(self, other):
+        """
+        Combine another sketch into this one.
+
+        Args:
+            other (QuantileSketch): Sketch over a disjoint part of the stream.
+
+        Returns:
+            QuantileSketch: This sketch.
+        """
+        while len(self.compactors) < len(other.compactors):
+            self._grow()
+        for level, items in enumerate(other.compactors):
+            self.compactors[level].extend(items)
+        self.count += other.count
+        self.size = sum(len(compactor) for compactor in self.compactors)
+        while self.size >= self.max_size:
+            self._compress()
+        return self
+
+    def weighted_items(self):
+        """
+        Get the retained items with the number of original values each stands for.
+
+        Returns:
+            list: (value, weight) tuples sorted by value.
+        """
+        return sorted((item, 1 << level) for level, items in enumerate(self.compactors) for item in items)
+
+    def quantiles(self, fractions):
+        """
+        Estimate several quantiles in one pass over the retained items.
+
+        Args:
+            fractions (iterable): Quantiles to estimate, between 0 and 1 (e.g., 0.5, 0.9).
+
+        Returns:
+            list: The estimated values, None for an empty sketch.
+        """
+        return weighted_quantiles(self.weighted_items(), fractions)
+
+    def quantile(self, fraction):
+        """
+        Estimate one quantile.
+
+        Args:
+            fraction (float): The quantile, between 0 and 1.
+
+        Returns:
+            float: The estimated value, None for an empty sketch.
+        """
+        return self.quantiles([fraction])[0]
+
+class DistinctCounter:
+    """
+    HyperLogLog estimate of the number of distinct values in a stream, in 2**precision
+    bytes. The standard error is about 1.04 / sqrt(2**precision), i.e. 1.6% at the
+    default precision. Values are hashed with BLAKE2b, so counters built in different
+    processes merge by taking the register-wise maximum.
+
+    Attributes:
+        precision (int): Number of index bits; 4 to 16.
+    """
+
+    def __init__(self, precision=12):
+        if not 4 <= precision <= 16:
+            raise ValueError("Precision must be between 4 and 16")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        digest = blake2b(str(value).encode('utf-8'), digest_size=8).digest()
+        hashed = int.from_bytes(digest, 'big')
+        index = hashed >> (64 - self.precision)
+        remaining_bits = 64 - self.precision
+        rank = remaining_bits - (hashed & ((1 << remaining_bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """
+        Combine another counter with the same precision into this one.
+
+        Args:
+            other (DistinctCounter): Counter over another part of the stream.
+
+        Returns:
+            DistinctCounter: This counter.
+        """
+        if other.precision != self.precision:
+            raise ValueError("Only counters with the same precision can be merged")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        """
+        Estimate the number of distinct values added.
+
+        Returns:
+            int: The estimated distinct count.
+        """
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate while many registers are still empty
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+class SpendStatistics:
+    """
+    Streaming summary of a set of amounts: Welford statistics plus a quantile sketch.
+
+    Attributes:
+        stats (RunningStats): Count, mean and spread.
+        sketch (QuantileSketch): Quantile estimates.
+    """
+
+    def __init__(self, k=200, seed=None):
+        self.stats = RunningStats()
+        self.sketch = QuantileSketch(k, seed)
+
+    def add(self, amount):
+        self.stats.add(amount)
+        self.sketch.add(amount)
+
+    def merge(self, other):
+        self.stats.merge(other.stats)
+        self.sketch.merge(other.sketch)
+        return self
+
+    def summary(self):
+        """
+        Get the summary as plain values.
+
+        Returns:
+            dict: count, total, mean, stddev, min, max, median and p90.
+        """
+        median, p90 = self.sketch.quantiles([0.5, 0.9])
+        return {
+            'count': self.stats.count,
+            'total': self.stats.mean * self.stats.count,
+            'mean': self.stats.mean,
+            'stddev': self.stats.stddev,
+            'min': self.stats.minimum,
+            'max': self.stats.maximum,
+            'median': median,
+            'p90': p90
+        }
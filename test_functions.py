@@ -1,5 +1,29 @@
+import bisect
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
-from database import register_user, create_connection, authenticate_user, add_transaction, view_transactions  # Import the functions to be tested
+from unittest import mock
+from datetime import datetime
+from batch_reports import run_batch_reports, read_chunked_report
+from benchmarks.synthetic import generate_transactions
+from benchmarks.run import compare_results
+from benchmarks.load import DEFAULT_MIX, run_load_test, parse_mix
+import database
+from database import create_tables, create_budget_table, update_transaction, set_budget, compact_change_log, backfill_category_ids
+from cdc_export import export_changes
+import instrumentation
+from profiling import ActionProfiler
+from currency import FxRateIndex
+from forecasting import CategoryModel, get_spending_model, spending_models
+from archive import archive_year
+from sketches import RunningStats, QuantileSketch, DistinctCounter
+from database import register_user, create_connection, authenticate_user, add_transaction, view_transactions, delete_transaction  # Import the functions to be tested
 
 # Base class to set up the test database
 class BaseTestCase(unittest.TestCase):
@@ -109,6 +133,920 @@ class TestTransactionFunctions(BaseTestCase):
         self.assertEqual(len(transactions), 1)  # Should have exactly 1 transaction
         self.assertEqual(transactions[0][0], 100)  # Amount should be 100 (index 0 for amount)
 
+class FileLedgerTestCase(unittest.TestCase):
+    """
+    Base test case class that sets up a small file-backed database, for features
+    that open their own connections.
+    """
+
+    def setUp(self):
+        """
+        Create a temporary database with two users, some transactions and a budget.
+        """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmp_dir.name, 'finance.db')
+        self.previous_db = database.DATABASE_FILE
+        database.DATABASE_FILE = self.db_file
+        create_tables()
+        create_budget_table()
+        conn = sqlite3.connect(self.db_file)
+        today = datetime.now().strftime("%Y-%m-01")
+        conn.executemany("INSERT INTO users (username, password) VALUES (?, ?)", [('alice', 'x'), ('bob', 'y')])
+        conn.executemany("INSERT INTO transactions (user_id, amount, category, type, date) VALUES (?, ?, ?, ?, ?)",
+                         [(1, 1000, 'Salary', 'income', today), (1, 300, 'Food', 'expense', today),
+                          (2, 50, 'Food', 'expense', today)])
+        conn.execute("INSERT INTO budgets (user_id, category, amount, period) VALUES (1, 'Food', 200, 'monthly')")
+        conn.commit()
+        backfill_category_ids(conn)
+        conn.close()
+
+    def tearDown(self):
+        database.DATABASE_FILE = self.previous_db
+        self.tmp_dir.cleanup()
+
+class TestBatchReports(FileLedgerTestCase):
+    """
+    Test case class for the parallel batch report job.
+    """
+
+    def test_batch_reports_jsonl(self):
+        """
+        Every user gets one report row with income, expense and budget status.
+        """
+        summary = run_batch_reports(self.db_file, self.tmp_dir.name, workers=2, chunk_size=1, verbose=False)
+        self.assertEqual(summary['users'], 2)
+        with open(summary['output_path']) as f:
+            rows = {row['user_id']: row for row in map(json.loads, f)}
+        self.assertEqual(rows[1]['monthly_income'], 1000)
+        self.assertEqual(rows[1]['monthly_expense'], 300)
+        self.assertTrue(rows[1]['monthly_budgets'][0]['exceeded'])
+        self.assertEqual(rows[2]['yearly_expense'], 50)
+        self.assertNotIn('monthly_category_stats', rows[1])
+        self.assertIsNone(summary['category_statistics'])
+
+    def test_batch_reports_statistics(self):
+        """
+        With statistics, rows get per-category expense statistics and the ledger-wide
+        summary is merged from every user.
+        """
+        summary = run_batch_reports(self.db_file, self.tmp_dir.name, workers=2, chunk_size=1, verbose=False,
+                                    statistics=True)
+        with open(summary['output_path']) as f:
+            rows = {row['user_id']: row for row in map(json.loads, f)}
+        self.assertEqual(rows[1]['monthly_category_stats']['Food']['median'], 300)
+        food = summary['category_statistics']['Food']
+        self.assertEqual((food['count'], food['total'], food['users']), (2, 350, 2))
+
+    def test_batch_reports_chunked(self):
+        """
+        The chunked output reads back into the same rows.
+        """
+        summary = run_batch_reports(self.db_file, self.tmp_dir.name, workers=1, output_format='chunked', verbose=False)
+        rows = read_chunked_report(summary['output_path'])
+        self.assertEqual(sorted(row['user_id'] for row in rows), [1, 2])
+
+class TestBenchmarkSuite(unittest.TestCase):
+    """
+    Test case class for the synthetic data generator and benchmark comparison.
+    """
+
+    def test_generator_is_deterministic(self):
+        """
+        The same seed always produces the same ledger.
+        """
+        first = list(generate_transactions(500, 10, seed=7))
+        second = list(generate_transactions(500, 10, seed=7))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, list(generate_transactions(500, 10, seed=8)))
+        self.assertTrue(all(1 <= row[0] <= 10 and row[1] > 0 for row in first))
+
+    def test_compare_flags_regressions(self):
+        """
+        Operations slower than the threshold are flagged; others are not.
+        """
+        baseline = {'results': {'10000': {'get_report_monthly': {'median': 1.0}, 'set_budget': {'median': 1.0}}}}
+        current = {'results': {'10000': {'get_report_monthly': {'median': 1.5}, 'set_budget': {'median': 1.05}}}}
+        flags = {item['operation']: item['regression'] for item in compare_results(baseline, current, 0.10)}
+        self.assertEqual(flags, {'get_report_monthly': True, 'set_budget': False})
+
+class TestQueryInstrumentation(unittest.TestCase):
+    """
+    Test case class for the instrumented connection and slow-query log.
+    """
+
+    def setUp(self):
+        instrumentation.query_stats.reset()
+        instrumentation.enable(slow_query_ms=1000)
+
+    def tearDown(self):
+        instrumentation.disable()
+        instrumentation.query_stats.reset()
+
+    def test_statement_stats(self):
+        """
+        Calls and fetched rows are counted per normalized statement.
+        """
+        conn = create_connection(':memory:')
+        self.assertIsInstance(conn, instrumentation.InstrumentedConnection)
+        cursor = conn.cursor()
+        cursor.execute("CREATE TABLE t (x INTEGER)")
+        cursor.executemany("INSERT INTO t VALUES (?)", [(1,), (2,), (3,)])
+        for _ in range(2):
+            cursor.execute("SELECT x   FROM t\n WHERE x > ?", (1,))
+            cursor.fetchall()
+        conn.close()
+        stats = {entry['sql']: entry for entry in instrumentation.query_stats.snapshot()['statements']}
+        select = stats['SELECT x FROM t WHERE x > ?']
+        self.assertEqual(select['calls'], 2)
+        self.assertEqual(select['rows'], 4)
+        self.assertEqual(sum(select['histogram']), 2)
+
+    def test_slow_query_logged_with_plan(self):
+        """
+        Statements over the threshold are logged together with their query plan.
+        """
+        instrumentation.enable(slow_query_ms=0)
+        conn = create_connection(':memory:')
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        with self.assertLogs('finance.slow_query', level='WARNING') as logs:
+            conn.execute("SELECT * FROM t WHERE x = ?", (1,)).fetchall()
+        conn.close()
+        self.assertIn("SCAN t", logs.output[-1])
+
+    def test_disabled_returns_plain_connection(self):
+        """
+        With instrumentation disabled connections are plain sqlite3 connections.
+        """
+        instrumentation.disable()
+        conn = create_connection(':memory:')
+        self.assertIs(type(conn), sqlite3.Connection)
+        conn.close()
+
+    def test_export_registered_once(self):
+        """
+        Enabling repeatedly registers one exit hook, which writes the last export path.
+        """
+        with mock.patch.object(instrumentation, 'export_registered', False), \
+                mock.patch.object(instrumentation, 'EXPORT_PATH', None), \
+                mock.patch('atexit.register') as register:
+            instrumentation.enable(export_path='first.json')
+            instrumentation.enable(export_path='second.json')
+            self.assertEqual(register.call_count, 1)
+            with mock.patch.object(instrumentation, 'export_stats') as export_stats:
+                register.call_args.args[0]()
+            export_stats.assert_called_once_with('second.json')
+
+    def test_run_command_exports_stats(self):
+        """
+        The command line runs a script with instrumentation on and writes its statistics.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            script = os.path.join(tmp_dir, 'queries.py')
+            with open(script, 'w') as f:
+                f.write("import database\nconn = database.create_connection(':memory:')\n"
+                        "conn.execute('SELECT 1 + 1').fetchall()\n")
+            output = os.path.join(tmp_dir, 'stats.json')
+            subprocess.run([sys.executable, os.path.abspath(instrumentation.__file__), 'run', '--output', output,
+                            script], check=True, capture_output=True, cwd=tmp_dir,
+                           env={**os.environ, 'PYTHONPATH': os.path.dirname(os.path.abspath(database.__file__))})
+            with open(output) as f:
+                stats = json.load(f)
+        self.assertIn('SELECT 1 + 1', [entry['sql'] for entry in stats['statements']])
+
+class TestActionProfiler(unittest.TestCase):
+    """
+    Test case class for the per-action profiler behind the --profile option.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_profiled_action_writes_reports(self):
+        """
+        A profiled action returns its result and leaves a profile, a hotspot report and a summary line.
+        """
+        profiler = ActionProfiler(self.tmp_dir.name, top=5)
+        result = profiler.run('view report', lambda n: sum(range(n)), 1000)
+        self.assertEqual(result, sum(range(1000)))
+        files = sorted(os.listdir(self.tmp_dir.name))
+        self.assertEqual(files, ['0001_view_report.prof', '0001_view_report.txt', 'profile_summary.jsonl'])
+        with open(os.path.join(self.tmp_dir.name, 'profile_summary.jsonl')) as f:
+            summary = json.loads(f.readline())
+        self.assertEqual(summary['action'], 'view report')
+        self.assertGreater(summary['memory_peak_bytes'], 0)
+
+    def test_new_session_continues_numbering(self):
+        """
+        A second profiler on the same directory does not overwrite the first session's profiles.
+        """
+        ActionProfiler(self.tmp_dir.name).run('view report', lambda: None)
+        ActionProfiler(self.tmp_dir.name).run('view report', lambda: None)
+        files = sorted(name for name in os.listdir(self.tmp_dir.name) if name.endswith('.prof'))
+        self.assertEqual(files, ['0001_view_report.prof', '0002_view_report.prof'])
+        with open(os.path.join(self.tmp_dir.name, 'profile_summary.jsonl')) as f:
+            self.assertEqual([json.loads(line)['profile'] for line in f], files)
+
+    def test_sampling_skips_actions(self):
+        """
+        With a zero sample rate actions still run but nothing is written.
+        """
+        profiler = ActionProfiler(self.tmp_dir.name, sample_rate=0.0)
+        self.assertEqual(profiler.run('noop', lambda: 42), 42)
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+
+class TestReadOptimizedMode(FileLedgerTestCase):
+    """
+    Test case class for the read-optimized connection mode.
+    """
+
+    def tearDown(self):
+        database.set_read_optimized(False)
+        super().tearDown()
+
+    def test_reports_share_tuned_readonly_connection(self):
+        """
+        Reads reuse one query-only connection and return the same results as the default mode.
+        """
+        expected = database.get_report(1, 'monthly')
+        database.set_read_optimized(True)
+        self.assertEqual(database.get_report(1, 'monthly'), expected)
+        self.assertEqual(database.get_budget_status(1)[0]['total_expenses'], 300)
+        conn = database.get_read_connection()
+        self.assertIs(conn, database.get_read_connection())
+        self.assertEqual(conn.execute("PRAGMA query_only").fetchone()[0], 1)
+        self.assertEqual(conn.execute("PRAGMA temp_store").fetchone()[0], 2)
+        with self.assertRaises(sqlite3.OperationalError):
+            conn.execute("DELETE FROM transactions")
+
+class TestChangeDataCapture(FileLedgerTestCase):
+    """
+    Test case class for the change log and the incremental NDJSON exporter.
+    """
+
+    def read_export(self, path):
+        with open(path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_category_backfill_is_logged(self):
+        """
+        Rows linked to categories by the backfill appear as updates carrying their new category_id.
+        """
+        changes = self.read_export(export_changes(os.path.join(self.tmp_dir.name, 'exports'))['path'])
+        self.assertEqual([(c['table'], c['operation']) for c in changes],
+                         [('transactions', 'update')] * 3 + [('budgets', 'update')])
+        self.assertTrue(all(c['data']['category_id'] for c in changes))
+        self.assertEqual(sorted(c['data']['amount'] for c in changes[:3]), [50, 300, 1000])
+
+    def test_incremental_export(self):
+        """
+        Each export contains only the changes made since the previous export, in sequence order.
+        """
+        export_dir = os.path.join(self.tmp_dir.name, 'exports')
+        export_changes(export_dir)  # The fixture's category backfill
+        conn = create_connection(self.db_file)
+        add_transaction(conn, 1, 'expense', 20, 'Lunch', 'Food')
+        set_budget(1, 'Food', 250)
+        first = export_changes(export_dir)
+        changes = self.read_export(first['path'])
+        self.assertEqual([(c['table'], c['operation']) for c in changes],
+                         [('transactions', 'insert'), ('budgets', 'update')])
+        self.assertEqual(changes[1]['data']['amount'], 250)
+
+        update_transaction(changes[0]['row_id'], 25, 'Food', 'expense')
+        delete_transaction(conn, changes[0]['row_id'], 1)
+        conn.close()
+        second = export_changes(export_dir)
+        changes = self.read_export(second['path'])
+        self.assertEqual([c['operation'] for c in changes], ['update', 'delete'])
+        self.assertGreater(changes[0]['seq'], first['last_seq'])
+        self.assertEqual(export_changes(export_dir)['changes'], 0)
+
+    def test_compaction_keeps_latest_change_per_row(self):
+        """
+        Compaction collapses each row's history to its latest entry, or purges it entirely.
+        """
+        for amount in (100, 200, 300):
+            set_budget(2, 'Rent', amount)
+        conn = create_connection(self.db_file)
+        last_seq = conn.execute("SELECT MAX(seq) FROM change_log").fetchone()[0]
+        self.assertEqual(compact_change_log(last_seq), 2)
+        rent = [change['data']['amount'] for change in database.iter_changes(conn)
+                if change['data']['category'] == 'Rent']
+        self.assertEqual(rent, [300])
+        self.assertEqual(compact_change_log(last_seq, purge=True), 5)  # Including the fixture's backfill
+        self.assertEqual(list(database.iter_changes(conn)), [])
+        conn.close()
+
+class TestDailyBalances(FileLedgerTestCase):
+    """
+    Test case class for the incrementally maintained daily running balances.
+    """
+
+    def balances_from_scratch(self, user_id, dates):
+        """
+        Compute balances with a full SUM over the transactions, for comparison.
+        """
+        conn = create_connection(self.db_file)
+        balances = [conn.execute('''SELECT COALESCE(SUM(CASE type WHEN 'income' THEN amount ELSE -amount END), 0)
+                                    FROM transactions WHERE user_id = ? AND date <= ?''', (user_id, date)).fetchone()[0]
+                    for date in dates]
+        conn.close()
+        return balances
+
+    def test_backdated_writes_keep_balances_consistent(self):
+        """
+        Inserts, backdated inserts, updates and deletes all leave every balance equal to a full recomputation.
+        """
+        conn = create_connection(self.db_file)
+        database.rebuild_daily_balances(conn)
+        month = datetime.now().strftime("%Y-%m")
+        add_transaction(conn, 1, 'expense', 40, 'Taxi', 'Transport', '2024-03-10')
+        add_transaction(conn, 1, 'income', 500, 'Bonus', 'Salary', '2024-01-05')
+        add_transaction(conn, 1, 'expense', 60, 'Dinner', 'Food', '2024-03-10')
+        transaction_id = conn.execute("SELECT MAX(id) FROM transactions").fetchone()[0]
+        update_transaction(transaction_id, 80, 'Food', 'expense')
+        delete_transaction(conn, transaction_id - 2, 1)
+        conn.close()
+
+        dates = ['2023-12-31', '2024-01-05', '2024-03-09', '2024-03-10', f"{month}-01", '2099-01-01']
+        self.assertEqual([database.get_balance_at(1, date) for date in dates], self.balances_from_scratch(1, dates))
+        self.assertEqual(database.get_balance_at(1, '2024-03-10'), 420)
+        self.assertEqual(database.get_balance_at(2, '2099-01-01'), -50)
+
+    def test_balance_series(self):
+        """
+        A series starts with the opening balance followed by one point per active date.
+        """
+        conn = create_connection(self.db_file)
+        add_transaction(conn, 2, 'income', 100, 'Gift', 'Gift', '2024-02-01')
+        add_transaction(conn, 2, 'expense', 30, 'Food', 'Food', '2024-02-15')
+        add_transaction(conn, 2, 'expense', 5, 'Food', 'Food', '2024-04-01')
+        conn.close()
+        self.assertEqual(database.get_balance_series(2, '2024-02-10', '2024-03-31'),
+                         [('2024-02-10', 100), ('2024-02-15', 70)])
+
+class TestMultiCurrency(FileLedgerTestCase):
+    """
+    Test case class for FX rate lookups and base-currency reports.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.rates_csv = os.path.join(self.tmp_dir.name, 'rates.csv')
+        with open(self.rates_csv, 'w') as f:
+            f.write("date,currency,rate\n2020-01-01,EUR,1.10\n2024-01-01,EUR,1.20\n2020-01-01,GBP,1.25\n")
+        database.load_fx_rates(self.rates_csv)
+
+    def test_rate_index_lookups(self):
+        """
+        Rates apply from their date until the next one; the sort-merge conversion agrees with bisect lookups.
+        """
+        index = FxRateIndex([('EUR', '2024-01-01', 1.2), ('EUR', '2020-01-01', 1.1)])
+        self.assertEqual(index.rate_at('EUR', '2023-12-31'), 1.1)
+        self.assertEqual(index.rate_at('EUR', '2024-06-01'), 1.2)
+        self.assertEqual(index.rate_at('EUR', '2019-01-01'), 1.1)
+        self.assertEqual(index.rate_at('USD', '2024-06-01'), 1.0)
+        with self.assertRaises(ValueError):
+            index.rate_at('JPY', '2024-06-01')
+        groups = [('a', 'EUR', '2024-02-01', 10), ('a', 'EUR', '2021-02-01', 10), ('b', 'USD', '2024-02-01', 5)]
+        totals = index.convert_totals(groups, 'EUR')
+        self.assertAlmostEqual(totals['a'], 10 * 1.2 / 1.2 + 10 * 1.1 / 1.1)
+        self.assertAlmostEqual(totals['b'], 5 / 1.2)
+
+    def test_report_converts_to_base_currency(self):
+        """
+        Reports and budget statuses sum mixed-currency transactions in the user's base currency.
+        """
+        today = datetime.now().strftime("%Y-%m-%d")
+        conn = create_connection(self.db_file)
+        add_transaction(conn, 2, 'expense', 100, 'Hotel', 'Food', today, 'EUR')
+        add_transaction(conn, 2, 'income', 80, 'Refund', 'Gift', today, 'GBP')
+        conn.close()
+        report = database.get_report(2, 'monthly')
+        self.assertEqual(report['currency'], 'USD')
+        self.assertAlmostEqual(report['expense'], 50 + 120)
+        self.assertAlmostEqual(report['income'], 100)
+        self.assertAlmostEqual(database.get_total_expenses(2, 'monthly'), 50 + 120)
+
+        database.set_base_currency(2, 'EUR')
+        set_budget(2, 'Food', 100)
+        report = database.get_report(2, 'monthly')
+        self.assertEqual(report['currency'], 'EUR')
+        self.assertAlmostEqual(report['expense'], 50 / 1.2 + 100)
+        self.assertAlmostEqual(database.get_budget_status(2)[0]['total_expenses'], 50 / 1.2 + 100)
+
+    def test_balances_in_base_currency(self):
+        """
+        Daily balances convert foreign transactions and follow a change of base currency.
+        """
+        today = datetime.now().strftime("%Y-%m-%d")
+        conn = create_connection(self.db_file)
+        add_transaction(conn, 2, 'expense', 100, 'Hotel', 'Travel', today, 'EUR')
+        add_transaction(conn, 2, 'income', 80, 'Refund', 'Gift', today, 'GBP')
+        conn.close()
+        self.assertAlmostEqual(database.get_balance_at(2, today), -50 - 120 + 100)
+
+        database.set_base_currency(2, 'EUR')
+        self.assertAlmostEqual(database.get_balance_at(2, today), -50 / 1.2 - 100 + 100 / 1.2)
+        conn = create_connection(self.db_file)
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM transactions WHERE user_id = 2 AND currency = 'EUR'")
+        delete_transaction(conn, cursor.fetchone()[0], 2)
+        conn.close()
+        self.assertAlmostEqual(database.get_balance_at(2, today), -50 / 1.2 + 100 / 1.2)
+
+    def test_rate_index_cache_sees_updates(self):
+        """
+        The cached index is rebuilt after a rate is updated in place, and in-memory databases do not share one.
+        """
+        conn = create_connection(self.db_file)
+        self.assertEqual(database.get_fx_index(conn).rate_at('EUR', '2024-06-01'), 1.2)
+        conn.execute("UPDATE fx_rates SET rate = 1.3 WHERE currency = 'EUR' AND date = '2024-01-01'")
+        conn.commit()
+        self.assertEqual(database.get_fx_index(conn).rate_at('EUR', '2024-06-01'), 1.3)
+        conn.close()
+
+        memory_indexes = []
+        for rate in (2.0, 3.0):
+            conn = sqlite3.connect(':memory:')
+            conn.execute("CREATE TABLE fx_rates (currency TEXT, date TEXT, rate REAL)")
+            conn.execute("CREATE TABLE fx_rates_version (version INTEGER)")
+            conn.execute("INSERT INTO fx_rates_version VALUES (1)")
+            conn.execute("INSERT INTO fx_rates VALUES ('EUR', '2020-01-01', ?)", (rate,))
+            memory_indexes.append((conn, database.get_fx_index(conn)))
+        self.assertEqual([index.rate_at('EUR', '2024-01-01') for _, index in memory_indexes], [2.0, 3.0])
+        for conn, _ in memory_indexes:
+            conn.close()
+
+    def test_unknown_currency_writes_nothing(self):
+        """
+        A transaction in a currency without FX rates is rejected before anything is written.
+        """
+        conn = create_connection(self.db_file)
+        logged = conn.execute("SELECT COUNT(*) FROM change_log").fetchone()[0]
+        with self.assertRaises(ValueError):
+            add_transaction(conn, 2, 'expense', 100, 'Sushi', 'Food', None, 'JPY')
+        conn.commit()
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM transactions WHERE currency = 'JPY'").fetchone()[0], 0)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM change_log").fetchone()[0], logged)
+        conn.close()
+
+class TestForecasting(FileLedgerTestCase):
+    """
+    Test case class for spend forecasts and anomaly detection.
+    """
+
+    def tearDown(self):
+        spending_models.clear()
+        super().tearDown()
+
+    def test_anomalies_and_incremental_refresh(self):
+        """
+        Outliers get flagged by robust z-score, and only new transactions are fitted on refresh.
+        """
+        conn = create_connection(self.db_file)
+        for day, amount in enumerate([20, 22, 19, 25, 21, 23, 18, 24], start=1):
+            add_transaction(conn, 2, 'expense', amount, 'Lunch', 'Dining', f"2024-05-{day:02d}")
+        model = get_spending_model(2, conn)
+        self.assertEqual(model.anomalies(), [])
+
+        add_transaction(conn, 2, 'expense', 400, 'Banquet', 'Dining', '2024-05-20')
+        self.assertEqual(model.refresh(conn), 1)
+        flagged = model.anomalies()
+        self.assertEqual([item[2] for item in flagged], [400])
+        self.assertGreater(flagged[0][4], 3.5)
+
+        # Deleting an earlier transaction forces a full refit
+        delete_transaction(conn, model.transactions[-1][0], 2)
+        self.assertEqual(model.refresh(conn), len(model.transactions))
+        self.assertEqual(model.anomalies(), [])
+        conn.close()
+
+    def test_refresh_sees_recategorised_and_foreign_expenses(self):
+        """
+        Updates that keep the amount are picked up from the change log, and amounts are in the base currency.
+        """
+        with open(os.path.join(self.tmp_dir.name, 'rates.csv'), 'w') as f:
+            f.write("date,currency,rate\n2020-01-01,JPY,0.01\n")
+        database.load_fx_rates(os.path.join(self.tmp_dir.name, 'rates.csv'))
+        conn = create_connection(self.db_file)
+        for day, amount in enumerate([40, 45, 50, 42, 48], start=1):
+            add_transaction(conn, 2, 'expense', amount, 'Dinner', 'Dining', f"2024-05-{day:02d}")
+        add_transaction(conn, 2, 'expense', 5000, 'Ramen', 'Dining', '2024-05-06', 'JPY')
+        conn.close()
+        model = get_spending_model(2)
+        self.assertEqual(model.transactions[-1][2], 50)
+        self.assertEqual(model.anomalies(), [])
+
+        dinner_id = next(item[0] for item in model.transactions if item[1] == 'Dining')
+        update_transaction(dinner_id, 40, 'Travel', 'expense')
+        model = get_spending_model(2)
+        self.assertEqual(model.categories['Travel'].monthly_totals, {(2024, 5): 40})
+        self.assertEqual(model.categories['Dining'].sketch.count, 5)
+
+    def test_sketched_fit_and_bounded_model_cache(self):
+        """
+        Large categories are fitted from the sketch close to the exact median and MAD; the model cache is an LRU.
+        """
+        rng = random.Random(3)
+        amounts = [round(rng.lognormvariate(3, 0.5), 2) for _ in range(20000)]
+        model = CategoryModel()
+        for amount in amounts:
+            model.add(amount, '2024-05-01')
+        model.refit()
+        amounts.sort()
+        median = amounts[len(amounts) // 2]
+        mad = sorted(abs(amount - median) for amount in amounts)[len(amounts) // 2]
+        self.assertLess(abs(model.median - median) / median, 0.03)
+        self.assertLess(abs(model.mad - mad) / mad, 0.05)
+
+        with mock.patch('forecasting.SPENDING_MODEL_CACHE_SIZE', 1):
+            first = get_spending_model(1)
+            get_spending_model(2)
+            self.assertEqual(list(spending_models), [(self.db_file, 2)])
+            self.assertIsNot(get_spending_model(1), first)
+
+    def test_monthly_forecast_blends_trajectory_and_history(self):
+        """
+        Early in the month the forecast leans on earlier months; with no history it extrapolates.
+        """
+        conn = create_connection(self.db_file)
+        add_transaction(conn, 2, 'expense', 300, 'Groceries', 'Groceries', '2023-06-15')
+        add_transaction(conn, 2, 'expense', 10, 'Groceries', 'Groceries', '2024-06-03')
+        add_transaction(conn, 2, 'expense', 30, 'Bus', 'Transport', '2024-06-03')
+        conn.close()
+        forecasts = get_spending_model(2).forecast('monthly', today=datetime(2024, 6, 6))
+        progress = 6 / 30
+        self.assertAlmostEqual(forecasts['Groceries']['projected'], progress * (10 / progress) + (1 - progress) * 300)
+        self.assertAlmostEqual(forecasts['Transport']['projected'], 30 / progress)
+
+class TestArchiveTiering(FileLedgerTestCase):
+    """
+    Test case class for moving closed years into the archive database.
+    """
+
+    def setUp(self):
+        super().setUp()
+        conn = create_connection(self.db_file)
+        add_transaction(conn, 1, 'income', 900, 'Salary', 'Salary', '2022-03-01')
+        add_transaction(conn, 1, 'expense', 150, 'Groceries', 'Food', '2022-03-05')
+        add_transaction(conn, 1, 'expense', 40, 'Taxi', 'Transport', '2023-01-10')
+        conn.close()
+        self.archive_dir = os.path.join(self.tmp_dir.name, 'archive')
+
+    def attached_databases(self, conn):
+        return [row[1] for row in conn.execute("PRAGMA database_list").fetchall()]
+
+    def test_archived_year_leaves_hot_database(self):
+        """
+        Archiving moves a year's rows out of the hot table and keeps monthly rollups and balances.
+        """
+        balance_before = database.get_balance_at(1, '2023-12-31')
+        result = archive_year(2022, self.archive_dir)
+        self.assertEqual(result['rows'], 2)
+        conn = create_connection(self.db_file)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM transactions WHERE date LIKE '2022%'").fetchone()[0], 0)
+        rollup = conn.execute("SELECT type, total, count FROM transactions_rollup WHERE year = 2022 ORDER BY type").fetchall()
+        self.assertEqual(rollup, [('expense', 150, 1), ('income', 900, 1)])
+        logged_years = [change['data']['date'][:4] for change in database.iter_changes(conn)
+                        if change['table'] == 'transactions']
+        self.assertNotIn('2022', logged_years)
+        self.assertIn('2023', logged_years)
+        conn.execute("ATTACH DATABASE ? AS archive", (result['path'],))
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM archive.change_log").fetchone()[0], 2)
+        conn.close()
+        self.assertEqual(database.get_balance_at(1, '2023-12-31'), balance_before)
+        with self.assertRaises(ValueError):
+            archive_year(2022, self.archive_dir)
+        with self.assertRaises(ValueError):
+            archive_year(datetime.now().year, self.archive_dir)
+
+    def test_queries_union_archives_only_when_needed(self):
+        """
+        Reads covering an archived year include its rows; reads that do not leave the archive closed.
+        """
+        archive_year(2022, self.archive_dir)
+        conn = create_connection(self.db_file)
+        recent = view_transactions(conn, 1, start_date='2023-01-01')
+        self.assertIn(40, [row[1] for row in recent])
+        self.assertNotIn(150, [row[1] for row in recent])
+        self.assertEqual(self.attached_databases(conn), ['main'])
+
+        everything = view_transactions(conn, 1)
+        self.assertEqual(len(everything), 5)
+        self.assertEqual(self.attached_databases(conn), ['main', 'archive'])
+        conn.close()
+
+        report = database.get_report(1, 'yearly', year=2022)
+        self.assertEqual((report['income'], report['expense']), (900, 150))
+
+    def test_many_archived_years_share_one_attachment(self):
+        """
+        More archived years than SQLite's attachment limit can still be read together, with their categories.
+        """
+        conn = create_connection(self.db_file)
+        for year in range(2010, 2022):
+            add_transaction(conn, 1, 'expense', 10, 'Snack', 'Food > Snacks', f"{year}-06-01")
+        conn.close()
+        for year in range(2010, 2023):
+            archive_year(year, self.archive_dir)
+
+        conn = create_connection(self.db_file)
+        self.assertEqual(len(view_transactions(conn, 1)), 2 + 3 + 12)
+        database.rebuild_daily_balances(conn)
+        self.assertEqual([name for name in self.attached_databases(conn) if name.startswith('archive')], ['archive'])
+        category_ids = conn.execute('''SELECT DISTINCT category_id FROM archive.transactions_2015
+                                       WHERE category = 'Food > Snacks' ''').fetchall()
+        self.assertNotIn((None,), category_ids)
+        conn.close()
+        self.assertEqual(database.get_balance_at(1, '2021-12-31'), -120)
+
+    def test_backups_include_archived_years(self):
+        """
+        The SQL backup dumps the archive database alongside, and the PDF lists archived transactions.
+        """
+        archive_year(2022, self.archive_dir)
+        backup_file = os.path.join(self.tmp_dir.name, 'backup.sql')
+        database.backup_data(backup_file)
+        with open(os.path.join(self.tmp_dir.name, 'backup.archive.sql')) as f:
+            archive_dump = f.read()
+        self.assertIn('CREATE TABLE transactions_2022', archive_dump)
+        self.assertIn(',150.0,', archive_dump)
+
+        with mock.patch.object(database.canvas.Canvas, 'drawString', autospec=True) as draw_string:
+            database.generate_backup_pdf(os.path.join(self.tmp_dir.name, 'backup.pdf'))
+        lines = [call.args[3] for call in draw_string.call_args_list]
+        self.assertTrue(any('Amount: 150.0' in line and 'Date: 2022-03-05' in line for line in lines))
+
+class TestCategoryHierarchy(FileLedgerTestCase):
+    """
+    Test case class for hierarchical categories and subtree totals.
+    """
+
+    def setUp(self):
+        super().setUp()
+        today = datetime.now().strftime("%Y-%m-%d")
+        conn = create_connection(self.db_file)
+        add_transaction(conn, 1, 'expense', 80, 'Market', 'Food > Groceries', today)
+        add_transaction(conn, 1, 'expense', 20, 'Apples', 'Food>Groceries>Produce ', today)
+        add_transaction(conn, 1, 'expense', 45, 'Bus pass', 'Transport', today)
+        conn.close()
+
+    def test_closure_links_every_ancestor(self):
+        """
+        Each category descends from itself and all of its ancestors, with their depths.
+        """
+        conn = create_connection(self.db_file)
+        rows = conn.execute('''SELECT a.path, cc.depth FROM category_closure AS cc
+                                JOIN categories AS a ON a.id = cc.ancestor_id
+                                JOIN categories AS d ON d.id = cc.descendant_id
+                                WHERE d.path = 'Food > Groceries > Produce' ORDER BY cc.depth''').fetchall()
+        conn.close()
+        self.assertEqual(rows, [('Food > Groceries > Produce', 0), ('Food > Groceries', 1), ('Food', 2)])
+
+    def test_rollup_and_budgets_cover_subcategories(self):
+        """
+        Subtree totals and parent budgets include every subcategory's expenses.
+        """
+        self.assertEqual(database.get_category_rollup(1, 'Food'), {'expense': 400})
+        self.assertEqual(database.get_category_rollup(1, 'Food > Groceries'), {'expense': 100})
+        self.assertEqual(database.get_category_rollup(2, 'Food > Groceries'), {})
+
+        set_budget(1, 'Food > Groceries', 90)
+        statuses = {status['category']: status for status in database.get_budget_status(1)}
+        self.assertEqual(statuses['Food']['total_expenses'], 400)
+        self.assertEqual(statuses['Food > Groceries']['total_expenses'], 100)
+        self.assertTrue(statuses['Food > Groceries']['exceeded'])
+        self.assertEqual(sorted(database.get_category_subtrees(['Food > Groceries'])['Food > Groceries']),
+                         ['Food > Groceries', 'Food > Groceries > Produce'])
+
+    def test_rollup_includes_archives_and_converts_currency(self):
+        """
+        Subtree totals cover archived years and are in the user's base currency.
+        """
+        with open(os.path.join(self.tmp_dir.name, 'rates.csv'), 'w') as f:
+            f.write("date,currency,rate\n2020-01-01,EUR,1.5\n")
+        database.load_fx_rates(os.path.join(self.tmp_dir.name, 'rates.csv'))
+        conn = create_connection(self.db_file)
+        add_transaction(conn, 1, 'expense', 10, 'Bakery', 'Food > Groceries', '2020-03-01')
+        add_transaction(conn, 1, 'expense', 20, 'Market', 'Food > Groceries', '2020-04-01', 'EUR')
+        conn.close()
+        archive_year(2020, os.path.join(self.tmp_dir.name, 'archive'))
+        self.assertEqual(database.get_category_rollup(1, 'Food', '2020-01-01', '2020-12-31'), {'expense': 40})
+
+    def test_categories_ignore_case(self):
+        """
+        Category text that only differs in case is stored as the first spelling.
+        """
+        conn = create_connection(self.db_file)
+        add_transaction(conn, 1, 'expense', 5, 'Snack', 'food > groceries', datetime.now().strftime("%Y-%m-%d"))
+        categories = conn.execute("SELECT path FROM categories WHERE path LIKE 'food%' ORDER BY path").fetchall()
+        last = conn.execute("SELECT category FROM transactions ORDER BY id DESC LIMIT 1").fetchone()[0]
+        conn.close()
+        self.assertEqual(categories, [('Food',), ('Food > Groceries',), ('Food > Groceries > Produce',)])
+        self.assertEqual(last, 'Food > Groceries')
+        self.assertEqual(database.get_category_rollup(1, 'FOOD'), {'expense': 405})
+        self.assertEqual(database.get_category_subtrees(['food'])['food'],
+                         ['Food', 'Food > Groceries', 'Food > Groceries > Produce'])
+
+    def test_case_duplicates_are_merged(self):
+        """
+        A categories table from before case-insensitive paths is rebuilt with 'food'
+        merged into 'Food', and the affected rows relinked and logged.
+        """
+        conn = create_connection(self.db_file)
+        conn.executescript('''DROP TABLE categories;
+                              CREATE TABLE categories (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL,
+                                                       parent_id INTEGER REFERENCES categories(id),
+                                                       path TEXT NOT NULL UNIQUE);
+                              DELETE FROM category_closure;
+                              UPDATE transactions SET category_id = NULL;
+                              UPDATE budgets SET category_id = NULL;''')
+        conn.executemany("INSERT INTO transactions (user_id, amount, category, type, date) VALUES (?, ?, ?, ?, ?)",
+                         [(1, 7, 'food', 'expense', '2024-01-02'), (1, 3, 'food > Snacks', 'expense', '2024-01-03')])
+        cursor = conn.cursor()
+        for path in ('Food', 'food', 'food > Snacks'):
+            category_id = database.get_or_create_category(cursor, path)
+            cursor.execute("UPDATE transactions SET category_id = ? WHERE category = ?", (category_id, path))
+        conn.commit()
+        last_seq = conn.execute("SELECT MAX(seq) FROM change_log").fetchone()[0]
+        conn.close()
+
+        database.create_categories_table()
+        conn = create_connection(self.db_file)
+        categories = conn.execute("SELECT id, path, parent_id FROM categories ORDER BY id").fetchall()
+        texts = conn.execute("SELECT category FROM transactions WHERE date = '2024-01-02' OR date = '2024-01-03' ORDER BY date").fetchall()
+        logged = conn.execute('''SELECT json_extract(data, '$.category') FROM change_log
+                                 WHERE seq > ? AND json_extract(data, '$.amount') IN (7, 3)''', (last_seq,)).fetchall()
+        conn.close()
+        self.assertEqual([path for _, path, _ in categories[:2]], ['Food', 'food > Snacks'])
+        self.assertEqual(categories[1][2], categories[0][0])
+        self.assertEqual(texts, [('Food',), ('food > Snacks',)])
+        self.assertEqual(logged, [('Food',)])
+        self.assertEqual(database.get_category_rollup(1, 'Food', '2024-01-01', '2024-01-31'), {'expense': 10})
+
+class TestStreamingSketches(unittest.TestCase):
+    """
+    Test case class for the fixed-memory streaming statistics.
+    """
+
+    def setUp(self):
+        rng = random.Random(5)
+        self.values = [round(rng.lognormvariate(3, 1), 2) for _ in range(100000)]
+
+    def rank_error(self, values_sorted, estimate, fraction):
+        return abs(bisect.bisect_left(values_sorted, estimate) / len(values_sorted) - fraction)
+
+    def test_quantile_sketch_accuracy_and_merge(self):
+        """
+        Median and p90 stay within 2% rank error, in bounded memory, for single and merged sketches.
+        """
+        values_sorted = sorted(self.values)
+        whole = QuantileSketch(seed=1)
+        shards = [QuantileSketch(seed=shard) for shard in range(4)]
+        for i, value in enumerate(self.values):
+            whole.add(value)
+            shards[i % 4].add(value)
+        merged = shards[0]
+        for shard in shards[1:]:
+            merged.merge(shard)
+
+        for sketch in (whole, merged):
+            self.assertEqual(sketch.count, len(self.values))
+            self.assertLess(sketch.size, 3 * sketch.k + 64)
+            for fraction, estimate in zip((0.5, 0.9), sketch.quantiles([0.5, 0.9])):
+                self.assertLess(self.rank_error(values_sorted, estimate, fraction), 0.02)
+
+    def test_running_stats_merge_matches_exact(self):
+        """
+        Merged Welford statistics match the exact mean and variance.
+        """
+        halves = [RunningStats(), RunningStats()]
+        for i, value in enumerate(self.values):
+            halves[i % 2].add(value)
+        stats = halves[0].merge(halves[1])
+        mean = sum(self.values) / len(self.values)
+        variance = sum((value - mean) ** 2 for value in self.values) / (len(self.values) - 1)
+        self.assertAlmostEqual(stats.mean, mean, places=6)
+        self.assertAlmostEqual(stats.variance / variance, 1, places=9)
+        self.assertEqual((stats.minimum, stats.maximum), (min(self.values), max(self.values)))
+
+    def test_distinct_counter_accuracy_and_merge(self):
+        """
+        HyperLogLog counts stay within 5% (about three standard errors) and merging counts the union.
+        """
+        first, second = DistinctCounter(), DistinctCounter()
+        for merchant in range(30000):
+            first.add(f"merchant-{merchant}")
+            first.add(f"merchant-{merchant}")
+        for merchant in range(20000, 50000):
+            second.add(f"merchant-{merchant}")
+        self.assertLess(abs(first.count() - 30000) / 30000, 0.05)
+        self.assertLess(abs(first.merge(second).count() - 50000) / 50000, 0.05)
+
+        small = DistinctCounter()
+        for merchant in range(100):
+            small.add(merchant)
+        self.assertLess(abs(small.count() - 100), 5)
+
+class TestReportingReplica(FileLedgerTestCase):
+    """
+    Test case class for serving reads from a snapshot of the database.
+    """
+
+    def tearDown(self):
+        database.disable_replica()
+        super().tearDown()
+
+    def add_expense(self, amount):
+        conn = create_connection(self.db_file)
+        add_transaction(conn, 1, 'expense', amount, 'Lunch', 'Food')
+        conn.close()
+
+    def test_reads_lag_until_refresh(self):
+        """
+        Reports read the snapshot, which only changes when refreshed.
+        """
+        replica_file = database.enable_replica(os.path.join(self.tmp_dir.name, 'replica.db'), max_staleness=3600)
+        self.assertTrue(os.path.exists(replica_file))
+        self.add_expense(25)
+        self.assertEqual(database.get_report(1)['expense'], 300)
+        self.assertFalse(database.refresh_replica(max_age=3600))
+        self.assertTrue(database.refresh_replica())
+        self.assertEqual(database.get_report(1)['expense'], 325)
+
+    def test_staleness_bound_refreshes_on_read(self):
+        """
+        A replica older than the staleness bound is refreshed before serving a read.
+        """
+        database.enable_replica(os.path.join(self.tmp_dir.name, 'replica.db'), max_staleness=0)
+        self.add_expense(25)
+        time.sleep(0.01)
+        self.assertEqual(database.get_report(1)['expense'], 325)
+        self.assertEqual(database.get_budget_status(1)[0]['total_expenses'], 325)
+
+    def test_reads_do_not_wait_for_a_running_refresh(self):
+        """
+        While a refresh holds the replica lock, reads get the current snapshot; the primary runs in WAL mode.
+        """
+        database.enable_replica(os.path.join(self.tmp_dir.name, 'replica.db'), max_staleness=0)
+        conn = create_connection(self.db_file)
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+        conn.close()
+        self.add_expense(25)
+        with database.replica_lock:
+            self.assertEqual(database.get_report(1)['expense'], 300)
+        self.assertEqual(database.get_report(1)['expense'], 325)
+
+    def test_refresher_picks_up_writes_on_request(self):
+        """
+        A write followed by a refresh request reaches the replica before the next interval.
+        """
+        database.enable_replica(os.path.join(self.tmp_dir.name, 'replica.db'), max_staleness=3600,
+                                refresh_interval=3600)
+        generation = database.replica_state['generation']
+        self.add_expense(25)
+        database.request_replica_refresh()
+        deadline = time.time() + 5
+        while database.replica_state['generation'] == generation and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(database.get_report(1)['expense'], 325)
+
+class TestLoadHarness(FileLedgerTestCase):
+    """
+    Test case class for the concurrent load generator.
+    """
+
+    def test_mixed_workload_summary(self):
+        """
+        A short mixed run completes operations of every kind and reports latency and growth.
+        """
+        mix = {name: 1 for name in DEFAULT_MIX}
+        summary = run_load_test(self.db_file, rate=400, duration=0.5, concurrency=4, mix=mix, verbose=False)
+        self.assertEqual(summary['total']['errors'], 0)
+        self.assertGreater(summary['total']['completed'], 0)
+        self.assertGreater(summary['throughput'], 0)
+        self.assertLessEqual(summary['total']['p50_ms'], summary['total']['p99_ms'])
+        self.assertEqual(summary['growth_bytes'], summary['size_after'] - summary['size_before'])
+        self.assertEqual(database.DATABASE_FILE, self.db_file)
+        self.assertEqual(parse_mix('add_expense=3,report'), {'add_expense': 3.0, 'report': 1.0})
+        with self.assertRaises(ValueError):
+            parse_mix('drop_tables=1')
+
+    def test_first_error_is_kept(self):
+        """
+        Failed operations keep the type and message of their first error.
+        """
+        with mock.patch('database.get_report', side_effect=KeyError('period')):
+            summary = run_load_test(self.db_file, rate=200, duration=0.3, concurrency=2, mix={'report': 1},
+                                    verbose=False)
+        self.assertGreater(summary['operations']['report']['errors'], 0)
+        self.assertEqual(summary['operations']['report']['first_error'], "KeyError: 'period'")
+        self.assertEqual(summary['total']['first_error'], "KeyError: 'period'")
+
 # Run the tests
 if __name__ == "__main__":
     unittest.main()